@@ -5,9 +5,13 @@ import os
 import io
 import re
 import json
+import time
+import hashlib
 import secrets
+import tempfile
+import threading
+import multiprocessing
 import unicodedata
-from openpyxl import load_workbook
 from flask import send_file
 from sqlalchemy import delete, extract, text
 from sqlalchemy.exc import IntegrityError
@@ -19,17 +23,18 @@ from sqlalchemy.exc import IntegrityError
 from calendar import monthrange
 import pdfplumber
 from dotenv import load_dotenv
-from collections import Counter
-from flask import Flask, request, jsonify, render_template, send_from_directory, redirect
+from collections import Counter, OrderedDict
+from flask import Flask, Response, g, request, jsonify, render_template, send_from_directory, redirect
 from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt, get_jwt_identity
-from sqlalchemy import and_, text as sqltext
+from sqlalchemy import and_, or_, bindparam, update, text as sqltext
 from sqlalchemy import text
 from sqlalchemy.sql import func
 from sqlalchemy.pool import NullPool
 from sqlalchemy.exc import OperationalError, DisconnectionError
 from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session, joinedload, object_session
+from sqlalchemy import event
 from flask import current_app
 from werkzeug.security import check_password_hash, generate_password_hash
 import sqlite3
@@ -89,6 +94,13 @@ class User(db.Model):
     reset_token   = db.Column(db.String(128), nullable=True)
     reset_expires = db.Column(db.DateTime, nullable=True)
 
+    # вычисляемые при записи (см. _resolve_user_flags): без Unicode-нормализации на каждую строку
+    name_key        = db.Column(db.String(255), nullable=True, index=True)  # _norm(full_name)
+    coord_resolved  = db.Column(db.Boolean, nullable=True)   # флаг/роль/список COORDINATORS_DEFAULT
+    zmiwaka_resolved = db.Column(db.Boolean, nullable=True)  # флаг/список ZMIWAKI_DEFAULT
+    # растёт при смене роли/флагов/email/пароля → старые токены отзываются (см. _token_revoked)
+    token_version   = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
 
     shifts = db.relationship('Shift', backref='user', cascade='all, delete-orphan')
 
@@ -110,6 +122,7 @@ class Shift(db.Model):
     __tablename__ = 'shifts'
     __table_args__ = (
         db.UniqueConstraint('user_id', 'shift_date', name='uq_shifts_user_date'),
+        db.Index('ix_shifts_shift_date', 'shift_date'),   # месяц/день без user_id
     )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -137,9 +150,93 @@ class Shift(db.Model):
             'coord_lounge': self.coord_lounge,
         }
 
+class ShiftChange(db.Model):
+    """Журнал изменений shifts для дельта-синхронизации (/api/shifts/changes)."""
+    __tablename__ = 'shift_changes'
+    __table_args__ = (
+        db.Index('ix_shift_changes_date_seq', 'shift_date', 'seq'),   # токен месяца для month_cache
+    )
+    seq        = db.Column(db.Integer, primary_key=True)            # монотонный номер изменения
+    op         = db.Column(db.String(8), nullable=False)            # 'insert' | 'update' | 'delete'
+    shift_id   = db.Column(db.Integer, nullable=False)
+    shift_date = db.Column(db.Date, nullable=False)
+    changed_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
+
+
+class UserMonthStats(db.Model):
+    """Сводка часов пользователя за месяц (для /api/my-stats); пересчитывается при изменении смен."""
+    __tablename__ = 'user_month_stats'
+    user_id         = db.Column(db.Integer, primary_key=True)
+    year            = db.Column(db.Integer, primary_key=True)
+    month           = db.Column(db.Integer, primary_key=True)
+    shift_count     = db.Column(db.Integer, nullable=False, default=0)
+    scheduled_hours = db.Column(db.Numeric(7, 2), nullable=False, default=0)  # по hours/коду смены
+    worked_hours    = db.Column(db.Numeric(7, 2), nullable=False, default=0)  # только отмеченные worklog
+    hours           = db.Column(db.Numeric(7, 2), nullable=False, default=0)  # как resolve_hours()
+    logged_count    = db.Column(db.Integer, nullable=False, default=0)        # смен с worked_hours
+    updated_at      = db.Column(db.DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class StaffingNorm(db.Model):
+    """
+    Норма obsady для /api/control/summary.
+    weekday: 0=пн … 6=вс, NULL = любой день; lounge: 'mazurek'|'polonez'|…, NULL = весь зал.
+    """
+    __tablename__ = 'staffing_norms'
+    id      = db.Column(db.Integer, primary_key=True)
+    weekday = db.Column(db.Integer, nullable=True)
+    lounge  = db.Column(db.String(16), nullable=True)
+    slot    = db.Column(db.String(8), nullable=False)   # 'morning' | 'evening'
+    norm    = db.Column(db.Integer, nullable=False)
+
+    def to_dict(self):
+        return {'weekday': self.weekday, 'lounge': self.lounge, 'slot': self.slot, 'norm': self.norm}
+
+
+class ImportJob(db.Model):
+    """Фоновый импорт графика (pdf/xlsx/text): статус и результат для /api/import-jobs/<id>."""
+    __tablename__ = 'import_jobs'
+    id          = db.Column(db.Integer, primary_key=True)
+    kind        = db.Column(db.String(8), nullable=False)                   # 'pdf' | 'xlsx' | 'text'
+    status      = db.Column(db.String(12), nullable=False, default='queued') # queued/running/done/error
+    progress    = db.Column(db.Integer, nullable=False, default=0)          # 0..100
+    year        = db.Column(db.Integer, nullable=False)
+    month       = db.Column(db.Integer, nullable=False)
+    mode        = db.Column(db.String(8), nullable=False, default='replace')
+    dry_run     = db.Column(db.Boolean, nullable=False, default=False)
+    created_by  = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    result      = db.Column(db.JSON, nullable=True)
+    error       = db.Column(db.Text, nullable=True)
+    created_at  = db.Column(db.DateTime(timezone=True), server_default=func.now())
+    updated_at  = db.Column(db.DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    finished_at = db.Column(db.DateTime(timezone=True), nullable=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id, 'kind': self.kind, 'status': self.status, 'progress': self.progress,
+            'year': self.year, 'month': self.month, 'mode': self.mode, 'dry_run': self.dry_run,
+            'result': self.result, 'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class StreamEvent(db.Model):
+    """Событие для /api/events (заявки, рынок, заметки). Смены идут через shift_changes."""
+    __tablename__ = 'stream_events'
+    id         = db.Column(db.Integer, primary_key=True)
+    kind       = db.Column(db.String(16), nullable=False)     # 'proposal' | 'market' | 'note'
+    audience   = db.Column(db.String(255), nullable=True)     # None = все; иначе ',3,7,managers,'
+    payload    = db.Column(db.JSON, nullable=True)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
+
+
 # --- модель контроля (рядом с другими моделями) ---
 class ControlEvent(db.Model):
     __tablename__ = 'control_events'
+    __table_args__ = (
+        db.Index('ix_control_events_event_date', 'event_date'),
+    )
     id            = db.Column(db.Integer, primary_key=True)
     kind          = db.Column(db.String(20), nullable=False)  # 'late' | 'extra' | 'absence' | 'manual_shift'
     user_id       = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -169,6 +266,11 @@ class ControlEvent(db.Model):
 
 class SwapProposal(db.Model):
     __tablename__ = 'swap_proposals'
+    __table_args__ = (
+        db.Index('ix_swap_target_status', 'target_user_id', 'status'),     # входящие
+        db.Index('ix_swap_requester_status', 'requester_id', 'status'),   # исходящие
+        db.Index('ix_swap_status', 'status'),                              # очередь менеджера
+    )
     id = db.Column(db.Integer, primary_key=True)
     requester_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     target_user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -194,6 +296,9 @@ class SwapProposal(db.Model):
 
 class MarketOffer(db.Model):
     __tablename__ = 'market_offers'
+    __table_args__ = (
+        db.Index('ix_market_status_owner', 'status', 'owner_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     shift_id = db.Column(db.Integer, db.ForeignKey('shifts.id'), nullable=False, unique=True)
     owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -217,134 +322,169 @@ class MarketOffer(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
-# ---------------------------------
-# DB init + light migrations
-# ---------------------------------
-with app.app_context():
-    db.create_all()
-    from sqlalchemy import inspect
-    engine = db.engine
-    insp = inspect(engine)
-    backend = engine.url.get_backend_name()
-
-    def _exec(sql, ok_msg):
-        try:
-            db.session.execute(sqltext(sql))
-            db.session.commit()
-            app.logger.info(ok_msg)
-        except Exception as e:
-            db.session.rollback()
-            app.logger.warning(f"skip: {e}")
-        # ensure control_events
-    if 'control_events' not in insp.get_table_names():
-        _exec("""
-            CREATE TABLE IF NOT EXISTS control_events(
-              id SERIAL PRIMARY KEY,
-              kind VARCHAR(20) NOT NULL,
-              user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-              event_date DATE NOT NULL,
-              reason TEXT,
-              hours NUMERIC(5,2),
-              time_from VARCHAR(5),
-              time_to VARCHAR(5),
-              created_by_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-              created_at TIMESTAMPTZ DEFAULT NOW()
-            )""", "control_events ensured")
-
-    # ensure columns on users
-    if 'users' in insp.get_table_names():
-        ucols = {c['name']: c for c in insp.get_columns('users')}
-        if 'hourly_rate_pln' not in ucols:
-            _exec("ALTER TABLE users ADD COLUMN hourly_rate_pln NUMERIC", "users.hourly_rate_pln added")
-        if 'tax_percent' not in ucols:
-            _exec("ALTER TABLE users ADD COLUMN tax_percent NUMERIC DEFAULT 0", "users.tax_percent added")
-        if 'order_index' not in ucols:
-            _exec("ALTER TABLE users ADD COLUMN order_index INTEGER", "users.order_index added")
-        if 'is_coordinator' not in ucols:
-            _exec("ALTER TABLE users ADD COLUMN is_coordinator BOOLEAN DEFAULT FALSE NOT NULL", "users.is_coordinator added")
-        if 'is_zmiwaka' not in ucols:
-            _exec("ALTER TABLE users ADD COLUMN is_zmiwaka BOOLEAN DEFAULT FALSE NOT NULL", "users.is_zmiwaka added")
-
-        # allow null email/password in Postgres
-        if backend.startswith('postgresql'):
-            cols = {c['name']: c for c in insp.get_columns('users')}
-            for col in ('email', 'password_hash'):
-                ci = cols.get(col)
-                if ci is not None and not ci.get('nullable', True):
-                    _exec(f"ALTER TABLE users ALTER COLUMN {col} DROP NOT NULL", f"users.{col} set NULLABLE")
-
-    # dedupe shifts per (user_id, date)
-    try:
-        dups = (db.session.query(Shift.user_id, Shift.shift_date, func.count(Shift.id))
-                .group_by(Shift.user_id, Shift.shift_date)
-                .having(func.count(Shift.id) > 1)
-                .all())
-        for uid, sdate, _ in dups:
-            rows = (Shift.query
-                    .filter(Shift.user_id == uid, Shift.shift_date == sdate)
-                    .order_by(Shift.id.desc())
-                    .all())
-            for extra in rows[1:]:
-                db.session.delete(extra)
-        db.session.commit()
-    except Exception as e:
-        db.session.rollback()
-        app.logger.warning(f"dedupe shifts skipped: {e}")
 
-    # unique index
-    _exec("CREATE UNIQUE INDEX IF NOT EXISTS uq_shifts_user_date ON shifts (user_id, shift_date)",
-          "uq_shifts_user_date ensured")
+# связи, которые читает to_dict(): для списков грузим одним запросом (без N+1)
+def _with_proposal_refs(q):
+    return q.options(joinedload(SwapProposal.requester), joinedload(SwapProposal.target_user))
 
-    # ensure swap_proposals table (sqlite path: db.create_all() already did)
-    if 'swap_proposals' not in insp.get_table_names() and backend.startswith('postgresql'):
-        try:
-            db.session.execute(sqltext("""
-                CREATE TABLE IF NOT EXISTS swap_proposals (
-                    id SERIAL PRIMARY KEY,
-                    requester_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                    target_user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                    my_date DATE NOT NULL,
-                    their_date DATE NOT NULL,
-                    status VARCHAR(20) NOT NULL DEFAULT 'pending',
-                    created_at TIMESTAMPTZ DEFAULT NOW()
-                )"""))
-            db.session.commit()
-        except Exception as e:
-            db.session.rollback()
-            app.logger.warning(f"swap_proposals migration skipped: {e}")
+def _with_offer_refs(q):
+    return q.options(joinedload(MarketOffer.shift), joinedload(MarketOffer.owner),
+                     joinedload(MarketOffer.candidate))
 
-    # ensure market_offers (for Postgres safety)
-    if 'market_offers' not in insp.get_table_names() and backend.startswith('postgresql'):
-        try:
-            db.session.execute(sqltext("""
-                CREATE TABLE IF NOT EXISTS market_offers(
-                    id SERIAL PRIMARY KEY,
-                    shift_id INTEGER UNIQUE NOT NULL REFERENCES shifts(id) ON DELETE CASCADE,
-                    owner_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                    candidate_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
-                    status VARCHAR(20) NOT NULL DEFAULT 'open',
-                    created_at TIMESTAMPTZ DEFAULT NOW()
-                )
-            """))
-            db.session.commit()
-        except Exception as e:
-            db.session.rollback()
-            app.logger.warning(f"market_offers migration skipped: {e}")
-# ensure column 'coord_lounge' exists on shifts
-def ensure_coord_lounge_column():
-    insp = db.inspect(db.engine)
-    cols = [c['name'] for c in insp.get_columns('shifts')]
-    if 'coord_lounge' not in cols:
-        db.session.execute(text("ALTER TABLE shifts ADD COLUMN coord_lounge VARCHAR(16)"))
-        db.session.commit()
+# --- журнал shift_changes: пишем в том же flush, что и сами смены ---
+# Слушатели висят на db.session (scoped_session приложения), а не на всём классе Session:
+# сторонние сессии (скрипты, тесты со своим движком) журнал и сводки не трогают.
+SHIFT_JOURNAL_LOCK_KEY = 0x73686674  # pg_advisory_xact_lock: seq журнала в порядке commit
+STREAM_EVENTS_LOCK_KEY = 0x73747276  # то же для id stream_events; берётся всегда после журнального
 
+def _as_date(v):
+    return datetime.fromisoformat(v).date() if isinstance(v, str) else v
 
-def ensure_lounge_column():
-    insp = db.inspect(db.engine)
-    cols = [c['name'] for c in insp.get_columns('shifts')]
-    if 'lounge' not in cols:
-        db.session.execute(text("ALTER TABLE shifts ADD COLUMN lounge VARCHAR(16)"))
-        db.session.commit()
+def _journal_lock(session, key=SHIFT_JOURNAL_LOCK_KEY):
+    """
+    Postgres раздаёт seq при INSERT, а не при commit: транзакция с меньшим seq
+    может закоммититься позже и клиент, уже прочитавший голову журнала, её пропустит.
+    Пишущие в журнал транзакции идут по очереди (xact-lock держится до commit/rollback),
+    поэтому видимые seq растут без дыр «в прошлом». SQLite и так пишет по одному.
+    """
+    if session.get_bind().dialect.name == 'postgresql':
+        session.execute(sqltext("SELECT pg_advisory_xact_lock(:k)"), {'k': key})
+
+@event.listens_for(db.session, 'before_flush')
+def _journal_lock_before_flush(session, flush_context, instances):
+    # берём до самих UPDATE/DELETE shifts — строки смен блокируются уже под журнальным замком
+    if any(isinstance(o, Shift) for o in list(session.new) + list(session.dirty) + list(session.deleted)):
+        _journal_lock(session)
+
+@event.listens_for(db.session, 'after_flush')
+def _journal_shift_changes(session, flush_context):
+    rows = []
+    for obj in session.new:
+        if isinstance(obj, Shift):
+            rows.append({'op': 'insert', 'shift_id': obj.id, 'shift_date': _as_date(obj.shift_date)})
+    for obj in session.dirty:
+        if isinstance(obj, Shift) and session.is_modified(obj, include_collections=False):
+            rows.append({'op': 'update', 'shift_id': obj.id, 'shift_date': _as_date(obj.shift_date)})
+            # смена уехала на другую дату — старый день (и месяц) тоже изменился
+            for old in db.inspect(obj).attrs.shift_date.history.deleted:
+                if old is not None and _as_date(old) != _as_date(obj.shift_date):
+                    rows.append({'op': 'update', 'shift_id': obj.id, 'shift_date': _as_date(old)})
+    for obj in session.deleted:
+        if isinstance(obj, Shift):
+            rows.append({'op': 'delete', 'shift_id': obj.id, 'shift_date': _as_date(obj.shift_date)})
+    if rows:
+        session.connection().execute(ShiftChange.__table__.insert(), rows)
+
+
+# --- user_month_stats: какие (user, месяц) пересчитать при commit ---
+def _ym(d):
+    d = _as_date(d)
+    return (d.year, d.month) if d else None
+
+def _stats_touch(session, user_id, d):
+    # user_id=None → пересчитать месяц целиком (массовые DELETE мимо ORM)
+    ym = _ym(d)
+    if ym:
+        session.info.setdefault('stats_keys', set()).add((user_id,) + ym)
+
+@event.listens_for(db.session, 'after_flush')
+def _stats_collect(session, flush_context):
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, Shift):
+            _stats_touch(session, obj.user_id, obj.shift_date)
+    for obj in session.dirty:
+        if isinstance(obj, Shift) and session.is_modified(obj, include_collections=False):
+            _stats_touch(session, obj.user_id, obj.shift_date)
+            # при обмене/передаче старый владелец и старая дата тоже меняются
+            state = db.inspect(obj)
+            old_users = state.attrs.user_id.history.deleted or [obj.user_id]
+            old_dates = state.attrs.shift_date.history.deleted or [obj.shift_date]
+            for uid in old_users:
+                for d in old_dates:
+                    _stats_touch(session, uid, d)
+
+@event.listens_for(db.session, 'before_commit')
+def _stats_apply(session):
+    session.flush()   # commit всё равно флашит; нужно сейчас, чтобы собрать ключи
+    keys = session.info.pop('stats_keys', set())
+    if keys:
+        _recompute_month_stats(session.connection(), keys)
+
+@event.listens_for(db.session, 'after_rollback')
+def _stats_forget(session):
+    session.info.pop('stats_keys', None)
+
+
+def _hours_sql():
+    """resolve_hours() в SQL: worked_hours → hours → норма по коду смены."""
+    by_hours = {}
+    for code, h in SHIFT_HOURS_DEFAULT.items():
+        by_hours.setdefault(h, []).append(code)
+    whens = ' '.join(
+        "WHEN UPPER(REPLACE(TRIM(shift_code), ' ', '')) IN (%s) THEN %s"
+        % (', '.join("'%s'" % c for c in codes), h)
+        for h, codes in by_hours.items()
+    )
+    planned = f"COALESCE(hours, CASE {whens} ELSE 0 END)"
+    return planned, f"COALESCE(worked_hours, {planned})"
+
+
+def _recompute_month_stats(conn, keys):
+    """
+    Пересчитать строки user_month_stats для ключей (user_id | None, year, month):
+    один GROUP BY на месяц по затронутым пользователям, затем delete+insert строк.
+    """
+    planned, resolved = _hours_sql()
+    by_month = {}
+    for uid, y, m in keys:
+        by_month.setdefault((y, m), set()).add(uid)
+    for (y, m), uids in by_month.items():
+        first, last = _date(y, m, 1), _date(y, m, monthrange(y, m)[1])
+        whole = None in uids
+        where = "shift_date BETWEEN :d1 AND :d2"
+        params = {'d1': first, 'd2': last}
+        if not whole:
+            ids = sorted(u for u in uids if u is not None)
+            where += " AND user_id IN (%s)" % ', '.join(str(int(u)) for u in ids)
+        rows = conn.execute(sqltext(f"""
+            SELECT user_id, COUNT(*), SUM({planned}), SUM(COALESCE(worked_hours, 0)),
+                   SUM({resolved}), COUNT(worked_hours)
+            FROM shifts WHERE {where}
+            GROUP BY user_id
+        """), params).all()
+        tbl = UserMonthStats.__table__
+        stale = tbl.delete().where(tbl.c.year == y, tbl.c.month == m)
+        if not whole:
+            stale = stale.where(tbl.c.user_id.in_(ids))
+        conn.execute(stale)
+        if rows:
+            conn.execute(tbl.insert(), [{
+                'user_id': r[0], 'year': y, 'month': m, 'shift_count': r[1],
+                'scheduled_hours': r[2] or 0, 'worked_hours': r[3] or 0,
+                'hours': r[4] or 0, 'logged_count': r[5],
+            } for r in rows])
+
+
+SHIFT_JOURNAL_DAYS = int(os.getenv('SHIFT_JOURNAL_DAYS', '60'))
+
+def _journal_range_deletes(first, last):
+    """
+    Массовые DELETE мимо ORM (импорты) событий не порождают —
+    журналируем удаление всех смен диапазона явно, до самого DELETE.
+    Заодно подрезаем старый хвост журнала.
+    """
+    _journal_lock(db.session)
+    y, m = first.year, first.month
+    while (y, m) <= (last.year, last.month):
+        _stats_touch(db.session, None, _date(y, m, 1))
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+    db.session.execute(sqltext("""
+        INSERT INTO shift_changes (op, shift_id, shift_date)
+        SELECT 'delete', id, shift_date FROM shifts
+        WHERE shift_date BETWEEN :d1 AND :d2
+    """), {'d1': first, 'd2': last})
+    cutoff = datetime.now(timezone.utc) - timedelta(days=SHIFT_JOURNAL_DAYS)
+    db.session.execute(delete(ShiftChange).where(ShiftChange.changed_at < cutoff))
 
 
 # ---------------------------------
@@ -361,11 +501,15 @@ ZMIWAKI_DEFAULT = {
 }
 
 def current_user():
+    # один SELECT на запрос, дальше — из g
+    if '_current_user' in g:
+        return g._current_user
     try:
         uid = int((get_jwt() or {}).get('sub'))
     except Exception:
         return None
-    return db.session.get(User, uid)
+    g._current_user = db.session.get(User, uid)
+    return g._current_user
 
 def _norm(s: str) -> str:
     if s is None:
@@ -382,23 +526,141 @@ def _is_coord_or_admin(u: User|None) -> bool:
     role = (u.role or '').lower()
     return role in ('admin','coordinator') or is_coordinator_user(u)
 
+def _resolve_user_flags(full_name, role=None, is_coordinator=False, is_zmiwaka=False) -> dict:
+    """name_key + итоговые флаги координатора/змывака — то, что храним в users."""
+    key = _norm(full_name)
+    return {
+        'name_key': key,
+        'coord_resolved': bool(is_coordinator) or (role or '').lower() == 'coordinator'
+                          or key in COORDINATORS_DEFAULT_NORM,
+        'zmiwaka_resolved': bool(is_zmiwaka) or key in ZMIWAKI_DEFAULT_NORM,
+    }
+
+
+_TOKEN_BUMP_ATTRS = ('role', 'email', 'password_hash')
+_SCHEDULE_USER_ATTRS = ('full_name', 'order_index')   # + итоговые флаги: видно в ответах графика
+USERS_REV_SETTING = 'users_rev'
+
+
+def _bump_users_rev(conn):
+    # ревизия «видимых в графике» полей users — часть ETag графика (см. etag_precheck)
+    conn.execute(sqltext("UPDATE app_settings SET value = CAST(CAST(value AS INTEGER) + 1 AS VARCHAR(32))"
+                         " WHERE key = :k"), {'k': USERS_REV_SETTING})
+
+
+def _users_rev() -> str:
+    return db.session.query(AppSetting.value).filter(AppSetting.key == USERS_REV_SETTING).scalar() or '0'
+
+
+@event.listens_for(User, 'before_insert')
+@event.listens_for(User, 'before_update')
+def _user_flags_on_write(mapper, connection, target):
+    # держим name_key/флаги актуальными при создании, переименовании и смене роли
+    flags = _resolve_user_flags(target.full_name, target.role,
+                                target.is_coordinator, target.is_zmiwaka)
+    if target.id is not None:
+        state = db.inspect(target)
+        changed = any(state.attrs[a].history.has_changes() for a in _TOKEN_BUMP_ATTRS)
+        changed = changed or (target.coord_resolved is not None and (
+            bool(target.coord_resolved) != flags['coord_resolved']
+            or bool(target.zmiwaka_resolved) != flags['zmiwaka_resolved']))
+        if changed:
+            # права в claims устарели → выданные токены больше не принимаем
+            target.token_version = (target.token_version or 0) + 1
+            # кэш версий — после commit: раньше соседний запрос перечитал бы старую версию
+            object_session(target).info.setdefault('token_forget', set()).add(target.id)
+        if (any(state.attrs[a].history.has_changes() for a in _SCHEDULE_USER_ATTRS)
+                or target.zmiwaka_resolved != flags['zmiwaka_resolved']
+                or target.coord_resolved != flags['coord_resolved']):
+            _bump_users_rev(connection)
+    for k, v in flags.items():
+        setattr(target, k, v)
+
+
+def _backfill_user_flags(conn):
+    """Разово дозаполнить name_key/флаги у старых строк (где name_key ещё пуст)."""
+    rows = conn.execute(sqltext("""
+        SELECT id, full_name, role, is_coordinator, is_zmiwaka FROM users WHERE name_key IS NULL
+    """)).all()
+    for uid, full_name, role, is_coord, is_zmiw in rows:
+        vals = _resolve_user_flags(full_name, role, is_coord, is_zmiw)
+        conn.execute(sqltext("""
+            UPDATE users SET name_key = :name_key, coord_resolved = :coord_resolved,
+                             zmiwaka_resolved = :zmiwaka_resolved
+            WHERE id = :id
+        """), dict(vals, id=uid))
+    if rows:
+        app.logger.info(f"users flags backfilled: {len(rows)}")
+
+
+USER_FLAGS_SETTING = 'user_flags_lists'
+
+def _user_lists_hash() -> str:
+    lists = [sorted(COORDINATORS_DEFAULT_NORM), sorted(ZMIWAKI_DEFAULT_NORM)]
+    return hashlib.sha256(json.dumps(lists, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def _sync_user_flags(conn) -> int:
+    """
+    COORDINATORS_DEFAULT / ZMIWAKI_DEFAULT поменялись с прошлого запуска → пересчитать флаги
+    всех пользователей. Хэш списков лежит в app_settings; у кого итог изменился — ещё и
+    token_version: права в claims устарели. Вызывается из migrate() под тем же замком.
+    """
+    digest = _user_lists_hash()
+    setting = conn.execute(sqltext("SELECT value FROM app_settings WHERE key = :k"),
+                           {'k': USER_FLAGS_SETTING}).first()
+    if setting is not None and setting[0] == digest:
+        return 0
+    rows = conn.execute(sqltext("""
+        SELECT id, full_name, role, is_coordinator, is_zmiwaka, coord_resolved, zmiwaka_resolved FROM users
+    """)).all()
+    changed = []
+    for uid, full_name, role, is_coord, is_zmiw, coord_res, zmiw_res in rows:
+        vals = _resolve_user_flags(full_name, role, is_coord, is_zmiw)
+        stored = tuple(None if v is None else bool(v) for v in (coord_res, zmiw_res))
+        if stored != (vals['coord_resolved'], vals['zmiwaka_resolved']):
+            changed.append(dict(vals, id=uid))
+    if changed:
+        conn.execute(sqltext("""
+            UPDATE users SET name_key = :name_key, coord_resolved = :coord_resolved,
+                             zmiwaka_resolved = :zmiwaka_resolved,
+                             token_version = COALESCE(token_version, 0) + 1
+            WHERE id = :id
+        """), changed)
+    conn.execute(sqltext("INSERT INTO app_settings (key, value) VALUES (:k, :v)" if setting is None
+                         else "UPDATE app_settings SET value = :v WHERE key = :k"),
+                 {'k': USER_FLAGS_SETTING, 'v': digest})
+    if changed:
+        _bump_users_rev(conn)
+        app.logger.info(f"users flags recomputed after list change: {len(changed)}")
+    return len(changed)
+
+
+def _users_by_key(names) -> dict:
+    """{name_key: User} только для встреченных в импорте имён — по индексу, без скана users."""
+    keys = {_norm(n) for n in names if n}
+    keys.discard('')
+    if not keys:
+        return {}
+    return {u.name_key: u for u in User.query.filter(User.name_key.in_(keys)).all()}
+
+
 def is_coordinator_user(user: User | None) -> bool:
     if not user:
         return False
-    if bool(getattr(user, 'is_coordinator', False)):
-        return True
-    role = (getattr(user, 'role', '') or '').lower()
-    if role == 'coordinator':
-        return True
-    return _norm(getattr(user, 'full_name', '')) in COORDINATORS_DEFAULT_NORM
+    resolved = getattr(user, 'coord_resolved', None)
+    if resolved is not None:
+        return bool(resolved)
+    return _resolve_user_flags(user.full_name, user.role, user.is_coordinator, user.is_zmiwaka)['coord_resolved']
 
 
 def is_zmiwaka_user(user: User | None) -> bool:
     if not user:
         return False
-    if bool(getattr(user, 'is_zmiwaka', False)):
-        return True
-    return _norm(getattr(user, 'full_name', '')) in ZMIWAKI_DEFAULT_NORM
+    resolved = getattr(user, 'zmiwaka_resolved', None)
+    if resolved is not None:
+        return bool(resolved)
+    return _resolve_user_flags(user.full_name, user.role, user.is_coordinator, user.is_zmiwaka)['zmiwaka_resolved']
 
 DATE_PATTERNS = [
     (re.compile(r'^(\d{1,2})[./-](\d{1,2})[./-](\d{2,4})$'), ('d','m','y')),
@@ -452,7 +714,121 @@ def warsaw_today():
 
 def warsaw_tomorrow():
     return warsaw_today() + timedelta(days=1)
- 
+
+
+# --- Кэш собранного графика по месяцам ---
+class MonthCache:
+    """
+    LRU-кэш документов /api/month-shifts по ключу (year, month).
+    Документ лежит вместе с токеном месяца из БД (см. _month_token) и отдаётся,
+    только если токен не изменился — так запись в другом воркере gunicorn
+    тоже выкидывает документ. Локальный счётчик версии сбрасывает документ сразу
+    после записи в этом воркере; документ, собранный по старой версии
+    (запись случилась во время сборки), в кэш не попадает.
+    TTL остаётся для правок пользователей (имя, порядок), которых журнал не видит.
+    """
+
+    def __init__(self, maxsize: int = 24, ttl: float = 30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._items: OrderedDict = OrderedDict()   # (y, m) -> (version, token, stored_at, doc)
+        self._versions: dict = {}                  # (y, m) -> int
+
+    def version(self, y: int, m: int) -> int:
+        with self._lock:
+            return self._versions.get((y, m), 0)
+
+    def get(self, y: int, m: int, token: int):
+        key = (y, m)
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            version, stored_token, stored_at, doc = item
+            if (version != self._versions.get(key, 0) or stored_token != token
+                    or time.monotonic() - stored_at > self.ttl):
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return doc
+
+    def put(self, y: int, m: int, version: int, token: int, doc) -> None:
+        key = (y, m)
+        with self._lock:
+            if version != self._versions.get(key, 0):
+                return
+            self._items[key] = (version, token, time.monotonic(), doc)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def invalidate(self, y: int, m: int) -> None:
+        key = (y, m)
+        with self._lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+            self._items.pop(key, None)
+
+
+month_cache = MonthCache(
+    maxsize=int(os.getenv('MONTH_CACHE_SIZE', '24')),
+    ttl=float(os.getenv('MONTH_CACHE_TTL', '30')),
+)
+
+def _dates_token(first, last) -> int:
+    """Последний seq журнала shift_changes по датам диапазона (индекс shift_date, seq)."""
+    return (db.session.query(func.max(ShiftChange.seq))
+            .filter(ShiftChange.shift_date.between(first, last))
+            .scalar() or 0)
+
+def _month_token(y: int, m: int) -> int:
+    return _dates_token(_date(y, m, 1), _date(y, m, monthrange(y, m)[1]))
+
+def _schedule_changed(*days):
+    """Сбросить кэш месяцев, в которые попадают даты (date или 'YYYY-MM-DD')."""
+    for d in days:
+        if not d:
+            continue
+        if isinstance(d, str):
+            d = datetime.fromisoformat(d).date()
+        month_cache.invalidate(d.year, d.month)
+
+
+def _json_body(payload) -> tuple[bytes, str]:
+    """Сериализует payload так же, как jsonify, и считает строгий ETag по содержимому."""
+    body = app.json.dumps(payload).encode('utf-8') + b'\n'
+    return body, hashlib.sha256(body).hexdigest()[:32]
+
+
+def json_etag(payload=None, body: bytes | None = None, etag: str | None = None):
+    """JSON-ответ со строгим ETag; при совпадении If-None-Match отдаём 304 без тела."""
+    if body is None:
+        body, body_etag = _json_body(payload)
+        etag = etag or body_etag
+    resp = app.response_class(body, mimetype='application/json')
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    return resp.make_conditional(request)
+
+
+ETAG_FORMAT = 1   # поднять, если меняется формат ответов с etag_precheck
+
+
+def etag_precheck(*parts):
+    """
+    ETag из версий данных (токен журнала, ревизия users, uid, параметры) — ДО выборки.
+    Совпал с If-None-Match → (etag, 304): ни запроса смен, ни сериализации.
+    Иначе (etag, None), и ответ уходит с тем же ETag: json_etag(..., etag=etag).
+    Токен читается раньше данных: запись между ними даст лишь лишний полный ответ.
+    """
+    etag = hashlib.sha256(repr((ETAG_FORMAT,) + parts).encode()).hexdigest()[:32]
+    if not request.if_none_match.contains(etag):
+        return etag, None
+    resp = app.response_class(status=304)
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    return etag, resp
+
 
 def _purge_shifts_and_offers_in_range(start_date, end_date):
     """
@@ -464,6 +840,8 @@ def _purge_shifts_and_offers_in_range(start_date, end_date):
         Shift.shift_date.between(start_date, end_date)
     )
 
+    _journal_range_deletes(start_date, end_date)
+
     # сначала — офферы, потом — сами смены
     db.session.execute(
         delete(MarketOffer).where(MarketOffer.shift_id.in_(shift_ids_q))
@@ -475,26 +853,262 @@ def _purge_shifts_and_offers_in_range(start_date, end_date):
     db.session.flush()
 
 
-def _xlsx_iter_colored_office_cells(xlsx_path: str, year: int, month: int):
+# --- общий bulk-writer импортов графика (pdf / xlsx / text) ---
+def _import_items(rows, year, month):
+    """
+    Строки парсеров → [{name, key, date, code, lounge, coord_lounge}]:
+    дата как date, имя нормализовано, дубли (человек, день) — первый выигрывает.
+    """
+    out, seen = [], set()
+    for r in rows:
+        name = (r.get('name') or '').strip()
+        if not name:
+            continue
+        if r.get('date'):
+            d = _as_date(r['date'])
+        elif r.get('day'):
+            d = _date(year, month, int(r['day']))
+        else:
+            continue
+        key = _norm(name)
+        if (key, d) in seen:
+            continue
+        seen.add((key, d))
+        out.append({
+            'name': name, 'key': key, 'date': d,
+            'code': r.get('shift') or r.get('code') or '',
+            'lounge': r.get('lounge') or None,
+            'coord_lounge': r.get('coord_lounge') or None,
+        })
+    return out
+
+
+def _ensure_import_users(items):
+    """
+    {name_key: user_id} для всех имён импорта; недостающих создаём одним INSERT
+    (bulk мимо ORM → name_key/флаги считаем здесь же). Возвращает (ids, created_names).
+    """
+    names = {}
+    for it in items:
+        names.setdefault(it['key'], it['name'])
+    ids = {k: u.id for k, u in _users_by_key(names.values()).items()}
+    missing = [(k, n) for k, n in names.items() if k not in ids]
+    if missing:
+        db.session.execute(User.__table__.insert(), [
+            dict(_resolve_user_flags(n, 'user'), full_name=n, role='user',
+                 is_coordinator=False, is_zmiwaka=False, token_version=0)
+            for _, n in missing
+        ])
+        ids.update({k: u.id for k, u in _users_by_key(n for _, n in missing).items()})
+    return ids, [n for _, n in missing]
+
+
+def _journal_rows(op, pairs):
+    # pairs: [(shift_id, shift_date)] → shift_changes одним executemany
+    if pairs:
+        _journal_lock(db.session)
+        db.session.execute(ShiftChange.__table__.insert(),
+                           [{'op': op, 'shift_id': i, 'shift_date': d} for i, d in pairs])
+
+
+def _bulk_insert_shifts(items, user_ids):
+    """
+    Вставка смен одним executemany (на Postgres SQLAlchemy сам собирает
+    многострочные VALUES). Журнал/сводки — вручную, т.к. ORM-события не срабатывают.
+    """
+    if not items:
+        return 0
+    res = db.session.execute(Shift.__table__.insert().returning(Shift.id, Shift.shift_date), [{
+        'user_id': user_ids[it['key']], 'shift_date': it['date'], 'shift_code': it['code'],
+        'hours': None, 'lounge': it['lounge'], 'coord_lounge': it['coord_lounge'],
+    } for it in items])
+    _journal_rows('insert', res.all())
+    _stats_touch(db.session, None, items[0]['date'])
+    return len(items)
+
+
+# поля смены, которые приходят из графика; worked_hours/work_note/hours импорт не трогает
+IMPORT_FIELDS = (('shift_code', 'code'), ('lounge', 'lounge'), ('coord_lounge', 'coord_lounge'))
+# залы есть не в каждом источнике (текст — только коды, PDF — лишь при заливке):
+# пустое значение в merge значит «источник не знает», а не «очистить»
+IMPORT_OPTIONAL_FIELDS = ('lounge', 'coord_lounge')
+IMPORT_MODES = ('replace', 'merge')
+
+
+def _import_opt(name, default=''):
+    # параметр импорта: query string, поле формы или JSON-тело
+    data = request.get_json(silent=True) if request.is_json else None
+    v = request.args.get(name) or request.form.get(name) or (data or {}).get(name) or default
+    return str(v).strip().lower()
+
+
+def _import_mode():
+    """?mode= / поле формы / JSON: 'replace' (по умолчанию) или 'merge'."""
+    mode = _import_opt('mode', 'replace')
+    return mode if mode in IMPORT_MODES else None
+
+
+def _import_flag(name):
+    # ?dry_run=1, ?async=1 …
+    return _import_opt(name) in ('1', 'true', 'yes', 'on')
+
+
+def _diff_month(items, user_ids, first, last, mode='merge'):
+    """
+    Сравнивает импорт с тем, что уже лежит в базе за месяц, по (user_id, дата).
+    Возвращает {'insert': [item], 'update': [(shift_id, item)], 'delete': [(shift_id, date, user_id)], 'unchanged': n}.
+    Люди без user_id (ещё не созданы) — целиком во вставках.
+    mode='merge': пустые IMPORT_OPTIONAL_FIELDS берутся из базы — merge не затирает залы,
+    проставленные другим источником (например, /api/admin/lounge-from-xlsx).
+    mode='replace' (предпросмотр): месяц вставляется как есть, очищаемый зал — это changed.
+    """
+    existing, dupes = {}, []
+    q = (db.session.query(Shift.id, Shift.user_id, Shift.shift_date,
+                          Shift.shift_code, Shift.lounge, Shift.coord_lounge)
+         .filter(Shift.shift_date.between(first, last))
+         .order_by(Shift.id))
+    for row in q:
+        k = (row.user_id, _as_date(row.shift_date))
+        if k in existing:
+            dupes.append((row.id, k[1], row.user_id))   # лишние дубли (user, день) — под удаление
+        else:
+            existing[k] = row
+
+    plan = {'insert': [], 'update': [], 'delete': dupes, 'unchanged': 0}
+    for it in items:
+        uid = user_ids.get(it['key'])
+        row = existing.pop((uid, it['date']), None) if uid else None
+        if row is None:
+            plan['insert'].append(it)
+            continue
+        if mode == 'merge':
+            it = dict(it, **{f: getattr(row, f) for f in IMPORT_OPTIONAL_FIELDS if it[f] is None})
+        if any((getattr(row, col) or None) != (it[f] or None) for col, f in IMPORT_FIELDS):
+            plan['update'].append((row.id, it))
+        else:
+            plan['unchanged'] += 1
+    plan['delete'] += [(row.id, d, uid) for (uid, d), row in existing.items()]
+    return plan
+
+
+def _apply_diff(plan, user_ids, first):
+    """Только изменённое: DELETE по id (с офферами), UPDATE executemany, INSERT bulk."""
+    _journal_lock(db.session)
+    del_ids = [i for i, _, _ in plan['delete']]
+    if del_ids:
+        _journal_rows('delete', [(i, d) for i, d, _ in plan['delete']])
+        db.session.execute(delete(MarketOffer).where(MarketOffer.shift_id.in_(del_ids)))
+        db.session.execute(delete(Shift).where(Shift.id.in_(del_ids)))
+    if plan['update']:
+        t = Shift.__table__
+        stmt = (update(t).where(t.c.id == bindparam('b_id'))
+                .values({col: bindparam('b_' + col) for col, _ in IMPORT_FIELDS}))
+        db.session.execute(stmt, [
+            dict({'b_' + col: it[f] for col, f in IMPORT_FIELDS}, b_id=sid)
+            for sid, it in plan['update']
+        ])
+        _journal_rows('update', [(sid, it['date']) for sid, it in plan['update']])
+    if del_ids or plan['update']:
+        _stats_touch(db.session, None, first)
+    _bulk_insert_shifts(plan['insert'], user_ids)
+
+
+def _import_preview(rows, year, month, mode):
+    """
+    ?dry_run=1: парсинг + diff без записи. Итоги, разбивка по людям,
+    кто будет создан и на кого из существующих похожи «чужие» имена (опечатки).
+    В replace дополнительно — сколько офферов и отметок часов пропадёт.
+    """
+    import difflib
+    first = _date(year, month, 1)
+    last  = _date(year, month, monthrange(year, month)[1])
+    items = _import_items(rows, year, month)
+    names = {}
+    for it in items:
+        names.setdefault(it['key'], it['name'])
+    user_ids = {k: u.id for k, u in _users_by_key(names.values()).items()}
+    plan = _diff_month(items, user_ids, first, last, mode)
+
+    per_user = {}
+    def bump(label, field):
+        per_user.setdefault(label, {'added': 0, 'changed': 0, 'removed': 0})[field] += 1
+    for it in plan['insert']:
+        bump(it['name'], 'added')
+    for _, it in plan['update']:
+        bump(it['name'], 'changed')
+    del_uids = {uid for _, _, uid in plan['delete']}
+    user_names = dict(db.session.query(User.id, User.full_name).filter(User.id.in_(del_uids))) if del_uids else {}
+    for _, _, uid in plan['delete']:
+        bump(user_names.get(uid) or f'#{uid}', 'removed')
+
+    new_users = [n for k, n in names.items() if k not in user_ids]
+    unmatched = []
+    if new_users:
+        known = dict(db.session.query(User.name_key, User.full_name).filter(User.name_key.isnot(None)))
+        for n in new_users:
+            close = difflib.get_close_matches(_norm(n), list(known), n=3, cutoff=0.8)
+            unmatched.append({'name': n, 'similar': [known[k] for k in close]})
+
+    out = {
+        'dry_run': True,
+        'mode': mode,
+        'imported': len(items),
+        'diff': {'added': len(plan['insert']), 'changed': len(plan['update']),
+                 'removed': len(plan['delete']), 'unchanged': plan['unchanged']},
+        'per_user': [dict(v, name=k) for k, v in sorted(per_user.items())],
+        'new_users': new_users,
+        'unmatched': unmatched,
+    }
+    if mode == 'replace':
+        in_month = db.session.query(Shift.id).filter(Shift.shift_date.between(first, last))
+        out['lost'] = {
+            'offers': MarketOffer.query.filter(MarketOffer.shift_id.in_(in_month)).count(),
+            'worked': in_month.filter(or_(Shift.worked_hours.isnot(None), Shift.work_note.isnot(None))).count(),
+        }
+    return out
+
+
+def _import_result(imported, created_users, mode, diff, **extra):
+    out = dict(extra, imported=imported, created_users=created_users, mode=mode)
+    if diff is not None:
+        out['diff'] = diff
+    return out
+
+
+def _import_month(rows, year, month, mode='replace'):
+    """
+    Импорт месяца одной транзакцией; пользователи создаются одним INSERT.
+    replace — офферы+смены месяца удаляются и вставляются заново;
+    merge   — только разница с базой, worked_hours/work_note/офферы остаются.
+    Возвращает (imported, created_users, diff|None).
+    """
+    first = _date(year, month, 1)
+    last  = _date(year, month, monthrange(year, month)[1])
+    items = _import_items(rows, year, month)
+    diff = None
+    if mode == 'merge':
+        user_ids, created_users = _ensure_import_users(items)
+        plan = _diff_month(items, user_ids, first, last, mode)
+        _apply_diff(plan, user_ids, first)
+        diff = {'added': len(plan['insert']), 'changed': len(plan['update']),
+                'removed': len(plan['delete']), 'unchanged': plan['unchanged']}
+    else:
+        _purge_shifts_and_offers_in_range(first, last)
+        user_ids, created_users = _ensure_import_users(items)
+        _bulk_insert_shifts(items, user_ids)
+    db.session.commit()
+    month_cache.invalidate(year, month)
+    return len(items), created_users, diff
+
+
+def _xlsx_iter_colored_office_cells(xlsx_src, year: int, month: int):
     """
     Генератор: (full_name:str, date:date, coord_lounge:'mazurek'|'polonez'|None)
     Берём только клетки со значением '1' или '2' и с заливкой.
+    xlsx_src — bytes или путь; лист читается потоково (_XlsxStream).
     """
     from datetime import date as _date_cls
 
-    def _to_rgb_tuple(color):
-        if not color: return None
-        rgb = getattr(color, "rgb", None)
-        if not rgb: return None
-        rgb = str(rgb).upper()
-        if len(rgb) == 8:
-            r = int(rgb[2:4], 16); g = int(rgb[4:6], 16); b = int(rgb[6:8], 16)
-            return (r, g, b)
-        if len(rgb) == 6:
-            r = int(rgb[0:2], 16); g = int(rgb[2:4], 16); b = int(rgb[4:6], 16)
-            return (r, g, b)
-        return None
-
     def _detect_lounge(rgb):
         if not rgb: return None
         r, g, b = rgb
@@ -502,32 +1116,35 @@ def _xlsx_iter_colored_office_cells(xlsx_path: str, year: int, month: int):
         if b >= 150 and r <= 140 and g <= 160: return "mazurek"  # синий
         return None
 
-    wb = load_workbook(xlsx_path, data_only=True)
-    ws = wb.active
-
-    header = [c.value for c in next(ws.iter_rows(min_row=1, max_row=1, values_only=True))]
-    day_cols = []
-    for idx, val in enumerate(header):
-        try:
-            d = int(str(val).strip())
-        except Exception:
+    book = _XlsxStream(xlsx_src)
+    day_cols = None
+    for r, cells in book.rows():
+        if r == 1:
+            # шапка с днями — строка 1 листа (номер из атрибута r, пустые строки в XML пропущены)
+            day_cols = []
+            for col, (val, _) in sorted(cells.items()):
+                try:
+                    d = int(str(val).strip())
+                except Exception:
+                    continue
+                if 1 <= d <= 31:
+                    day_cols.append((col, d))
+            if not day_cols:
+                return
             continue
-        if 1 <= d <= 31:
-            day_cols.append((idx, d))
-    if not day_cols:
-        return
+        if day_cols is None:
+            # строка 1 пустая — шапки нет, первую непустую строку за неё не принимаем
+            return
 
-    for row in ws.iter_rows(min_row=2, values_only=False):
-        full_name = (row[0].value or "").strip() if row[0].value else ""
+        name_val = cells.get(1, (None, 0))[0]
+        full_name = str(name_val).strip() if name_val else ""
         if not full_name:
             continue
-        for idx, day in day_cols:
-            cell = row[idx]
-            val = (str(cell.value).strip() if cell.value is not None else "")
-            if val not in ("1", "2"):
+        for col, day in day_cols:
+            cell = cells.get(col)
+            if not cell or str(cell[0]).strip() not in ("1", "2"):
                 continue
-            rgb = _to_rgb_tuple(cell.fill.start_color)
-            lounge = _detect_lounge(rgb)
+            lounge = _detect_lounge(book.colors(cell[1])[1])
             if lounge:
                 yield full_name, _date_cls(year, month, day), lounge
 
@@ -585,6 +1202,22 @@ def resolve_hours(shift_obj):
     code = (shift_obj.shift_code or '').strip().upper().replace(' ', '')
     return float(SHIFT_HOURS_DEFAULT.get(code, 0))
 
+
+def _backfill_month_stats(conn):
+    """Разово заполнить user_month_stats по всем месяцам, где есть смены (пока таблица пуста)."""
+    if conn.execute(sqltext("SELECT 1 FROM user_month_stats LIMIT 1")).first() is not None:
+        return
+    lo, hi = conn.execute(sqltext("SELECT MIN(shift_date), MAX(shift_date) FROM shifts")).one()
+    if not lo:
+        return
+    lo, hi = _as_date(lo), _as_date(hi)
+    keys, y, m = set(), lo.year, lo.month
+    while (y, m) <= (hi.year, hi.month):
+        keys.add((None, y, m))
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+    _recompute_month_stats(conn, keys)
+    app.logger.info(f"user_month_stats backfilled: {len(keys)} months")
+
 def default_times_for_code(code: str):
     c = (code or '').strip().upper().replace(' ', '')
     if c in ('1','1/B','1B'):
@@ -596,14 +1229,16 @@ def default_times_for_code(code: str):
 import re
 
 
-from werkzeug.utils import secure_filename
-
 @app.post('/api/admin/lounge-from-xlsx')
 @jwt_required()
 def lounge_from_xlsx():
+    """
+    Проставляет coord_lounge координаторам по заливке клеток XLSX.
+    Файл читается из памяти; пользователи и смены месяца — двумя запросами,
+    сопоставление по name_key, запись — один executemany UPDATE только изменённых.
+    """
     # только админ
-    me = current_user()  # если у тебя есть util; иначе достань из JWT
-    if not me or (me.role or '').lower() != 'admin':
+    if not _perm('admin'):
         return jsonify({'error': 'Forbidden'}), 403
 
     year = int(request.form.get('year', '0') or 0)
@@ -612,39 +1247,54 @@ def lounge_from_xlsx():
     if not f or year < 2000 or year > 2100 or month < 1 or month > 12:
         return jsonify({'error': 'Bad input'}), 400
 
-    tmp_path = os.path.join(tempfile.gettempdir(), secure_filename(f.filename))
-    f.save(tmp_path)
+    # соберём (name_key, date) -> lounge из XLSX
+    wanted, names = {}, {}
+    try:
+        for full_name, d, lounge in _xlsx_iter_colored_office_cells(f.read(), year, month):
+            key = _norm(full_name)
+            names.setdefault(key, full_name)
+            wanted[(key, d)] = lounge
+    except Exception as e:
+        return jsonify({'error': f'Błąd odczytu XLSX: {e}'}), 400
 
-    # соберём (full_name,date)->lounge из XLSX
-    updates = []
-    for full_name, d, lounge in _xlsx_iter_colored_office_cells(tmp_path, year, month):
-        updates.append((full_name, d, lounge))
+    if not wanted:
+        return jsonify({'ok': True, 'updated': 0})
 
-    if not updates:
+    # 1) пользователи по name_key — только координаторы
+    coords = {k: u.id for k, u in _users_by_key(names.values()).items()
+              if (u.role or '').lower() == 'coordinator'}
+    if not coords:
         return jsonify({'ok': True, 'updated': 0})
+    key_by_uid = {uid: k for k, uid in coords.items()}
 
-    # Применяем к БД: только для координаторов
-    updated = 0
-    for full_name, d, lounge in updates:
-        u = db.session.query(User).filter(User.full_name == full_name).first()
-        if not u:
-            continue
-        if (u.role or '').lower() != 'coordinator':
-            continue
-        sh = (db.session.query(Shift)
-              .filter(Shift.user_id == u.id, Shift.shift_date == d)
-              .first())
-        if not sh:
+    # 2) их смены за месяц
+    first = _date(year, month, 1)
+    last  = _date(year, month, monthrange(year, month)[1])
+    shifts = (db.session.query(Shift.id, Shift.user_id, Shift.shift_date, Shift.coord_lounge)
+              .filter(Shift.user_id.in_(list(key_by_uid)), Shift.shift_date.between(first, last))
+              .all())
+
+    updated, changes = 0, []
+    for sid, uid, d, cur in shifts:
+        d = _as_date(d)
+        lounge = wanted.get((key_by_uid[uid], d))
+        if not lounge:
             continue
-        sh.coord_lounge = lounge  # 'mazurek'|'polonez'
         updated += 1
-
-    db.session.commit()
-    try:
-        os.remove(tmp_path)
-    except Exception:
-        pass
-    return jsonify({'ok': True, 'updated': updated})
+        if cur != lounge:
+            changes.append({'b_id': sid, 'b_lounge': lounge, 'd': d})
+
+    # 3) один UPDATE (executemany) + журнал для дельта-синхронизации
+    if changes:
+        _journal_lock(db.session)
+        t = Shift.__table__
+        db.session.execute(update(t).where(t.c.id == bindparam('b_id'))
+                           .values(coord_lounge=bindparam('b_lounge')),
+                           [{'b_id': c['b_id'], 'b_lounge': c['b_lounge']} for c in changes])
+        _journal_rows('update', [(c['b_id'], c['d']) for c in changes])
+        db.session.commit()
+        month_cache.invalidate(year, month)
+    return jsonify({'ok': True, 'updated': updated, 'changed': len(changes)})
 
 
 
@@ -689,25 +1339,118 @@ def parse_date_fuzzy(token, default_month=None, default_year=None):
         return None
 
 
-def _get_user_from_jwt():
-    """Возвращает (user_id, User) из JWT, без legacy Query.get()."""
-    claims = get_jwt() or {}
-    uid = int(claims["sub"])
-    u = db_get(User, uid)  # вместо User.query.get(uid)
-    return uid, u
-
-
 def _is_manager(user_or_id) -> bool:
     """Менеджер = роль admin/coordinator ИЛИ email в MANAGER_EMAILS."""
     u = user_or_id
     if isinstance(u, int):
-        u = User.query.get(u)
+        u = db_get(User, u)
     if not u:
         return False
     email = (u.email or '').strip().lower()
     role  = (u.role  or '').strip().lower()
     return (role in ('admin', 'coordinator')) or (email in MANAGER_EMAILS)
 
+
+# ---------------------------------
+# Права в claims токена
+# ---------------------------------
+# Права подписываются в токен при логине, проверка прав — без похода в БД.
+# Отзыв: users.token_version растёт при смене роли/флагов/email/пароля
+# (см. _user_flags_on_write; при ручном UPDATE в БД — увеличить token_version самому),
+# токен с другой версией → 401. Версии кешируются на воркер на AUTH_CACHE_TTL секунд.
+AUTH_CACHE_TTL = float(os.getenv('AUTH_CACHE_TTL', '30'))
+
+
+def _user_claims(u: User) -> dict:
+    role = (u.role or '').strip().lower()
+    return {
+        'role': u.role,
+        'full_name': u.full_name,
+        'tv': u.token_version or 0,
+        'admin': role == 'admin',
+        'manager': _is_manager(u),
+        'coordinator': is_coordinator_user(u),
+        'zmywak': is_zmiwaka_user(u),
+    }
+
+
+def _issue_token(u: User) -> str:
+    return create_access_token(identity=str(u.id), additional_claims=_user_claims(u))
+
+
+def _perm(name: str) -> bool:
+    """Право из claims ('admin'|'manager'|'coordinator'|'zmywak'); старые токены — через БД."""
+    claims = get_jwt() or {}
+    if name in claims:
+        return bool(claims[name])
+    u = current_user()
+    return bool(u and _user_claims(u)[name])
+
+
+def _perm_coord_or_admin() -> bool:
+    # то же, что _is_coord_or_admin(user), но по claims
+    return _perm('admin') or _perm('coordinator')
+
+
+class TokenVersions:
+    """
+    uid → token_version с коротким TTL: одна выборка на пользователя раз в AUTH_CACHE_TTL.
+    forget() зовётся после commit; выборка, начатая до него, в кэш уже не ляжет (поколения).
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._data = {}   # uid -> (version | None, expires_at)
+        self._gen = 0     # растёт на каждый forget
+        self._lock = threading.Lock()
+
+    def get(self, uid: int):
+        now = time.monotonic()
+        with self._lock:
+            hit = self._data.get(uid)
+            gen = self._gen
+        if hit and hit[1] > now:
+            return hit[0]
+        version = db.session.execute(
+            db.select(User.token_version).where(User.id == uid)
+        ).scalar_one_or_none()
+        with self._lock:
+            if gen == self._gen:
+                if len(self._data) > 5000:
+                    self._data.clear()
+                self._data[uid] = (version, now + self.ttl)
+        return version
+
+    def forget(self, uid: int):
+        with self._lock:
+            self._gen += 1
+            self._data.pop(uid, None)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _token_versions_forget(session):
+    for uid in session.info.pop('token_forget', ()):
+        token_versions.forget(uid)
+
+@event.listens_for(db.session, 'after_rollback')
+def _token_versions_keep(session):
+    session.info.pop('token_forget', None)
+
+
+token_versions = TokenVersions(AUTH_CACHE_TTL)
+
+
+@jwt.token_in_blocklist_loader
+def _token_revoked(jwt_header, jwt_payload) -> bool:
+    try:
+        uid = int(jwt_payload.get('sub'))
+    except (TypeError, ValueError):
+        return True
+    current = token_versions.get(uid)
+    if current is None:   # пользователь удалён
+        return True
+    return int(jwt_payload.get('tv', 0) or 0) != int(current or 0)
+
 def _shift_of(user_id, d: date):
     return Shift.query.filter(and_(Shift.user_id==user_id, Shift.shift_date==d)).first()
 
@@ -735,8 +1478,7 @@ def register():
             existing.email = email
             existing.password_hash = generate_password_hash(password)
             db.session.commit()
-            token = create_access_token(identity=str(existing.id),
-                                        additional_claims={'role': existing.role, 'full_name': existing.full_name})
+            token = _issue_token(existing)
             return jsonify({'access_token': token, 'user': existing.to_dict()})
         return jsonify({'error': 'Użytkownik o takim full_name już istnieje.'}), 400
 
@@ -744,8 +1486,7 @@ def register():
     user = User(email=email, password_hash=generate_password_hash(password), full_name=full_name, role=role)
     db.session.add(user); db.session.commit()
 
-    token = create_access_token(identity=str(user.id),
-                                additional_claims={'role': user.role, 'full_name': user.full_name})
+    token = _issue_token(user)
     return jsonify({'access_token': token, 'user': user.to_dict()})
 
 @app.post('/api/login')
@@ -761,8 +1502,7 @@ def login():
     if not user or not user.password_hash or not check_password_hash(user.password_hash, password):
         return jsonify({'error': 'Nieprawidłowy email lub hasło.'}), 401
 
-    token = create_access_token(identity=str(user.id),
-                                additional_claims={'role': user.role, 'full_name': user.full_name})
+    token = _issue_token(user)
     return jsonify({'access_token': token, 'user': user.to_dict()})
 
 # ---------------------------------
@@ -771,8 +1511,7 @@ def login():
 @app.get('/api/me/settings')
 @jwt_required()
 def me_settings_get():
-    uid = int(get_jwt()['sub'])
-    u = User.query.get(uid)
+    u = current_user()
     return jsonify({
         'hourly_rate_pln': float(u.hourly_rate_pln) if u and u.hourly_rate_pln is not None else None,
         'tax_percent': float(u.tax_percent or 0)
@@ -781,8 +1520,7 @@ def me_settings_get():
 @app.post('/api/me/settings')
 @jwt_required()
 def me_settings_set():
-    uid = int(get_jwt()['sub'])
-    u = User.query.get(uid)
+    u = current_user()
     data = request.get_json(force=True)
     try:
         rate = data.get('hourly_rate_pln', None)
@@ -845,9 +1583,9 @@ def password_change_before_login():
 @app.post('/api/control/late')
 @jwt_required()
 def control_add_late():
-    me = current_user()
-    if not _is_coord_or_admin(me):
+    if not _perm_coord_or_admin():
         return jsonify({'error':'Forbidden'}), 403
+    me_id = int(get_jwt()['sub'])
     data = request.get_json(force=True) or {}
     uid  = int(data.get('user_id') or 0)
     date_iso = (data.get('date') or '').strip()
@@ -856,7 +1594,7 @@ def control_add_late():
         d = datetime.fromisoformat(date_iso).date()
     except Exception:
         return jsonify({'error':'Bad date'}), 400
-    ev = ControlEvent(kind='late', user_id=uid, event_date=d, reason=reason, created_by_id=me.id)
+    ev = ControlEvent(kind='late', user_id=uid, event_date=d, reason=reason, created_by_id=me_id)
     db.session.add(ev); db.session.commit()
     return jsonify({'ok': True, 'event': ev.to_dict()})
     
@@ -864,9 +1602,9 @@ def control_add_late():
 @app.post('/api/control/extra')
 @jwt_required()
 def control_add_extra():
-    me = current_user()
-    if not _is_coord_or_admin(me):
+    if not _perm_coord_or_admin():
         return jsonify({'error':'Forbidden'}), 403
+    me_id = int(get_jwt()['sub'])
     data = request.get_json(force=True) or {}
     uid = int(data.get('user_id') or 0)
     date_iso = (data.get('date') or '').strip()
@@ -878,7 +1616,7 @@ def control_add_extra():
         d = datetime.fromisoformat(date_iso).date()
     except Exception:
         return jsonify({'error':'Bad date'}), 400
-    ev = ControlEvent(kind='extra', user_id=uid, event_date=d, reason=reason, hours=hours, created_by_id=me.id)
+    ev = ControlEvent(kind='extra', user_id=uid, event_date=d, reason=reason, hours=hours, created_by_id=me_id)
     db.session.add(ev); db.session.commit()
     return jsonify({'ok': True, 'event': ev.to_dict()})
 
@@ -886,9 +1624,9 @@ def control_add_extra():
 @app.post('/api/control/absence')
 @jwt_required()
 def control_add_absence():
-    me = current_user()
-    if not _is_coord_or_admin(me):
+    if not _perm_coord_or_admin():
         return jsonify({'error':'Forbidden'}), 403
+    me_id = int(get_jwt()['sub'])
     data = request.get_json(force=True) or {}
     uid = int(data.get('user_id') or 0)
     date_iso = (data.get('date') or '').strip()
@@ -897,7 +1635,7 @@ def control_add_absence():
         d = datetime.fromisoformat(date_iso).date()
     except Exception:
         return jsonify({'error':'Bad date'}), 400
-    ev = ControlEvent(kind='absence', user_id=uid, event_date=d, reason=reason, created_by_id=me.id)
+    ev = ControlEvent(kind='absence', user_id=uid, event_date=d, reason=reason, created_by_id=me_id)
     db.session.add(ev); db.session.commit()
     return jsonify({'ok': True, 'event': ev.to_dict()})
 
@@ -905,9 +1643,9 @@ def control_add_absence():
 @app.post('/api/control/add-shift')
 @jwt_required()
 def control_add_shift():
-    me = current_user()
-    if not _is_coord_or_admin(me):
+    if not _perm_coord_or_admin():
         return jsonify({'error':'Forbidden'}), 403
+    me_id = int(get_jwt()['sub'])
     data = request.get_json(force=True) or {}
     uid = int(data.get('user_id') or 0)
     date_iso = (data.get('date') or '').strip()
@@ -939,24 +1677,147 @@ def control_add_shift():
     db.session.add(sh)
 
     ev = ControlEvent(kind='manual_shift', user_id=uid, event_date=d, reason=reason,
-                      time_from=t_from, time_to=t_to, hours=hours, created_by_id=me.id)
+                      time_from=t_from, time_to=t_to, hours=hours, created_by_id=me_id)
     db.session.add(ev)
     db.session.commit()
+    _schedule_changed(d)
     return jsonify({'ok': True, 'event': ev.to_dict(), 'shift_id': sh.id})
 
 
 
-@app.get('/api/control/summary')
-@jwt_required()
-def control_summary():
-    # любой залогиненный может смотреть
+# ---------------------------------
+# Obsada (staffing): день × слот × зал
+# ---------------------------------
+STAFFING_NORM_DEFAULT = int(os.getenv('STAFFING_NORM_DEFAULT', '12'))
+STAFFING_RANGE_MAX = 400  # дней за запрос
+SLOTS = ('morning', 'evening')
+
+
+def _staffing_norms():
+    """{(weekday|None, lounge|None, slot): norm} из staffing_norms."""
+    return {(n.weekday, (n.lounge or None), n.slot): n.norm for n in StaffingNorm.query.all()}
+
+
+def _norm_for(norms, weekday, lounge, slot):
+    # точнее → общее: (день, зал) → (любой день, зал); для всего зала — дефолт
+    for key in ((weekday, lounge, slot), (None, lounge, slot)):
+        if key in norms:
+            return norms[key]
+    return STAFFING_NORM_DEFAULT if lounge is None else None
+
+
+def staffing_range(start, end):
+    """
+    Укомплектованность за [start, end]: один GROUP BY по (дата, слот, lounge, coord_lounge).
+    Слот — как в графике (_month_slot): код '2…' → evening, иначе morning.
+    """
+    from sqlalchemy import case
+    slot_expr = case((func.trim(Shift.shift_code).like('2%'), 'evening'), else_='morning')
+    lounge_expr = func.lower(func.coalesce(Shift.lounge, ''))
+    coord_expr = func.lower(func.coalesce(Shift.coord_lounge, ''))
+    rows = (db.session.query(Shift.shift_date, slot_expr, lounge_expr, coord_expr, func.count(Shift.id))
+            .filter(Shift.shift_date >= start, Shift.shift_date <= end)
+            .group_by(Shift.shift_date, slot_expr, lounge_expr, coord_expr)
+            .all())
+
+    per_day = {}
+    for d, slot, lounge, coord, cnt in rows:
+        day = per_day.setdefault(_as_date(d), {'total': Counter(), 'lounges': {}, 'coords': {}})
+        day['total'][slot] += cnt
+        day['lounges'].setdefault(lounge.strip() or None, Counter())[slot] += cnt
+        if coord.strip():
+            day['coords'].setdefault(slot, Counter())[coord.strip()] += cnt
+
+    norms = _staffing_norms()
+    norm_lounges = {lg for (_, lg, _) in norms if lg}
+    out = []
+    cur = start
+    while cur <= end:
+        day = per_day.get(cur, {'total': Counter(), 'lounges': {}, 'coords': {}})
+        wd = cur.weekday()
+        row = {'date': cur.isoformat()}
+        for slot in SLOTS:
+            n = _norm_for(norms, wd, None, slot)
+            row[slot] = day['total'][slot]
+            row[f'{slot}_norm'] = n
+            row[f'{slot}_delta'] = day['total'][slot] - n
+        lounges = {}
+        for lg in sorted((set(day['lounges']) | norm_lounges) - {None}):
+            cnt = day['lounges'].get(lg, Counter())
+            item = {}
+            for slot in SLOTS:
+                n = _norm_for(norms, wd, lg, slot)
+                item[slot] = cnt[slot]
+                item[f'{slot}_norm'] = n
+                item[f'{slot}_delta'] = None if n is None else cnt[slot] - n
+            lounges[lg] = item
+        row['lounges'] = lounges
+        row['coordinators'] = {slot: dict(day['coords'].get(slot, {})) for slot in SLOTS}
+        out.append(row)
+        cur += timedelta(days=1)
+    return out
+
+
+def _summary_range():
+    """?from=&to= (YYYY-MM-DD) или ?month=YYYY-MM (по умолчанию текущий месяц)."""
+    if request.args.get('from') or request.args.get('to'):
+        start = datetime.fromisoformat(request.args.get('from', '')).date()
+        end   = datetime.fromisoformat(request.args.get('to', '')).date()
+        return start, end
     month = (request.args.get('month') or '').strip()  # 'YYYY-MM'
     if not month:
         today = _date.today(); y, m = today.year, today.month
     else:
         y, m = map(int, month.split('-'))
-    start = _date(y, m, 1)
-    end   = _date(y, m, monthrange(y, m)[1])
+    return _date(y, m, 1), _date(y, m, monthrange(y, m)[1])
+
+
+@app.get('/api/control/norms')
+@jwt_required()
+def control_norms_get():
+    rows = StaffingNorm.query.order_by(StaffingNorm.lounge, StaffingNorm.weekday, StaffingNorm.slot).all()
+    return jsonify({'default': STAFFING_NORM_DEFAULT, 'norms': [n.to_dict() for n in rows]})
+
+
+@app.put('/api/control/norms')
+@jwt_required()
+def control_norms_set():
+    """Заменить весь набор норм: {norms: [{weekday, lounge, slot, norm}, ...]}."""
+    if not _perm('admin'):
+        return jsonify({'error': 'Forbidden'}), 403
+    items = (request.get_json(force=True) or {}).get('norms') or []
+    rows, seen = [], set()
+    try:
+        for it in items:
+            wd = it.get('weekday')
+            wd = None if wd in (None, '') else int(wd)
+            lounge = (it.get('lounge') or '').strip().lower() or None
+            slot = (it.get('slot') or '').strip().lower()
+            norm = int(it.get('norm'))
+            if (wd is not None and not 0 <= wd <= 6) or slot not in SLOTS or norm < 0:
+                raise ValueError
+            if (wd, lounge, slot) in seen:
+                raise ValueError
+            seen.add((wd, lounge, slot))
+            rows.append(StaffingNorm(weekday=wd, lounge=lounge, slot=slot, norm=norm))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Nieprawidłowe normy (weekday 0-6, slot morning/evening, norm ≥ 0, bez duplikatów).'}), 400
+    StaffingNorm.query.delete()
+    db.session.add_all(rows)
+    db.session.commit()
+    return jsonify({'ok': True, 'norms': [n.to_dict() for n in rows]})
+
+
+@app.get('/api/control/summary')
+@jwt_required()
+def control_summary():
+    # любой залогиненный может смотреть
+    try:
+        start, end = _summary_range()
+    except ValueError:
+        return jsonify({'error': 'Zły zakres dat.'}), 400
+    if end < start or (end - start).days >= STAFFING_RANGE_MAX:
+        return jsonify({'error': f'Zakres dat: maksymalnie {STAFFING_RANGE_MAX} dni.'}), 400
 
     # события
     evs = (ControlEvent.query
@@ -965,39 +1826,56 @@ def control_summary():
            .all())
     events = [e.to_dict() for e in evs]
 
-    # укомплектованность
-    # считаем списки людей по каждому дню и слоту
-    q = (db.session.query(Shift.shift_date, Shift.shift_code, func.count(Shift.id))
-         .filter(Shift.shift_date>=start, Shift.shift_date<=end)
-         .group_by(Shift.shift_date, Shift.shift_code))
-    counts = {}
-    for d, code, cnt in q.all():
-        key = d.isoformat()
-        slot = 'evening' if str(code or '').strip().upper().startswith('2') else 'morning'
-        c = counts.setdefault(key, {'morning':0,'evening':0})
-        c[slot] += int(cnt or 0)
-
-    NORM = 12
-    staffing = []
-    cur = start
-    while cur <= end:
-        iso = cur.isoformat()
-        c = counts.get(iso, {'morning':0,'evening':0})
-        staffing.append({
-            'date': iso,
-            'morning': c['morning'],
-            'evening': c['evening'],
-            'morning_delta': c['morning'] - NORM,
-            'evening_delta': c['evening'] - NORM,
-        })
-        cur = cur + timedelta(days=1)
-
-    return jsonify({'events': events, 'staffing': staffing})
+    return jsonify({'events': events, 'staffing': staffing_range(start, end)})
 
 
 
-@app.get('/api/my-stats')
-@jwt_required()
+def _stats_hours(uid, start, end, today):
+    """
+    (часов всего, часов отработано) за [start, end].
+    Целые прошедшие/будущие месяцы — из user_month_stats, края диапазона
+    и текущий месяц — одним агрегатом по shifts.
+    """
+    whole, edges = [], []
+    y, m = start.year, start.month
+    while (y, m) <= (end.year, end.month):
+        first, last = _date(y, m, 1), _date(y, m, monthrange(y, m)[1])
+        lo, hi = max(first, start), min(last, end)
+        if lo == first and hi == last and not (first <= today <= last):
+            whole.append((y, m))
+        else:
+            edges.append((lo, hi))
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+
+    total = done = 0.0
+    if whole:
+        rows = (db.session.query(UserMonthStats.year, UserMonthStats.month, UserMonthStats.hours)
+                .filter(UserMonthStats.user_id == uid,
+                        UserMonthStats.year >= whole[0][0], UserMonthStats.year <= whole[-1][0])
+                .all())
+        wanted = set(whole)
+        for ry, rm, h in rows:
+            if (ry, rm) in wanted:
+                total += float(h or 0)
+                if _date(ry, rm, 1) <= today:
+                    done += float(h or 0)
+    if edges:
+        _, resolved = _hours_sql()
+        ranges = ' OR '.join(f"shift_date BETWEEN :a{i} AND :b{i}" for i in range(len(edges)))
+        params = {'uid': uid, 'today': today}
+        for i, (lo, hi) in enumerate(edges):
+            params[f'a{i}'], params[f'b{i}'] = lo, hi
+        t, dn = db.session.execute(sqltext(f"""
+            SELECT SUM({resolved}), SUM(CASE WHEN shift_date <= :today THEN {resolved} ELSE 0 END)
+            FROM shifts WHERE user_id = :uid AND ({ranges})
+        """), params).one()
+        total += float(t or 0)
+        done  += float(dn or 0)
+    return round(total, 2), round(done, 2)
+
+
+@app.get('/api/my-stats')
+@jwt_required()
 def my_stats():
     uid = int(get_jwt()['sub'])
     month = (request.args.get('month') or '').strip()  # 'YYYY-MM'
@@ -1012,24 +1890,24 @@ def my_stats():
         except Exception:
             return jsonify({'error':'Zły zakres dat.'}), 400
 
-    shifts = (Shift.query
-              .filter(Shift.user_id==uid, Shift.shift_date>=start, Shift.shift_date<=end)
-              .order_by(Shift.shift_date.asc())
-              .all())
-
-    u = User.query.get(uid)
+    u = current_user()
     rate = float(u.hourly_rate_pln) if u and u.hourly_rate_pln is not None else 0.0
     tax  = float(u.tax_percent or 0)
 
     today = _date.today()
-    total_hours = 0
-    done_hours  = 0
+    total_hours, done_hours = _stats_hours(uid, start, end, today)
+
+    # ?daily=0 — только итоги (строки смен не читаем)
+    shifts = []
+    if request.args.get('daily', '1') != '0':
+        shifts = (Shift.query
+                  .filter(Shift.user_id==uid, Shift.shift_date>=start, Shift.shift_date<=end)
+                  .order_by(Shift.shift_date.asc())
+                  .all())
     daily = []
     for s in shifts:
         h = resolve_hours(s)
-        total_hours += h
         is_done = s.shift_date <= today
-        if is_done: done_hours += h
         gross = h * rate
         net   = gross * (1 - tax/100.0)
         daily.append({
@@ -1061,6 +1939,59 @@ def my_stats():
     })
 
 
+@app.get('/api/my-stats/year')
+@jwt_required()
+def my_stats_year():
+    """Помесячные итоги за год (YTD) — только строки user_month_stats."""
+    uid = int(get_jwt()['sub'])
+    try:
+        year = int(request.args.get('year') or _date.today().year)
+    except ValueError:
+        return jsonify({'error': 'Zły rok.'}), 400
+
+    u = current_user()
+    rate = float(u.hourly_rate_pln) if u and u.hourly_rate_pln is not None else 0.0
+    tax  = float(u.tax_percent or 0)
+
+    rows = (UserMonthStats.query
+            .filter(UserMonthStats.user_id == uid, UserMonthStats.year == year)
+            .order_by(UserMonthStats.month.asc())
+            .all())
+    months = []
+    for r in rows:
+        h = float(r.hours or 0)
+        gross = round(h * rate, 2)
+        months.append({
+            'month': f'{year:04d}-{r.month:02d}',
+            'shifts': r.shift_count,
+            'hours': h,
+            'scheduled_hours': float(r.scheduled_hours or 0),
+            'worked_hours': float(r.worked_hours or 0),
+            'logged': r.logged_count,
+            'gross': gross,
+            'net': round(gross * (1 - tax/100.0), 2),
+        })
+
+    today = _date.today()
+    hours_total = round(sum(x['hours'] for x in months), 2)
+    if year < today.year:
+        hours_done = hours_total
+    elif year > today.year:
+        hours_done = 0.0
+    else:
+        _, hours_done = _stats_hours(uid, _date(year, 1, 1), _date(year, 12, 31), today)
+    gross_done = round(hours_done * rate, 2)
+    return jsonify({
+        'year': year,
+        'rate_pln': rate, 'tax_percent': tax,
+        'hours_total': hours_total,
+        'hours_done': hours_done,
+        'gross_done': gross_done,
+        'net_done': round(gross_done * (1 - tax/100.0), 2),
+        'months': months,
+    })
+
+
 @app.get('/api/users')
 @jwt_required()
 def users_list():
@@ -1076,11 +2007,16 @@ def users_list():
 @jwt_required()
 def my_shifts():
     user_id = int((get_jwt() or {})["sub"])
+    # все даты пользователя: версия — голова журнала (max по PK)
+    head = db.session.query(func.max(ShiftChange.seq)).scalar() or 0
+    etag, not_modified = etag_precheck('my-shifts', user_id, head, _users_rev())
+    if not_modified:
+        return not_modified
     shifts = (Shift.query
               .filter(Shift.user_id == user_id)
               .order_by(Shift.shift_date.asc())
               .all())
-    return jsonify([s.to_dict() for s in shifts])
+    return json_etag([s.to_dict() for s in shifts], etag=etag)
 
 @app.get('/api/day-shifts')
 @jwt_required()
@@ -1092,21 +2028,31 @@ def day_shifts():
     except Exception:
         return jsonify({'error': 'Nieprawidłowa data.'}), 400
 
-    backend = db.engine.url.get_backend_name()
+    etag, not_modified = etag_precheck('day', d, _dates_token(d, d), _users_rev())
+    if not_modified:
+        return not_modified
+    q = (db.session.query(Shift, User)
+         .join(User, User.id == Shift.user_id)
+         .filter(Shift.shift_date == d))
+    day = _group_day(_order_by_user(q).all())
+    return json_etag({'date': d.isoformat(), 'morning': day['morning'], 'evening': day['evening']}, etag=etag)
 
-    base_q = Shift.query.join(User).filter(Shift.shift_date == d)
+
+def _order_by_user(q):
+    """Порядок как в графике: order_index (NULL в конце), потом имя."""
+    backend = db.engine.url.get_backend_name()
     if backend.startswith('postgresql'):
-        q = base_q.order_by(User.order_index.asc().nulls_last(), User.full_name.asc())
-    else:
-        from sqlalchemy import case
-        q = base_q.order_by(
-            case((User.order_index.is_(None), 1), else_=0),
-            User.order_index.asc(),
-            User.full_name.asc()
-        )
+        return q.order_by(User.order_index.asc().nulls_last(), User.full_name.asc())
+    from sqlalchemy import case
+    return q.order_by(
+        case((User.order_index.is_(None), 1), else_=0),
+        User.order_index.asc(),
+        User.full_name.asc()
+    )
 
-    rows = q.all()
 
+def _group_day(rows) -> dict:
+    """(Shift, User) одного дня → {'morning': [...], 'evening': [...]} в формате /api/day-shifts."""
     def is_evening(code: str) -> bool:
         return (code or '').strip().upper().startswith('2')
 
@@ -1114,8 +2060,7 @@ def day_shifts():
         return (code or '').strip().upper().startswith('1')
 
     morning, evening = [], []
-    for s in rows:
-        u = s.user
+    for s, u in rows:
         code = (s.shift_code or '').upper()
 
         # определяем текущий lounge
@@ -1145,84 +2090,103 @@ def day_shifts():
         elif is_morning(s.shift_code):
             morning.append(item)
 
-    return jsonify({'date': d.isoformat(), 'morning': morning, 'evening': evening})
+    return {'morning': morning, 'evening': evening}
 
 
 
 @app.route('/api/admin/control')
 @jwt_required()
 def admin_control():
-    claims = get_jwt()
-    if claims.get('role') not in ('admin', 'coordinator'):
+    """
+    Месячный отчёт контроля: обмены, переработки, отсутствия, баланс obsady.
+    Фиксированное число запросов (обмены, события, переработки из worklog, obsada ×2)
+    и только диапазоны по датам — индексы на датах работают.
+    """
+    if not _perm_coord_or_admin():
         return jsonify({'error': 'Brak uprawnień'}), 403
 
     ym = request.args.get('month', '')
-    year, month = map(int, ym.split('-')) if '-' in ym else (date.today().year, date.today().month)
-
-    # === 1. Swapy ===
-    swaps = Proposal.query.filter(
-        extract('year', Proposal.created_at) == year,
-        extract('month', Proposal.created_at) == month,
-        Proposal.status.in_(['accepted', 'approved'])
-    ).all()
-
+    try:
+        year, month = map(int, ym.split('-')) if '-' in ym else (date.today().year, date.today().month)
+        first = _date(year, month, 1)
+    except ValueError:
+        return jsonify({'error': 'Zły miesiąc (YYYY-MM).'}), 400
+    last = _date(year, month, monthrange(year, month)[1])
+    t0 = datetime(year, month, 1, tzinfo=timezone.utc)
+    t1 = datetime(year + (month == 12), month % 12 + 1, 1, tzinfo=timezone.utc)
+
+    # === 1. Swapy (zaakceptowane / zatwierdzone w tym miesiącu) ===
+    swaps = (SwapProposal.query
+             .options(joinedload(SwapProposal.requester), joinedload(SwapProposal.target_user))
+             .filter(SwapProposal.created_at >= t0, SwapProposal.created_at < t1,
+                     SwapProposal.status.in_(['accepted', 'approved']))
+             .order_by(SwapProposal.created_at.asc())
+             .all())
     swaps_data = [{
-        "date": s.created_at.strftime('%Y-%m-%d'),
+        "date": s.created_at.strftime('%Y-%m-%d') if s.created_at else None,
         "from": s.requester.full_name if s.requester else '?',
         "to": s.target_user.full_name if s.target_user else '?',
-        "shift_from": s.my_date,
-        "shift_to": s.their_date
+        "status": s.status,
+        "shift_from": s.my_date.isoformat(),
+        "shift_to": s.their_date.isoformat(),
     } for s in swaps]
 
-    # === 2. Extra godziny ===
-    extra = WorkLog.query.filter(
-        extract('year', WorkLog.date) == year,
-        extract('month', WorkLog.date) == month,
-        WorkLog.worked_hours > WorkLog.default_hours
-    ).all()
-    extra_data = [{
-        "date": w.date.strftime('%Y-%m-%d'),
-        "user": w.user.full_name if w.user else '?',
-        "shift": w.shift_code,
-        "extra": round(w.worked_hours - w.default_hours, 2),
-        "note": w.note or ''
-    } for w in extra]
-
-    # === 3. Nieobecności ===
-    missing = Attendance.query.filter(
-        extract('year', Attendance.date) == year,
-        extract('month', Attendance.date) == month,
-        Attendance.status == 'absent'
-    ).all()
-    missing_data = [{
-        "date": m.date.strftime('%Y-%m-%d'),
-        "user": m.user.full_name if m.user else '?',
-        "shift": m.shift_code,
-        "reason": m.reason or ''
-    } for m in missing]
-
-    # === 4. Bilans obsady ===
-    shifts = Shift.query.filter(
-        extract('year', Shift.shift_date) == year,
-        extract('month', Shift.shift_date) == month
-    ).all()
-    daily = {}
-    for s in shifts:
-        key = s.shift_date.isoformat()
-        if key not in daily:
-            daily[key] = {'rano': 0, 'popo': 0}
-        if s.shift_code.lower().startswith('1'):
-            daily[key]['rano'] += 1
-        elif s.shift_code.lower().startswith('2'):
-            daily[key]['popo'] += 1
+    # === 2–3. Zdarzenia kontroli: extra + absence ===
+    evs = (ControlEvent.query
+           .options(joinedload(ControlEvent.user))
+           .filter(ControlEvent.event_date >= first, ControlEvent.event_date <= last,
+                   ControlEvent.kind.in_(['extra', 'absence']))
+           .order_by(ControlEvent.event_date.asc(), ControlEvent.created_at.asc())
+           .all())
+    extra_data, missing_data = [], []
+    for e in evs:
+        item = {
+            "date": e.event_date.isoformat(),
+            "user": e.user.full_name if e.user else '?',
+            "reason": e.reason or '',
+        }
+        if e.kind == 'extra':
+            item.update(source='event', shift=None,
+                        extra=round(float(e.hours or 0), 2), note=e.reason or '')
+            extra_data.append(item)
+        else:
+            item['shift'] = None
+            missing_data.append(item)
+
+    # nadgodziny z worklog: worked_hours ponad plan zmiany (plan jak w resolve_hours)
+    planned, _ = _hours_sql()
+    rows = db.session.execute(sqltext(f"""
+        SELECT s.shift_date, u.full_name, s.shift_code, s.worked_hours, {planned} AS planned, s.work_note
+        FROM shifts s JOIN users u ON u.id = s.user_id
+        WHERE s.shift_date BETWEEN :d1 AND :d2
+          AND s.worked_hours IS NOT NULL
+          AND {planned} > 0 AND s.worked_hours > {planned}
+        ORDER BY s.shift_date, u.full_name
+    """), {'d1': first, 'd2': last}).all()
+    for d, full_name, code, worked, plan, note in rows:
+        extra_data.append({
+            "date": _as_date(d).isoformat(),
+            "user": full_name,
+            "shift": code,
+            "extra": round(float(worked) - float(plan), 2),
+            "note": note or '',
+            "source": 'worklog',
+        })
+    extra_data.sort(key=lambda x: x['date'])
+
+    # === 4. Bilans obsady (tylko dni z grafikiem) ===
     imbalance_data = []
-    for d, v in daily.items():
-        if v['rano'] != 12 or v['popo'] != 12:
+    for r in staffing_range(first, last):
+        if not (r['morning'] or r['evening']):
+            continue
+        if r['morning_delta'] or r['evening_delta']:
             imbalance_data.append({
-                'date': d,
-                'rano': v['rano'],
-                'popo': v['popo'],
-                'status': 'niedobór' if v['rano'] < 12 or v['popo'] < 12 else 'nadwyżka'
+                'date': r['date'],
+                'rano': r['morning'],
+                'popo': r['evening'],
+                'rano_norm': r['morning_norm'],
+                'popo_norm': r['evening_norm'],
+                'status': 'niedobór' if r['morning_delta'] < 0 or r['evening_delta'] < 0 else 'nadwyżka',
             })
 
     return jsonify({
@@ -1238,6 +2202,11 @@ def admin_control():
 def month_shifts():
     """Возвращает весь месяц пачкой: {"YYYY-MM-DD": {"morning":[...], "evening":[...]}, ...}.
        Координатор = только если в этой смене есть coord_lounge.
+       Готовое тело ответа и его ETag кэшируются в month_cache до первой записи в этот месяц
+       (в любом воркере: перед отдачей сверяется токен месяца из журнала).
+       ?format=compact — колоночный формат (см. _compact_month_doc).
+       seq журнала, на котором собран документ: поле "seq" в compact и заголовок X-Shift-Seq —
+       с него клиент продолжает дельтой /api/shifts/changes.
     """
     try:
         y = int(request.args.get('year', '0'))
@@ -1248,6 +2217,28 @@ def month_shifts():
     if y < 2000 or y > 2100 or m < 1 or m > 12:
         return jsonify({'error': 'Bad year/month'}), 400
 
+    fmt = 'compact' if (request.args.get('format') or '').strip().lower() == 'compact' else 'full'
+
+    token = _month_token(y, m)
+    entry = month_cache.get(y, m, token)
+    if entry is None:
+        version = month_cache.version(y, m)
+        # голову журнала читаем в той же транзакции и ДО смен: всё, что закоммитят после,
+        # имеет seq больше и придёт дельтой (повтор upsert/delete безвреден)
+        seq = db.session.query(func.max(ShiftChange.seq)).scalar() or 0
+        entry = {'seq': seq, 'doc': _build_month_doc(y, m)}
+        month_cache.put(y, m, version, token, entry)
+    if fmt not in entry:
+        # тела форматов сериализуются лениво, по первому запросу, и живут вместе с документом
+        entry[fmt] = _json_body(dict(_compact_month_doc(entry['doc']), seq=entry['seq'])
+                                if fmt == 'compact' else entry['doc'])
+    body, etag = entry[fmt]
+    resp = json_etag(body=body, etag=etag)
+    resp.headers['X-Shift-Seq'] = str(entry['seq'])
+    return resp
+
+
+def _build_month_doc(y: int, m: int) -> dict:
     first = _date(y, m, 1)
     last  = _date(y, m, monthrange(y, m)[1])
 
@@ -1259,31 +2250,154 @@ def month_shifts():
     out = {}
     for sh, u in q.all():
         iso  = sh.shift_date.isoformat()
-        slot = 'evening' if str(sh.shift_code or '').strip().startswith('2') else 'morning'
         out.setdefault(iso, {'morning': [], 'evening': []})
+        out[iso][_month_slot(sh.shift_code)].append(_month_item(sh, u))
 
-        code = (sh.shift_code or '').upper()
-        lounge = getattr(sh, 'lounge', None)
-        coord_lounge = (getattr(sh, 'coord_lounge', None) or '').strip().lower() or None
+    return out
 
-        is_bar = 'B' in code
-        is_zmiwak = is_zmiwaka_user(u)
-        is_coord_today = bool(coord_lounge)  # <--- фиксация
 
-        out[iso][slot].append({
-            'user_id': u.id,
-            'full_name': u.full_name,
-            'shift_code': sh.shift_code,
-            'hours': sh.hours,
-            'order_index': getattr(u, 'order_index', None),
-            'is_coordinator': is_coord_today,
-            'is_zmiwaka': is_zmiwak,
-            'is_bar_today': is_bar,
-            'lounge': lounge,
-            'coord_lounge': coord_lounge,
+def _compact_month_doc(doc: dict) -> dict:
+    """
+    Колоночный вариант документа месяца: справочники один раз, по дням — только индексы.
+      users:   {"id":[...], "full_name":[...], "order_index":[...], "is_zmiwaka":[...]}
+      codes:   ["1", "2", "1/B", ...]
+      lounges: [null, "mazurek", "polonez", ...]
+      days:    {"YYYY-MM-DD": {"morning": {"i":[shift_id], "u":[user], "c":[code], "l":[lounge], "k":[coord_lounge]}, "evening": {...}}}
+    "h" (часы) есть в слоте, только если хоть у кого-то hours не пустые.
+    is_bar_today = 'B' в коде, is_coordinator = k != 0 — клиент выводит их сам.
+    """
+    users = {'id': [], 'full_name': [], 'order_index': [], 'is_zmiwaka': []}
+    user_idx, codes, code_idx = {}, [], {}
+    lounges, lounge_idx = [None, 'mazurek', 'polonez'], {None: 0, 'mazurek': 1, 'polonez': 2}
+
+    def _idx(table, index, value):
+        i = index.get(value)
+        if i is None:
+            i = index[value] = len(table)
+            table.append(value)
+        return i
+
+    days = {}
+    for iso, slots in doc.items():
+        day = days[iso] = {}
+        for slot, items in slots.items():
+            col = {'i': [], 'u': [], 'c': [], 'l': [], 'k': []}
+            hours = []
+            for it in items:
+                uid = it['user_id']
+                ui = user_idx.get(uid)
+                if ui is None:
+                    ui = user_idx[uid] = len(users['id'])
+                    users['id'].append(uid)
+                    users['full_name'].append(it['full_name'])
+                    users['order_index'].append(it['order_index'])
+                    users['is_zmiwaka'].append(1 if it['is_zmiwaka'] else 0)
+                col['i'].append(it['id'])
+                col['u'].append(ui)
+                col['c'].append(_idx(codes, code_idx, it['shift_code']))
+                col['l'].append(_idx(lounges, lounge_idx, it['lounge']))
+                col['k'].append(_idx(lounges, lounge_idx, it['coord_lounge']))
+                hours.append(it['hours'])
+            if any(h is not None for h in hours):
+                col['h'] = hours
+            day[slot] = col
+
+    return {'format': 'compact', 'users': users, 'codes': codes, 'lounges': lounges, 'days': days}
+
+
+def _month_slot(code) -> str:
+    return 'evening' if str(code or '').strip().startswith('2') else 'morning'
+
+
+def _month_item(sh, u) -> dict:
+    """Одна запись дня в формате /api/month-shifts (и /api/shifts/changes)."""
+    code = (sh.shift_code or '').upper()
+    lounge = getattr(sh, 'lounge', None)
+    coord_lounge = (getattr(sh, 'coord_lounge', None) or '').strip().lower() or None
+
+    is_bar = 'B' in code
+    is_zmiwak = is_zmiwaka_user(u)
+    is_coord_today = bool(coord_lounge)  # <--- фиксация
+
+    return {
+        'id': sh.id,
+        'user_id': u.id,
+        'full_name': u.full_name,
+        'shift_code': sh.shift_code,
+        'hours': sh.hours,
+        'order_index': getattr(u, 'order_index', None),
+        'is_coordinator': is_coord_today,
+        'is_zmiwaka': is_zmiwak,
+        'is_bar_today': is_bar,
+        'lounge': lounge,
+        'coord_lounge': coord_lounge,
+    }
+
+
+SHIFT_CHANGES_LIMIT = 2000
+DAYS_RANGE_MAX = 62  # дней за запрос /api/days
+
+@app.get('/api/shifts/changes')
+@jwt_required()
+def shift_changes():
+    """
+    Дельта графика с момента ?since=<seq>:
+      {"seq": N, "reset": false, "changes": [{"seq","op":"upsert"|"delete","id","date","slot","item"}]}
+    Без since — только текущий seq. Точку отсчёта для месяца берите из самого /api/month-shifts (seq).
+    reset=true — журнал уже не покрывает since (или изменений слишком много): клиент перезагружает месяц.
+    """
+    head = db.session.query(func.max(ShiftChange.seq)).scalar() or 0
+    raw = (request.args.get('since') or '').strip()
+    if not raw:
+        return jsonify({'seq': head, 'reset': False, 'changes': []})
+    try:
+        since = int(raw)
+    except ValueError:
+        return jsonify({'error': 'Bad since'}), 400
+    if since < 0 or since > head:
+        return jsonify({'seq': head, 'reset': True, 'changes': []})
+
+    oldest = db.session.query(func.min(ShiftChange.seq)).scalar()
+    if oldest is not None and since < oldest - 1:
+        return jsonify({'seq': head, 'reset': True, 'changes': []})
+
+    rows = (db.session.query(ShiftChange)
+            .filter(ShiftChange.seq > since, ShiftChange.seq <= head)
+            .order_by(ShiftChange.seq.asc())
+            .limit(SHIFT_CHANGES_LIMIT + 1)
+            .all())
+    if len(rows) > SHIFT_CHANGES_LIMIT:
+        return jsonify({'seq': head, 'reset': True, 'changes': []})
+
+    # схлопываем: по каждой смене важна только последняя операция
+    last = {}
+    for ch in rows:
+        last.pop(ch.shift_id, None)
+        last[ch.shift_id] = ch
+
+    alive_ids = [sid for sid, ch in last.items() if ch.op != 'delete']
+    current = {}
+    if alive_ids:
+        q = (db.session.query(Shift, User)
+             .join(User, User.id == Shift.user_id)
+             .filter(Shift.id.in_(alive_ids)))
+        current = {sh.id: (sh, u) for sh, u in q.all()}
+
+    changes = []
+    for sid, ch in last.items():
+        pair = current.get(sid)
+        if pair is None:
+            changes.append({'seq': ch.seq, 'op': 'delete', 'id': sid, 'date': ch.shift_date.isoformat()})
+            continue
+        sh, u = pair
+        changes.append({
+            'seq': ch.seq, 'op': 'upsert', 'id': sid,
+            'date': sh.shift_date.isoformat(),
+            'slot': _month_slot(sh.shift_code),
+            'item': _month_item(sh, u),
         })
 
-    return jsonify(out)
+    return jsonify({'seq': head, 'reset': False, 'changes': changes})
 
 
 
@@ -1347,6 +2461,9 @@ def my_shifts_brief():
     start = date(y, m, 1)
     end   = date(y, m, monthrange(y, m)[1])
 
+    etag, not_modified = etag_precheck('my-brief', uid, start, _dates_token(start, end))
+    if not_modified:
+        return not_modified
     rows = (Shift.query
             .filter(Shift.user_id==uid, Shift.shift_date>=start, Shift.shift_date<=end)
             .order_by(Shift.shift_date.asc())
@@ -1362,7 +2479,7 @@ def my_shifts_brief():
             'worked_hours': float(s.worked_hours) if s.worked_hours is not None else None,
             'note_preview': (s.work_note[:120] + '…') if s.work_note and len(s.work_note) > 120 else (s.work_note or '')
         })
-    return jsonify(out)
+    return json_etag(out, etag=etag)
 
 @app.get("/api/day/coworkers-shifts")
 @jwt_required()
@@ -1522,6 +2639,8 @@ def day_notes_add():
         created_at=datetime.now(timezone.utc)   # <<< КЛЮЧЕВОЕ
     )
     db.session.add(note)
+    db.session.flush()
+    _emit('note', {'id': note.id, 'date': d}, everyone=True)
     db.session.commit()
     return jsonify(note.to_dict()), 201
 
@@ -1535,8 +2654,57 @@ def day_notes_delete(nid):
         return jsonify({'error':'Nie znaleziono'}), 404
     if uid != note.author_id:
         return jsonify({'error':'Tylko autor może usunąć notatkę.'}), 403
+    _emit('note', {'id': note.id, 'date': note.note_date.isoformat()}, everyone=True)
     db.session.delete(note); db.session.commit()
     return jsonify({'ok': True})
+
+
+@app.get('/api/days')
+@jwt_required()
+def days_range():
+    """
+    Смены и заметки за диапазон дат одним запросом (две выборки):
+      {"YYYY-MM-DD": {"morning": [...], "evening": [...], "notes": [...]}, ...}
+    Группировка смен — как в /api/day-shifts, заметки — как в /api/day-notes.
+    """
+    try:
+        d_from = datetime.fromisoformat(request.args.get('from', '')).date()
+        d_to   = datetime.fromisoformat(request.args.get('to', '')).date()
+    except Exception:
+        return jsonify({'error': 'Nieprawidłowa data.'}), 400
+    if d_to < d_from or (d_to - d_from).days >= DAYS_RANGE_MAX:
+        return jsonify({'error': f'Zakres dat: maksymalnie {DAYS_RANGE_MAX} dni.'}), 400
+
+    # заметки не журналируются; их только добавляют и удаляют — хватает (count, max id)
+    notes_rev = tuple(db.session.query(func.count(DayNote.id), func.max(DayNote.id))
+                      .filter(DayNote.note_date >= d_from, DayNote.note_date <= d_to).one())
+    etag, not_modified = etag_precheck('days', d_from, d_to, _dates_token(d_from, d_to),
+                                       notes_rev, _users_rev())
+    if not_modified:
+        return not_modified
+    q = (db.session.query(Shift, User)
+         .join(User, User.id == Shift.user_id)
+         .filter(Shift.shift_date >= d_from, Shift.shift_date <= d_to))
+    by_day = {}
+    for sh, u in _order_by_user(q).all():
+        by_day.setdefault(sh.shift_date, []).append((sh, u))
+
+    notes = (db.session.query(DayNote)
+             .options(joinedload(DayNote.author))
+             .filter(DayNote.note_date >= d_from, DayNote.note_date <= d_to)
+             .order_by(DayNote.note_date.asc(), DayNote.created_at.asc())
+             .all())
+    notes_by_day = {}
+    for n in notes:
+        notes_by_day.setdefault(n.note_date, []).append(n.to_dict())
+
+    out = {}
+    for i in range((d_to - d_from).days + 1):
+        d = d_from + timedelta(days=i)
+        day = _group_day(by_day.get(d, []))
+        day['notes'] = notes_by_day.get(d, [])
+        out[d.isoformat()] = day
+    return json_etag(out, etag=etag)
 # -------- /Day Notes --------
 
 # -------- Worklog --------
@@ -1572,6 +2740,7 @@ def my_shift_save_worklog(sid):
             s.worked_hours = float(worked_hours)
         s.work_note = note or None
         db.session.commit()
+        _schedule_changed(s.shift_date)
         return jsonify({'ok': True, 'worked_hours': float(s.worked_hours) if s.worked_hours is not None else None})
     except Exception as e:
         db.session.rollback()
@@ -1613,7 +2782,7 @@ def create_proposal():
       - на разных датах проверяем отсутствие второй смены в целевой дате у каждого
       - защита от дубликатных pending
     """
-    user_id, _ = _get_user_from_jwt()
+    user_id = int(get_jwt()['sub'])
     data = request.get_json(force=True) or {}
 
     # --- Новый путь: по ID смен
@@ -1689,65 +2858,142 @@ def create_proposal():
         their_date=their_date,
         status='pending'
     )
-    db.session.add(sp); db.session.commit()
+    db.session.add(sp); db.session.flush()
+    _emit_proposal(sp)
+    db.session.commit()
     return jsonify({'proposal': sp.to_dict()})
 
 
+# --- списки с keyset-пагинацией: по id, новые сверху ---
+PAGE_DEFAULT = 50
+PAGE_MAX = 200
+PROPOSAL_STATUSES = ['pending', 'accepted', 'declined', 'approved', 'rejected', 'canceled']
+
+
+def _list_args(allowed_statuses):
+    """
+    limit, статусы, окно по created_at [from, to] из query string. ValueError — плохие параметры.
+    Без limit и cursor — limit=None: весь список, как до пагинации (старые вызовы без параметров).
+    """
+    if request.args.get('limit'):
+        limit = max(1, min(int(request.args['limit']), PAGE_MAX))
+    else:
+        limit = PAGE_DEFAULT if request.args.get('cursor') else None
+    statuses = [x.strip() for x in (request.args.get('status') or '').split(',') if x.strip()]
+    if any(x not in allowed_statuses for x in statuses):
+        raise ValueError('status')
+    d_from = request.args.get('from')
+    d_to = request.args.get('to')
+    t_from = datetime.fromisoformat(d_from).replace(tzinfo=timezone.utc) if d_from else None
+    t_to = (datetime.fromisoformat(d_to) + timedelta(days=1)).replace(tzinfo=timezone.utc) if d_to else None
+    return limit, statuses, t_from, t_to
+
+
+def _window(q, model, t_from, t_to):
+    if t_from is not None:
+        q = q.filter(model.created_at >= t_from)
+    if t_to is not None:
+        q = q.filter(model.created_at < t_to)
+    return q
+
+
+def _keyset_page(q, model, cursor, limit):
+    """
+    Страница после строки cursor (её id). Порядок — по id: он растёт вместе с created_at
+    (server_default now()), но не бывает NULL, так что старые строки без даты не рвут курсор.
+    limit=None — все строки. Возвращает (rows, next_cursor | None).
+    """
+    if cursor:
+        q = q.filter(model.id < cursor)
+    q = q.order_by(model.id.desc())
+    if limit is None:
+        return q.all(), None
+    rows = q.limit(limit + 1).all()
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1].id
+    return rows, None
+
+
+def _status_counts(q, model):
+    return {st: n for st, n in q.with_entities(model.status, func.count(model.id)).group_by(model.status).all()}
+
+
 @app.get('/api/proposals')
 @jwt_required()
 def list_proposals():
-    uid, user = _get_user_from_jwt()
-
-    incoming = (SwapProposal.query
-                .filter(and_(SwapProposal.target_user_id == uid,
-                             SwapProposal.status.in_(['pending', 'accepted', 'declined', 'approved', 'rejected', 'canceled'])))
-                .order_by(SwapProposal.created_at.desc())
-                .all())
+    """
+    ?box=incoming|outgoing|for_approval&cursor=<id> — следующая страница одного списка;
+    ?status=pending,accepted  ?from=&to= (дата создания)  ?limit= (с cursor — 50; без обоих — всё);
+    ?counts=1 — только счётчики по статусам (бейджи).
+    """
+    uid = int(get_jwt()['sub'])
+    is_manager = _perm('manager')
+    try:
+        limit, statuses, t_from, t_to = _list_args(PROPOSAL_STATUSES)
+        cursor = int(request.args.get('cursor') or 0)
+    except ValueError:
+        return jsonify({'error': 'Nieprawidłowe parametry listy.'}), 400
 
-    outgoing = (SwapProposal.query
-                .filter(and_(SwapProposal.requester_id == uid,
-                             SwapProposal.status.in_(['pending', 'accepted', 'declined', 'approved', 'rejected', 'canceled'])))
-                .order_by(SwapProposal.created_at.desc())
-                .all())
+    def base(*cond):
+        q = SwapProposal.query.filter(*cond,
+                                      SwapProposal.status.in_(statuses or PROPOSAL_STATUSES))
+        return _window(q, SwapProposal, t_from, t_to)
 
-    resp = {
-        'incoming': [p.to_dict() for p in incoming],
-        'outgoing': [p.to_dict() for p in outgoing],
+    boxes = {
+        'incoming': lambda: base(SwapProposal.target_user_id == uid),
+        'outgoing': lambda: base(SwapProposal.requester_id == uid),
     }
-
-    if _is_manager(user):
-        queue = (SwapProposal.query
-                 .filter(SwapProposal.status == 'accepted')
-                 .order_by(SwapProposal.created_at.desc())
-                 .all())
-        resp['for_approval'] = [p.to_dict() for p in queue]
-        resp['to_approve']   = resp['for_approval']  # alias
-    else:
-        resp['for_approval'] = []
-
+    if is_manager:
+        boxes['for_approval'] = lambda: _window(SwapProposal.query.filter(SwapProposal.status == 'accepted'),
+                                                SwapProposal, t_from, t_to)
+
+    if request.args.get('counts') == '1':
+        out = {'incoming': _status_counts(boxes['incoming'](), SwapProposal),
+               'outgoing': _status_counts(boxes['outgoing'](), SwapProposal)}
+        out['for_approval'] = boxes['for_approval']().count() if is_manager else 0
+        return jsonify(out)
+
+    only = request.args.get('box')
+    if only and only not in ('incoming', 'outgoing', 'for_approval'):
+        return jsonify({'error': 'Nieprawidłowe parametry listy.'}), 400
+
+    resp, nxt = {}, {}
+    for name, make in boxes.items():
+        if only and name != only:
+            continue
+        rows, nxt[name] = _keyset_page(_with_proposal_refs(make()), SwapProposal,
+                                       cursor if only else 0, limit)
+        resp[name] = [p.to_dict() for p in rows]
+
+    if not only or only == 'for_approval':
+        resp.setdefault('for_approval', [])
+        resp['to_approve'] = resp['for_approval']  # alias
+    resp['next'] = nxt
     return jsonify(resp)
 
 @app.post('/api/proposals/<int:pid>/cancel')
 @jwt_required()
 def cancel_proposal(pid):
-    user_id, _ = _get_user_from_jwt()
+    user_id = int(get_jwt()['sub'])
     p = SwapProposal.query.get(pid)
     if not p: return jsonify({'error': 'Nie znaleziono.'}), 404
     if p.requester_id != user_id: return jsonify({'error': 'Tylko autor może anulować.'}), 403
     if p.status != 'pending': return jsonify({'error': 'Propozycja została już rozpatrzona.'}), 400
     p.status = 'canceled'
+    _emit_proposal(p)
     db.session.commit()
     return jsonify({'proposal': p.to_dict()})
 
 @app.post('/api/proposals/<int:pid>/decline')
 @jwt_required()
 def decline_proposal(pid):
-    user_id, _ = _get_user_from_jwt()
+    user_id = int(get_jwt()['sub'])
     p = SwapProposal.query.get(pid)
     if not p: return jsonify({'error': 'Nie znaleziono.'}), 404
     if p.target_user_id != user_id: return jsonify({'error': 'Możesz odrzucać tylko swoje przychodzące propozycje.'}), 403
     if p.status != 'pending': return jsonify({'error': 'Propozycja została już rozpatrzona.'}), 400
     p.status = 'declined'
+    _emit_proposal(p)
     db.session.commit()
     return jsonify({'proposal': p.to_dict()})
 
@@ -1755,7 +3001,7 @@ def decline_proposal(pid):
 @jwt_required()
 def accept_proposal(pid):
     # Получатель подтверждает → только статус accepted, БЕЗ обмена сменами
-    user_id, _ = _get_user_from_jwt()
+    user_id = int(get_jwt()['sub'])
     p = SwapProposal.query.get(pid)
     if not p: 
         return jsonify({'error': 'Nie znaleziono.'}), 404
@@ -1781,14 +3027,14 @@ def accept_proposal(pid):
             return jsonify({'error': 'Pracownik ma już zmianę w docelowym dniu.'}), 409
 
     p.status = 'accepted'
+    _emit_proposal(p)
     db.session.commit()
     return jsonify({'proposal': p.to_dict()})
 
 @app.post('/api/proposals/<int:pid>/approve')
 @jwt_required()
 def approve_proposal(pid):
-    _, user = _get_user_from_jwt()
-    if not _is_manager(user):
+    if not _perm('manager'):
         return jsonify({'error': 'Tylko przełożony może zatwierdzać.'}), 403
 
     p = db_get(SwapProposal, pid)
@@ -1803,6 +3049,7 @@ def approve_proposal(pid):
     def reject_with(reason, code=409):
         try:
             p.status = 'rejected'
+            _emit_proposal(p)
             db.session.commit()
         except Exception:
             db.session.rollback()
@@ -1822,7 +3069,9 @@ def approve_proposal(pid):
         s_req.shift_code, s_tgt.shift_code = s_tgt.shift_code, s_req.shift_code
         s_req.hours,      s_tgt.hours      = s_tgt.hours,      s_req.hours
         p.status = 'approved'
+        _emit_proposal(p)
         db.session.commit()
+        _schedule_changed(p.my_date)
         return jsonify({'proposal': p.to_dict()})
 
     # --- РАЗНЫЕ ДАТЫ: обычный своп владельцев
@@ -1835,18 +3084,19 @@ def approve_proposal(pid):
     try:
         s_req.user_id, s_tgt.user_id = p.target_user_id, p.requester_id
         p.status = 'approved'
+        _emit_proposal(p)
         db.session.commit()
     except IntegrityError:
         db.session.rollback()
         return reject_with('Zmiany uległy zmianie — wymiana niemożliwa.', code=409)
 
+    _schedule_changed(p.my_date, p.their_date)
     return jsonify({'proposal': p.to_dict()})
 
 @app.post('/api/proposals/<int:pid>/reject')
 @jwt_required()
 def reject_proposal(pid):
-    _, user = _get_user_from_jwt()
-    if not _is_manager(user):
+    if not _perm('manager'):
         return jsonify({'error': 'Tylko przełożony może odrzucać.'}), 403
     p = SwapProposal.query.get(pid)
     if not p:
@@ -1854,6 +3104,7 @@ def reject_proposal(pid):
     if p.status != 'accepted':
         return jsonify({'error': 'Propozycja nie jest w stanie do odrzucenia.'}), 400
     p.status = 'rejected'
+    _emit_proposal(p)
     db.session.commit()
     return jsonify({'proposal': p.to_dict()})
 
@@ -1867,7 +3118,7 @@ def market_offer_create(shift_id):
     sh = Shift.query.get(shift_id)
     if not sh:
         return jsonify({'error':'Nie znaleziono zmiany'}), 404
-    if sh.user_id != uid and (get_jwt().get('role','').lower() != 'admin'):
+    if sh.user_id != uid and not _perm('admin'):
         return jsonify({'error':'To nie jest Twoja zmiana'}), 403
 
     # уже есть оффер? — не роняем 500
@@ -1878,6 +3129,8 @@ def market_offer_create(shift_id):
     mo = MarketOffer(shift_id=shift_id, owner_id=uid, candidate_id=None, status='open')
     db.session.add(mo)
     try:
+        db.session.flush()
+        _emit_market(mo, public=True)
         db.session.commit()
     except IntegrityError:
         db.session.rollback()
@@ -1892,19 +3145,43 @@ def market_offer_create(shift_id):
 @app.get('/api/market/offers')
 @jwt_required()
 def market_offers_list():
+    """
+    'open' — чужие открытые, 'mine' — мои; пагинация как у /api/proposals
+    (?box=open|mine&cursor=<id>, ?limit=, ?from=&to=, ?status= для mine, ?counts=1).
+    """
     uid = int(get_jwt()['sub'])
-    open_offers = (MarketOffer.query
-                   .filter(MarketOffer.status=='open', MarketOffer.owner_id != uid)
-                   .order_by(MarketOffer.created_at.desc())
-                   .all())
-    my_offers = (MarketOffer.query
-                 .filter(MarketOffer.owner_id==uid, MarketOffer.status.in_(['open','requested','approved','rejected']))
-                 .order_by(MarketOffer.created_at.desc())
-                 .all())
-    return jsonify({
-        'open': [o.to_dict() for o in open_offers],
-        'mine': [o.to_dict() for o in my_offers]
-    })
+    mine_statuses = ['open', 'requested', 'approved', 'rejected']
+    try:
+        limit, statuses, t_from, t_to = _list_args(mine_statuses)
+        cursor = int(request.args.get('cursor') or 0)
+    except ValueError:
+        return jsonify({'error': 'Nieprawidłowe parametry listy.'}), 400
+
+    boxes = {
+        'open': lambda: _window(MarketOffer.query.filter(MarketOffer.status=='open', MarketOffer.owner_id != uid),
+                                MarketOffer, t_from, t_to),
+        'mine': lambda: _window(MarketOffer.query.filter(MarketOffer.owner_id==uid,
+                                                         MarketOffer.status.in_(statuses or mine_statuses)),
+                                MarketOffer, t_from, t_to),
+    }
+
+    if request.args.get('counts') == '1':
+        return jsonify({'open': boxes['open']().count(),
+                        'mine': _status_counts(boxes['mine'](), MarketOffer)})
+
+    only = request.args.get('box')
+    if only and only not in boxes:
+        return jsonify({'error': 'Nieprawidłowe parametry listy.'}), 400
+
+    resp, nxt = {}, {}
+    for name, make in boxes.items():
+        if only and name != only:
+            continue
+        rows, nxt[name] = _keyset_page(_with_offer_refs(make()), MarketOffer,
+                                       cursor if only else 0, limit)
+        resp[name] = [o.to_dict() for o in rows]
+    resp['next'] = nxt
+    return jsonify(resp)
 
 @app.post('/api/market/offers/<int:oid>/claim')
 @jwt_required()
@@ -1925,6 +3202,7 @@ def market_offer_claim(oid):
 
     o.candidate_id = uid
     o.status = 'requested'
+    _emit_market(o, public=True)
     db.session.commit()
     return jsonify({'offer': o.to_dict()})
 
@@ -1938,6 +3216,7 @@ def market_offer_cancel(oid):
     if o.status != 'open':
         return jsonify({'error':'Tę ofertę nie można anulować.'}), 400
     o.status = 'cancelled'
+    _emit_market(o, public=True)
     db.session.commit()
     return jsonify({'offer': o.to_dict()})
 
@@ -1954,12 +3233,15 @@ def market_offer_approve(oid):
     day = o.shift.shift_date
     if _has_shift(o.candidate_id, day):
         o.status = 'rejected'
+        _emit_market(o)
         db.session.commit()
         return jsonify({'error':'Kandydat ma już zmianę w tym dniu.', 'offer': o.to_dict()}), 409
     # перенос смены
     o.shift.user_id = o.candidate_id
     o.status = 'approved'
+    _emit_market(o)
     db.session.commit()
+    _schedule_changed(day)
     return jsonify({'offer': o.to_dict()})
 
 @app.post('/api/market/offers/<int:oid>/reject')
@@ -1973,6 +3255,7 @@ def market_offer_reject(oid):
         return jsonify({'error':'Oferta nie oczekuje na kandydata.'}), 400
     o.status = 'open'
     o.candidate_id = None
+    _emit_market(o, public=True)
     db.session.commit()
     return jsonify({'offer': o.to_dict()})
 
@@ -1987,7 +3270,7 @@ def takeovers_request():
     - затем владелец может zatwierdzić/odrzucić через /api/market/offers/<id>/approve|reject
     """
     uid = int(get_jwt()['sub'])
-    user = User.query.get(uid)
+    user = current_user()
 
     data = request.get_json(force=True)
     target_user_id = int(data.get('target_user_id') or 0)
@@ -2004,6 +3287,7 @@ def takeovers_request():
         return jsonify({'error':'Masz już zmianę w tym dniu.'}), 400
 
     offer = MarketOffer.query.filter_by(shift_id=shift.id).first()
+    was_open = bool(offer and offer.status == 'open')
     if not offer:
         offer = MarketOffer(shift_id=shift.id, owner_id=target_user_id,
                             candidate_id=uid, status='requested')
@@ -2026,6 +3310,8 @@ def takeovers_request():
     except Exception:
         pass
 
+    db.session.flush()
+    _emit_market(offer, public=was_open)
     db.session.commit()
     return jsonify({'offer': offer.to_dict()})
 
@@ -2256,7 +3542,98 @@ def _bbox_overlaps(a, b) -> bool:
     bx0, by0, bx1, by1 = b
     return not (ax1 <= bx0 or bx1 <= ax0 or ay1 <= by0 or by1 <= ay0)
 
+class _GridIndex:
+    """
+    Объекты страницы (x0/top/x1/bottom), разложенные один раз по сетке CELL×CELL pt:
+    каждый лежит во всех корзинах, которые задевает. Запрос ячейки смотрит только
+    пересекающиеся корзины, а не всю страницу. Порядок результатов — как на странице.
+    """
+    CELL = 12.0
+    TOL = 0.0
+
+    def __init__(self, items):
+        self.buckets = {}
+        c = self.CELL
+        for i, it in enumerate(items):
+            if it.get('x0') is None:
+                continue
+            for gx in range(int(it['x0'] // c), int(it['x1'] // c) + 1):
+                for gy in range(int(it['top'] // c), int(it['bottom'] // c) + 1):
+                    self.buckets.setdefault((gx, gy), []).append((i, it))
+
+    def _hits(self, bbox):
+        # [(номер на странице, объект)], пересекающие bbox (с допуском TOL)
+        x0, y0, x1, y1 = bbox
+        c, t = self.CELL, self.TOL
+        found = {}
+        for gx in range(int((x0 - t) // c), int((x1 + t) // c) + 1):
+            for gy in range(int((y0 - t) // c), int((y1 + t) // c) + 1):
+                for i, it in self.buckets.get((gx, gy), ()):
+                    if i not in found and (it['x1'] > x0 - t and it['x0'] < x1 + t
+                                           and it['bottom'] > y0 - t and it['top'] < y1 + t):
+                        found[i] = it
+        return sorted(found.items())
+
+    def query(self, bbox):
+        return [it for _, it in self._hits(bbox)]
+
+
+class _CharIndex(_GridIndex):
+    """Символы страницы для _cell_chars (было rows × days × chars на страницу)."""
+    TOL = 0.5   # тот же допуск, что и в линейном _cell_chars
+
+
+class _FillIndex(_GridIndex):
+    """
+    Только «заливки» страницы для _cell_fill_color: линии сетки/рамки (тоньше MIN_SIDE),
+    прямоугольники без заливки или без цвета и белый фон отбрасываются один раз на страницу.
+    """
+    CELL = 24.0
+    MIN_SIDE = 2.0
+    WHITE = 245
+    MIN_COVER = 0.25   # доля ячейки; меньше — это край соседней заливки
+
+    def __init__(self, rects):
+        self.rgb = {}
+        fills = []
+        for r in rects:
+            if None in (r.get('x0'), r.get('top'), r.get('x1'), r.get('bottom')):
+                continue
+            if r.get('fill') is False:
+                continue
+            if min(r['x1'] - r['x0'], r['bottom'] - r['top']) < self.MIN_SIDE:
+                continue
+            rgb = _norm_rgb(r.get('non_stroking_color'))
+            if not rgb or min(rgb) >= self.WHITE:
+                continue
+            fills.append(r)
+        super().__init__(fills)
+        for i, r in enumerate(fills):
+            self.rgb[i] = _norm_rgb(r.get('non_stroking_color'))
+
+    def fill(self, bbox):
+        """
+        Цвет заливки ячейки. Детерминированно: больше всего покрывает ячейку,
+        при равенстве — меньший (более «свой») прямоугольник, затем порядок на странице.
+        """
+        x0, y0, x1, y1 = bbox
+        min_cover = (x1 - x0) * (y1 - y0) * self.MIN_COVER
+        best, best_key = None, None
+        for i, r in self._hits(bbox):
+            cover = (min(x1, r['x1']) - max(x0, r['x0'])) * (min(y1, r['bottom']) - max(y0, r['top']))
+            if cover < min_cover:
+                continue
+            area = (r['x1'] - r['x0']) * (r['bottom'] - r['top'])
+            key = (cover, -area, -i)
+            if best_key is None or key > best_key:
+                best, best_key = i, key
+        return self.rgb[best] if best is not None else None
+
+
 def _cell_chars(chars, bbox):
+    # chars: список page.chars (линейный проход) или _CharIndex страницы
+    if isinstance(chars, _CharIndex):
+        return chars.query(bbox)
     x0,y0,x1,y1 = bbox
     out = []
     for ch in chars:
@@ -2283,141 +3660,191 @@ def _majority_color(chars):
     return (r,g,b)
 
 def _cell_fill_color(rects, bbox):
-    # ищем прямоугольник заливки, перекрывающий ячейку
-    for r in rects:
-        rb = (r.get('x0'), r.get('top'), r.get('x1'), r.get('bottom'))
-        if None in rb: 
+    # заливка, перекрывающая ячейку; rects — page.rects или готовый _FillIndex страницы
+    if not isinstance(rects, _FillIndex):
+        rects = _FillIndex(rects)
+    return rects.fill(bbox)
+
+# PDF_WORKERS > 1 — страницы разбираются параллельно в процессах (pdfplumber — чистый Python, упирается в GIL).
+# Пул создаётся на каждый импорт в том gunicorn-воркере, который его принял: под нагрузкой это
+# до workers × PDF_WORKERS лишних процессов, каждый со своей копией server (~память воркера).
+# На маленьких инстансах оставляйте 1.
+PDF_WORKERS = int(os.getenv('PDF_WORKERS', '1'))
+_pdf_worker_doc = None   # открытый PDF внутри процесса-воркера
+
+
+def _parse_pdf_page(page, year: int, month: int):
+    """Записи одной страницы (см. _parse_schedule_pdf_advanced)."""
+    from datetime import date as _date_cls
+
+    out = []
+    words = page.extract_words(use_text_flow=True, keep_blank_chars=False)
+    chars = _CharIndex(page.chars or [])   # один раз на страницу, дальше — запросы по ячейкам
+    rects = _FillIndex(page.rects or [])   # только заливки, по сетке
+
+    # 1) найдём заголовок с датами (1..31) — возьмём их X-координаты как границы колонок
+    # Берём первую строку, где >= 10 токенов вида числа 1..31
+    date_words = [w for w in words if re.fullmatch(r'\d{1,2}', w.get('text','').strip())]
+    # сгруппируем по y (строки)
+    rows_by_y = {}
+    for w in date_words:
+        key = round(w['top'] / 5)  # грубая кластеризация по высоте
+        rows_by_y.setdefault(key, []).append(w)
+    header_row = None
+    for _, arr in sorted(rows_by_y.items(), key=lambda kv: len(kv[1]), reverse=True):
+        vals = [int(w['text']) for w in arr if 1 <= int(w['text']) <= 31]
+        if len(vals) >= 10:  # достаточно столбцов
+            header_row = sorted(arr, key=lambda w: w['x0'])
+            break
+    if not header_row:
+        return out
+
+    # Список границ X для каждого дня (берём центр слова)
+    x_centers = [ (w['x0'] + w['x1'])/2.0 for w in header_row ]
+    days      = [ int(w['text']) for w in header_row ]
+    # отсортировать на всякий случай
+    cols = sorted(zip(days, x_centers), key=lambda t: t[0])
+    # фильтр по нашему месяцу (1..N)
+    cols = [(d,x) for (d,x) in cols if 1 <= d <= 31]
+    if not cols:
+        return out
+
+    # превратим точки в интервалы (границы колонок)
+    # граница для дня d — середина между центрами d-1 и d
+    xs = [x for _,x in cols]
+    xbounds = []
+    for i,x in enumerate(xs):
+        left  = xs[i-1] + (x - xs[i-1]) * 0.5 if i>0 else x - 8   # небольшой fallback
+        right = xs[i+1] - (xs[i+1] - x) * 0.5 if i<len(xs)-1 else x + 8
+        xbounds.append((left, right))
+
+    # 2) найдём строки сотрудников: берём слова слева от первой колонки и тянем по Y
+    first_col_left = min(l for l,_ in xbounds) - 5
+    name_candidates = [w for w in words if w['x1'] <= first_col_left and len(w['text'].strip())>1]
+    # сгруппируем по строкам (y)
+    name_rows = {}
+    for w in name_candidates:
+        key = round(w['top'] / 2)  # плотнее, имена часто в 2 слова
+        name_rows.setdefault(key, []).append(w)
+
+    # для каждой строки — имя и y-границы строки
+    rows = []
+    for _, arr in name_rows.items():
+        arr = sorted(arr, key=lambda w: w['x0'])
+        name = ' '.join(w['text'] for w in arr).strip()
+        if not name or re.match(r'(?i)^(plan|braki|nazwisko)', name):
             continue
-        if _bbox_overlaps(bbox, rb):
-            rgb = _norm_rgb(r.get('non_stroking_color'))
-            if rgb:
-                return rgb
-    return None
+        top = min(w['top'] for w in arr)
+        bottom = max(w['bottom'] for w in arr)
+        rows.append((name, top-1, bottom+1))
+    # отсортируем сверху-вниз
+    rows.sort(key=lambda r: r[1])
+
+    # 3) обходим ячейки: (row, day)
+    for name, y0, y1 in rows:
+        for (day,(xl,xr)), (_,xc) in zip(enumerate(xbounds, start=1), cols):
+            try:
+                d = _date_cls(year, month, day)
+            except Exception:
+                continue
+            bbox = (xl, y0, xr, y1)
+
+            cell_ch = _cell_chars(chars, bbox)
+            # вытащим код смены по видимому тексту
+            txt = ''.join(ch['text'] for ch in sorted(cell_ch, key=lambda c: (c['x0'], c['top']))).strip()
+            if not txt:
+                continue
+            # нормализуем: допустим варианты '1', '2', '1/B', '2/B', '1 B'
+            txt_norm = txt.upper().replace(' ', '')
+            if txt_norm not in ('1','2','1/B','2/B','1B','2B'):
+                # игнорируем мусор и 'X'
+                continue
+            shift_code = '1/B' if txt_norm in ('1/B','1B') else ('2/B' if txt_norm in ('2/B','2B') else txt_norm)
+
+            # цвет цифр → lounge
+            rgb_text = _majority_color(cell_ch)
+            lounge = 'mazurek' if _is_blue(rgb_text) else ('polonez' if _is_black(rgb_text) else None)
 
-def _parse_schedule_pdf_advanced(file_bytes: bytes, year: int, month: int):
+            # заливка ячейки → координатор
+            fill_rgb = _cell_fill_color(rects, bbox)
+            coord_lounge = None
+            if _is_blue(fill_rgb):
+                coord_lounge = 'mazurek'
+            elif _is_yellow(fill_rgb):
+                coord_lounge = 'polonez'
+
+            out.append({
+                'name': name,
+                'date': d.isoformat(),
+                'shift': shift_code,
+                'lounge': lounge,
+                'coord_lounge': coord_lounge
+            })
+    return out
+
+
+def _pdf_worker_init(file_bytes):
+    # один раз на процесс: дальше задачи передают только номер страницы
+    global _pdf_worker_doc
+    import pdfplumber
+    _pdf_worker_doc = pdfplumber.open(io.BytesIO(file_bytes))
+
+
+def _pdf_worker_page(args):
+    page_no, year, month = args
+    page = _pdf_worker_doc.pages[page_no]
+    try:
+        return _parse_pdf_page(page, year, month)
+    finally:
+        page.close()
+
+
+def _parse_schedule_pdf_advanced(file_bytes: bytes, year: int, month: int, progress=None, workers=None):
     """
     Возвращает записи:
       {'name', 'date'(YYYY-MM-DD), 'shift', 'lounge', 'coord_lounge'}
     lounge: 'mazurek'|'polonez'|None
     coord_lounge: 'mazurek'|'polonez'|None
+    progress(done_pages, total_pages) — необязательный колбэк (фоновые импорты).
+    workers — число процессов (по умолчанию PDF_WORKERS); результаты страниц склеиваются по порядку.
     """
     import pdfplumber
-    from datetime import date as _date_cls
+    from concurrent.futures import ProcessPoolExecutor
 
+    workers = PDF_WORKERS if workers is None else workers
     out = []
     with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
-        for page in pdf.pages:
-            words = page.extract_words(use_text_flow=True, keep_blank_chars=False)
-            chars = page.chars or []
-            rects = page.rects or []
-
-            # 1) найдём заголовок с датами (1..31) — возьмём их X-координаты как границы колонок
-            # Берём первую строку, где >= 10 токенов вида числа 1..31
-            date_words = [w for w in words if re.fullmatch(r'\d{1,2}', w.get('text','').strip())]
-            # сгруппируем по y (строки)
-            rows_by_y = {}
-            for w in date_words:
-                key = round(w['top'] / 5)  # грубая кластеризация по высоте
-                rows_by_y.setdefault(key, []).append(w)
-            header_row = None
-            for _, arr in sorted(rows_by_y.items(), key=lambda kv: len(kv[1]), reverse=True):
-                vals = [int(w['text']) for w in arr if 1 <= int(w['text']) <= 31]
-                if len(vals) >= 10:  # достаточно столбцов
-                    header_row = sorted(arr, key=lambda w: w['x0'])
-                    break
-            if not header_row:
-                continue
-
-            # Список границ X для каждого дня (берём центр слова)
-            x_centers = [ (w['x0'] + w['x1'])/2.0 for w in header_row ]
-            days      = [ int(w['text']) for w in header_row ]
-            # отсортировать на всякий случай
-            cols = sorted(zip(days, x_centers), key=lambda t: t[0])
-            # фильтр по нашему месяцу (1..N)
-            cols = [(d,x) for (d,x) in cols if 1 <= d <= 31]
-            if not cols:
-                continue
-
-            # превратим точки в интервалы (границы колонок)
-            # граница для дня d — середина между центрами d-1 и d
-            xs = [x for _,x in cols]
-            xbounds = []
-            for i,x in enumerate(xs):
-                left  = xs[i-1] + (x - xs[i-1]) * 0.5 if i>0 else x - 8   # небольшой fallback
-                right = xs[i+1] - (xs[i+1] - x) * 0.5 if i<len(xs)-1 else x + 8
-                xbounds.append((left, right))
-
-            # 2) найдём строки сотрудников: берём слова слева от первой колонки и тянем по Y
-            first_col_left = min(l for l,_ in xbounds) - 5
-            name_candidates = [w for w in words if w['x1'] <= first_col_left and len(w['text'].strip())>1]
-            # сгруппируем по строкам (y)
-            name_rows = {}
-            for w in name_candidates:
-                key = round(w['top'] / 2)  # плотнее, имена часто в 2 слова
-                name_rows.setdefault(key, []).append(w)
-
-            # для каждой строки — имя и y-границы строки
-            rows = []
-            for _, arr in name_rows.items():
-                arr = sorted(arr, key=lambda w: w['x0'])
-                name = ' '.join(w['text'] for w in arr).strip()
-                if not name or re.match(r'(?i)^(plan|braki|nazwisko)', name):
-                    continue
-                top = min(w['top'] for w in arr)
-                bottom = max(w['bottom'] for w in arr)
-                rows.append((name, top-1, bottom+1))
-            # отсортируем сверху-вниз
-            rows.sort(key=lambda r: r[1])
-
-            # 3) обходим ячейки: (row, day)
-            for name, y0, y1 in rows:
-                for (day,(xl,xr)), (_,xc) in zip(enumerate(xbounds, start=1), cols):
-                    try:
-                        d = _date_cls(year, month, day)
-                    except Exception:
-                        continue
-                    bbox = (xl, y0, xr, y1)
-
-                    cell_ch = _cell_chars(chars, bbox)
-                    # вытащим код смены по видимому тексту
-                    txt = ''.join(ch['text'] for ch in sorted(cell_ch, key=lambda c: (c['x0'], c['top']))).strip()
-                    if not txt:
-                        continue
-                    # нормализуем: допустим варианты '1', '2', '1/B', '2/B', '1 B'
-                    txt_norm = txt.upper().replace(' ', '')
-                    if txt_norm not in ('1','2','1/B','2/B','1B','2B'):
-                        # игнорируем мусор и 'X'
-                        continue
-                    shift_code = '1/B' if txt_norm in ('1/B','1B') else ('2/B' if txt_norm in ('2/B','2B') else txt_norm)
-
-                    # цвет цифр → lounge
-                    rgb_text = _majority_color(cell_ch)
-                    lounge = 'mazurek' if _is_blue(rgb_text) else ('polonez' if _is_black(rgb_text) else None)
-
-                    # заливка ячейки → координатор
-                    fill_rgb = _cell_fill_color(rects, bbox)
-                    coord_lounge = None
-                    if _is_blue(fill_rgb):
-                        coord_lounge = 'mazurek'
-                    elif _is_yellow(fill_rgb):
-                        coord_lounge = 'polonez'
-
-                    out.append({
-                        'name': name,
-                        'date': d.isoformat(),
-                        'shift': shift_code,
-                        'lounge': lounge,
-                        'coord_lounge': coord_lounge
-                    })
+        total = len(pdf.pages)
+        if workers > 1 and total > 1:
+            # не fork: воркер gunicorn многопоточный, копия чужих замков (пул БД, логи) может
+            # зависнуть навсегда. forkserver/spawn импортируют server заново — без БД, см. низ файла
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            n = min(workers, total)
+            with ProcessPoolExecutor(max_workers=n, mp_context=multiprocessing.get_context(method),
+                                     initializer=_pdf_worker_init, initargs=(file_bytes,)) as pool:
+                for page_no, page_rows in enumerate(pool.map(_pdf_worker_page,
+                                                             [(i, year, month) for i in range(total)])):
+                    if progress:
+                        progress(page_no, total)
+                    out.extend(page_rows)
+        else:
+            for page_no, page in enumerate(pdf.pages):
+                if progress:
+                    progress(page_no, total)
+                out.extend(_parse_pdf_page(page, year, month))
+        if progress:
+            progress(total, total)
     return out
 
 @app.post('/api/upload-pdf-adv')
 @jwt_required()
 def upload_pdf_advanced():
     """Импорт PDF со считыванием цвета цифры (локация) и заливки (координатор)."""
-    claims = get_jwt() or {}
-    if (claims.get('role') or '').lower() != 'admin':
+    if not _perm('admin'):
         return jsonify({'error': 'Tylko administrator może przesyłać PDF.'}), 403
+    mode = _import_mode()
+    if not mode:
+        return jsonify({'error': 'Nieznany tryb importu (replace|merge).'}), 400
 
     f = request.files.get('file')
     year  = int(request.form.get('year') or 0)
@@ -2426,74 +3853,24 @@ def upload_pdf_advanced():
         return jsonify({'error': 'Podaj plik, rok i miesiąc.'}), 400
 
     data = f.read()
+    if _import_flag('async'):
+        return _submit_import_job('pdf', data, year, month, mode)
     try:
-        rows = _parse_schedule_pdf_advanced(data, year, month)
+        rows = _parse_cached('pdf', data, year, month)
     except Exception as e:
         return jsonify({'error': f'Błąd odczytu PDF: {e}'}), 400
 
-    # Сбросим только нужный месяц (и офферы)
-    first = _date(year, month, 1)
-    last  = _date(year, month, monthrange(year, month)[1])
-
-    shift_ids = [s.id for s in Shift.query.filter(Shift.shift_date>=first, Shift.shift_date<=last).all()]
-    if shift_ids:
-        try:
-            MarketOffer.query.filter(MarketOffer.shift_id.in_(shift_ids)).delete(synchronize_session=False)
-        except Exception:
-            db.session.execute(db.text("DELETE FROM market_offers WHERE shift_id = ANY(:ids)"), {'ids': shift_ids})
-        Shift.query.filter(Shift.id.in_(shift_ids)).delete(synchronize_session=False)
-    db.session.commit()
-
-    users_by_key = {_norm(u.full_name): u for u in User.query.all()}
-    imported = 0
-    created_users = []
-
-    for r in rows:
-        name = r['name'].strip()
-        if not name: 
-            continue
-        key = _norm(name)
-        u = users_by_key.get(key)
-        if not u:
-            u = User(full_name=name, role='user')
-            db.session.add(u); db.session.flush()
-            users_by_key[key] = u
-            created_users.append(u.full_name)
-
-        sh = Shift(
-            user_id = u.id,
-            shift_date = r['date'],
-            shift_code = r['shift'],
-            hours = None,
-        )
-        # Если в ячейке отмечен координатор — ставим на смену
-        if r.get('coord_lounge'):
-            sh.coord_lounge = r['coord_lounge']
-        db.session.add(sh)
-        imported += 1
-
-    db.session.commit()
-    return jsonify({'imported': imported, 'created_users': created_users})
+    if _import_flag('dry_run'):
+        return jsonify(_import_preview(rows, year, month, mode))
+    try:
+        imported, created_users, diff = _import_month(rows, year, month, mode)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Błąd zapisu do bazy: {e}'}), 500
+    return jsonify(_import_result(imported, created_users, mode, diff))
 
 # ===== XLSX schedule import (with colors) =====
 from typing import Optional, Tuple
-from openpyxl import load_workbook
-
-def _rgb_from_openpyxl(color) -> Optional[Tuple[int,int,int]]:
-    """
-    openpyxl color может быть theme/indexed или ARGB 'FFRRGGBB'/'RRGGBB'.
-    Возвращает (R,G,B) или None.
-    """
-    if not color:
-        return None
-    rgb = getattr(color, "rgb", None)
-    if rgb:
-        rgb = str(rgb).upper()
-        if len(rgb) == 8:  # AARRGGBB
-            return (int(rgb[2:4], 16), int(rgb[4:6], 16), int(rgb[6:8], 16))
-        if len(rgb) == 6:  # RRGGBB
-            return (int(rgb[0:2], 16), int(rgb[2:4], 16), int(rgb[4:6], 16))
-    return None
 
 def _is_blue(rgb: Optional[Tuple[int,int,int]]) -> bool:
     if not rgb: return False
@@ -2516,6 +3893,153 @@ def _is_red(rgb: Optional[Tuple[int,int,int]]) -> bool:
     r,g,b = rgb
     return r >= 180 and g <= 110 and b <= 110
 
+class _XlsxStream:
+    """
+    Потоковое чтение активного листа XLSX без load_workbook: sheet XML идёт iterparse
+    строка за строкой (элементы сразу чистятся), из styles.xml берутся только цвета
+    шрифта и заливки, и каждый индекс стиля разрешается в цвета один раз.
+    Цвета — только явный ARGB/RGB (как .rgb у openpyxl), theme/indexed → None.
+    src — bytes или путь к файлу.
+    """
+    _REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id'
+
+    def __init__(self, src):
+        import zipfile
+        self.zf = zipfile.ZipFile(io.BytesIO(src) if isinstance(src, (bytes, bytearray)) else src)
+        self.names = set(self.zf.namelist())
+        self.shared = self._shared_strings()
+        self.xfs, self.fonts, self.fills = self._styles()
+        self._colors = {}
+
+    @staticmethod
+    def _tag(el):
+        return el.tag.rsplit('}', 1)[-1]
+
+    def _xml(self, name):
+        import xml.etree.ElementTree as ET
+        return ET.fromstring(self.zf.read(name)) if name in self.names else None
+
+    def _shared_strings(self):
+        import xml.etree.ElementTree as ET
+        out = []
+        if 'xl/sharedStrings.xml' not in self.names:
+            return out
+        with self.zf.open('xl/sharedStrings.xml') as fh:
+            for _, el in ET.iterparse(fh):
+                if self._tag(el) == 'si':
+                    out.append(''.join(t.text or '' for t in el.iter() if self._tag(t) == 't'))
+                    el.clear()
+        return out
+
+    @staticmethod
+    def _argb(el):
+        # <color rgb="FFRRGGBB"/> → (R,G,B); theme/indexed/auto → None
+        rgb = (el.get('rgb') or '').upper() if el is not None else ''
+        if len(rgb) == 8:
+            rgb = rgb[2:]
+        if len(rgb) != 6:
+            return None
+        try:
+            return (int(rgb[0:2], 16), int(rgb[2:4], 16), int(rgb[4:6], 16))
+        except ValueError:
+            return None
+
+    def _styles(self):
+        root = self._xml('xl/styles.xml')
+        if root is None:
+            return [], [], []
+        def child(el, name):
+            return next((c for c in el if self._tag(c) == name), None)
+        fonts, fills, xfs = [], [], []
+        for sec in root:
+            kind = self._tag(sec)
+            if kind == 'fonts':
+                fonts = [self._argb(child(f, 'color')) for f in sec]
+            elif kind == 'fills':
+                for f in sec:
+                    pf = child(f, 'patternFill')
+                    fills.append(self._argb(child(pf, 'fgColor')) if pf is not None else None)
+            elif kind == 'cellXfs':
+                xfs = [(int(x.get('fontId') or 0), int(x.get('fillId') or 0)) for x in sec]
+        return xfs, fonts, fills
+
+    def colors(self, style):
+        """(font_rgb, fill_rgb) для индекса стиля ячейки; кэшируется."""
+        if style not in self._colors:
+            font_id, fill_id = self.xfs[style] if style < len(self.xfs) else (0, 0)
+            self._colors[style] = (self.fonts[font_id] if font_id < len(self.fonts) else None,
+                                   self.fills[fill_id] if fill_id < len(self.fills) else None)
+        return self._colors[style]
+
+    def _sheet_path(self):
+        wb = self._xml('xl/workbook.xml')
+        rels = self._xml('xl/_rels/workbook.xml.rels')
+        active = 0
+        sheets = []
+        for el in wb.iter():
+            t = self._tag(el)
+            if t == 'workbookView':
+                active = int(el.get('activeTab') or 0)
+            elif t == 'sheet':
+                sheets.append(el.get(self._REL_NS))
+        targets = {r.get('Id'): r.get('Target') for r in rels} if rels is not None else {}
+        target = targets.get(sheets[min(active, len(sheets) - 1)]) if sheets else None
+        if not target:
+            return 'xl/worksheets/sheet1.xml'
+        target = target.lstrip('/')
+        return target if target.startswith('xl/') else 'xl/' + target
+
+    @staticmethod
+    def _col(ref):
+        n = 0
+        for ch in ref:
+            if ch.isalpha():
+                n = n * 26 + (ord(ch.upper()) - 64)
+            else:
+                break
+        return n
+
+    def _value(self, c):
+        t = c.get('t')
+        v = next((x.text for x in c if self._tag(x) == 'v'), None)
+        if t == 's':
+            return self.shared[int(v)] if v is not None else None
+        if t == 'inlineStr':
+            return ''.join(x.text or '' for x in c.iter() if self._tag(x) == 't')
+        if v is None:
+            return None
+        if t in ('str', 'e'):
+            return v
+        if t == 'b':
+            return v == '1'
+        # число — как openpyxl: с точкой/экспонентой float, иначе int
+        try:
+            return float(v) if ('.' in v or 'E' in v or 'e' in v) else int(v)
+        except ValueError:
+            return v
+
+    def rows(self):
+        """Генератор (номер_строки, {колонка(1..): (значение, индекс_стиля)}), только непустые ячейки."""
+        import xml.etree.ElementTree as ET
+        with self.zf.open(self._sheet_path()) as fh:
+            row_no = 0
+            for _, el in ET.iterparse(fh):
+                if self._tag(el) != 'row':
+                    continue
+                row_no = int(el.get('r') or row_no + 1)
+                cells, col = {}, 0
+                for c in el:
+                    if self._tag(c) != 'c':
+                        continue
+                    ref = c.get('r')
+                    col = self._col(ref) if ref else col + 1
+                    val = self._value(c)
+                    if val is not None:
+                        cells[col] = (val, int(c.get('s') or 0))
+                el.clear()
+                yield row_no, cells
+
+
 def _normalize_code(raw: str) -> Optional[str]:
     """
     Приводим к: '1', '2', '1/B', '2/B'.
@@ -2553,46 +4077,44 @@ def parse_schedule_xlsx(xlsx_bytes: bytes, year: int, month: int):
     Возвращает list[dict]: {name, date:'YYYY-MM-DD', shift:'1|2|1/B|2/B', lounge, coord_lounge}
     lounge: голубой цвет цифры -> 'mazurek', чёрный/красный -> 'polonez'
     coord_lounge: голубая заливка -> 'mazurek', жёлтая -> 'polonez' (НО не для 1/B,2/B)
+    Лист читается потоково (_XlsxStream): память и время — по непустым ячейкам.
     """
     from datetime import date as _date_cls
     from calendar import monthrange
-    wb = load_workbook(io.BytesIO(xlsx_bytes), data_only=True)
-    ws = wb.active
 
-    # --- 1) строка с днями ---
+    book = _XlsxStream(xlsx_bytes)
+    days_in_month = monthrange(year, month)[1]
     header_row = None
     day_cols: list[tuple[int,int]] = []
-    for r in range(1, 6):
-        row_vals = [c.value for c in ws[r]]
-        tmp = []
-        for j, val in enumerate(row_vals, start=1):
-            try:
-                d = int(str(val).strip())
-            except Exception:
-                continue
-            if 1 <= d <= 31:
-                tmp.append((j, d))
-        if len(tmp) >= 8:
-            header_row = r
-            day_cols = tmp
-            break
-    if not day_cols:
-        raise ValueError("Не найдена строка с датами (1..31).")
-
-    days_in_month = monthrange(year, month)[1]
-    uniq = {d for _, d in day_cols}
-    if len(uniq) <= max(1, len(day_cols)//4):
-        day_cols = [(col_idx, i+1) for i, (col_idx, _) in enumerate(day_cols[:days_in_month])]
-    day_cols = [(c, d) for (c, d) in day_cols if 1 <= d <= days_in_month]
-    if not day_cols:
-        raise ValueError("В шапке нет корректных чисел дней для указанного месяца.")
-
     out = []
 
-    # --- 2) строки сотрудников ---
-    for row in ws.iter_rows(min_row=header_row+1):
-        name_cell = row[0]
-        full_name = (name_cell.value or "").strip() if name_cell.value else ""
+    for r, cells in book.rows():
+        # --- 1) строка с днями (среди первых 5) ---
+        if header_row is None:
+            if r > 5:
+                break
+            tmp = []
+            for j in sorted(cells):
+                try:
+                    d = int(str(cells[j][0]).strip())
+                except Exception:
+                    continue
+                if 1 <= d <= 31:
+                    tmp.append((j, d))
+            if len(tmp) >= 8:
+                header_row = r
+                day_cols = tmp
+                uniq = {d for _, d in day_cols}
+                if len(uniq) <= max(1, len(day_cols)//4):
+                    day_cols = [(col_idx, i+1) for i, (col_idx, _) in enumerate(day_cols[:days_in_month])]
+                day_cols = [(c, d) for (c, d) in day_cols if 1 <= d <= days_in_month]
+                if not day_cols:
+                    raise ValueError("В шапке нет корректных чисел дней для указанного месяца.")
+            continue
+
+        # --- 2) строки сотрудников ---
+        name_val = cells.get(1, (None, 0))[0]
+        full_name = str(name_val).strip() if name_val else ""
         if not full_name:
             continue
         low = full_name.lower()
@@ -2600,14 +4122,15 @@ def parse_schedule_xlsx(xlsx_bytes: bytes, year: int, month: int):
             continue
 
         for col_idx, day in day_cols:
-            cell = ws.cell(row=name_cell.row, column=col_idx)
-
-            code = _normalize_code(cell.value)
+            cell = cells.get(col_idx)
+            if not cell:
+                continue
+            code = _normalize_code(cell[0])
             if not code:
                 continue
+            font_rgb, fill_rgb = book.colors(cell[1])
 
             # --- цвет цифры -> lounge ---
-            font_rgb = _rgb_from_openpyxl(getattr(cell.font, 'color', None))
             if _is_blue(font_rgb):
                 lounge = 'mazurek'
             elif _is_black(font_rgb) or _is_red(font_rgb):
@@ -2615,10 +4138,7 @@ def parse_schedule_xlsx(xlsx_bytes: bytes, year: int, month: int):
             else:
                 lounge = None
 
-            # --- цвет заливки -> coord_lounge (учитываем start_color И fgColor) ---
-            fill_obj = getattr(cell.fill, 'start_color', None) or getattr(cell.fill, 'fgColor', None)
-            fill_rgb = _rgb_from_openpyxl(fill_obj)
-
+            # --- цвет заливки -> coord_lounge ---
             if _is_blue(fill_rgb):
                 coord_lounge = 'mazurek'
             elif _is_yellow(fill_rgb) and code not in {'1/B', '2/B'}:
@@ -2634,6 +4154,8 @@ def parse_schedule_xlsx(xlsx_bytes: bytes, year: int, month: int):
                 'coord_lounge': coord_lounge
             })
 
+    if header_row is None:
+        raise ValueError("Не найдена строка с датами (1..31).")
     return out
 
 
@@ -2643,9 +4165,11 @@ def parse_schedule_xlsx(xlsx_bytes: bytes, year: int, month: int):
 def upload_xlsx():
     """Импорт графика из XLSX (цвет цифры -> lounge, цвет заливки -> coord_lounge)."""
 
-    claims = get_jwt() or {}
-    if (claims.get('role') or '').lower() != 'admin':
+    if not _perm('admin'):
         return jsonify({'error': 'Tylko administrator może przesyłać XLSX.'}), 403
+    mode = _import_mode()
+    if not mode:
+        return jsonify({'error': 'Nieznany tryb importu (replace|merge).'}), 400
 
     # --- Проверка формы ---
     f = request.files.get('file')
@@ -2658,103 +4182,41 @@ def upload_xlsx():
         return jsonify({'error': 'Podaj poprawny rok i miesiąc.'}), 400
 
     data = f.read()
+    if _import_flag('async'):
+        return _submit_import_job('xlsx', data, year, month, mode)
 
     # --- Парсинг XLSX ---
     try:
-        rows = parse_schedule_xlsx(data, year, month)
+        rows = _parse_cached('xlsx', data, year, month)
     except Exception as e:
         import traceback
         tb = traceback.format_exc()
         print(tb)
         return jsonify({'error': f'Błąd odczytu XLSX: {e}'}), 400
 
-    # --- Очистка данных выбранного месяца ---
-    first = _date(year, month, 1)
-    last = _date(year, month, monthrange(year, month)[1])
-
-    try:
-        db.session.execute(sqltext("""
-            DELETE FROM market_offers
-            WHERE shift_id IN (
-              SELECT id FROM shifts
-              WHERE shift_date BETWEEN :d1 AND :d2
-            )
-        """), {'d1': first, 'd2': last})
-
-        db.session.execute(sqltext("""
-            DELETE FROM shifts
-            WHERE shift_date BETWEEN :d1 AND :d2
-        """), {'d1': first, 'd2': last})
-
-        db.session.flush()
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'error': f'Błąd czyszczenia bazy danych: {e}'}), 500
-
-    # --- Подготовка пользователей ---
-    users_by_key = {_norm(u.full_name): u for u in User.query.all()}
-    imported = 0
-    created_users = []
-    seen_pairs = set()  # (user_id, date)
-
-    for r in rows:
-        name = (r.get('name') or '').strip()
-        if not name:
-            continue
-
-        key = _norm(name)
-        u = users_by_key.get(key)
-        if not u:
-            u = User(full_name=name, role='user')
-            db.session.add(u)
-            db.session.flush()
-            users_by_key[key] = u
-            created_users.append(u.full_name)
-
-        d_iso = r.get('date')
-        if not d_iso:
-            continue
+    if _import_flag('dry_run'):
+        return jsonify(_import_preview(rows, year, month, mode))
 
-        pair = (u.id, d_iso)
-        if pair in seen_pairs:
-            continue
-        seen_pairs.add(pair)
-
-        # --- создаём смену ---
-        sh = Shift(
-            user_id=u.id,
-            shift_date=d_iso,
-            shift_code=r.get('shift') or '',
-            hours=None,
-            lounge=(r.get('lounge') or None),
-            coord_lounge=(r.get('coord_lounge') or None)
-        )
-
-        db.session.add(sh)
-        imported += 1
-
-    # --- Сохранение ---
+    # --- Запись месяца (одна транзакция) ---
     try:
-        db.session.commit()
+        imported, created_users, diff = _import_month(rows, year, month, mode)
     except Exception as e:
         db.session.rollback()
         import traceback
         print(traceback.format_exc())
         return jsonify({'error': f'Błąd zapisu do bazy: {e}'}), 500
 
-    return jsonify({
-        'status': 'OK',
-        'imported': imported,
-        'created_users': created_users
-    })
+    return jsonify(_import_result(imported, created_users, mode, diff, status='OK'))
 
 
 @app.post('/api/upload-text')
 @jwt_required()
 def upload_text():
-    claims = get_jwt() or {}
-    if (claims.get('role') or '').lower() != 'admin':
+    if not _perm('admin'):
         return jsonify({'error': 'Tylko administrator może przesyłać tekst.'}), 403
+    mode = _import_mode()
+    if not mode:
+        return jsonify({'error': 'Nieznany tryb importu (replace|merge).'}), 400
 
     data = request.get_json(force=True) or {}
     text  = (data.get('text') or '').strip()
@@ -2765,60 +4227,188 @@ def upload_text():
     if not (1 <= month <= 12) or year < 2000:
         return jsonify({'error': 'Podaj poprawny miesiąc i rok.'}), 400
 
+    if _import_flag('async'):
+        return _submit_import_job('text', text, year, month, mode)
+
     try:
-        rows = _parse_table_no_dates(text, year, month)  # -> list[dict{name, day, code}]
+        rows = _parse_cached('text', text, year, month)  # -> list[dict{name, day, code}]
     except Exception as e:
         return jsonify({'error': f'Błąd parsowania: {e}'}), 400
 
-    # диапазон месяца
-    first_day = _date(year, month, 1)
-    last_day  = _date(year, month, monthrange(year, month)[1])
+    if _import_flag('dry_run'):
+        return jsonify(_import_preview(rows, year, month, mode))
+    try:
+        imported, created_users, diff = _import_month(rows, year, month, mode)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Błąd zapisu do bazy: {e}'}), 500
+    return jsonify(_import_result(imported, created_users, mode, diff))
+
+
+# ---------------------------------
+# Фоновые импорты (import_jobs)
+# ---------------------------------
+# ?async=1 на /api/upload-* → 202 + job_id; парсинг и запись идут в пуле потоков процесса,
+# веб-поток освобождается сразу. Статус — в таблице import_jobs, поэтому опрос
+# /api/import-jobs/<id> работает из любого gunicorn-воркера. Сам файл держим только в памяти:
+# если процесс умер, зависшая задача через IMPORT_JOB_STALE отдаётся как ошибка.
+from concurrent.futures import ThreadPoolExecutor
+
+IMPORT_WORKERS   = int(os.getenv('IMPORT_WORKERS', '1'))
+IMPORT_JOB_STALE = timedelta(minutes=int(os.getenv('IMPORT_JOB_STALE_MIN', '15')))
+_import_pool = ThreadPoolExecutor(max_workers=IMPORT_WORKERS, thread_name_prefix='import')
+
+IMPORT_PARSERS = {
+    'pdf':  (_parse_schedule_pdf_advanced, 'Błąd odczytu PDF'),
+    'xlsx': (parse_schedule_xlsx,          'Błąd odczytu XLSX'),
+    'text': (_parse_table_no_dates,        'Błąd parsowania'),
+}
 
-    # подчистка только выбранного месяца (и зависимых market_offers)
-    shift_ids = [s.id for s in Shift.query.filter(
-        Shift.shift_date >= first_day,
-        Shift.shift_date <= last_day
-    ).all()]
 
-    if shift_ids:
-        MarketOffer.query.filter(MarketOffer.shift_id.in_(shift_ids)) \
-            .delete(synchronize_session=False)
-        Shift.query.filter(
-            Shift.shift_date >= first_day,
-            Shift.shift_date <= last_day
-        ).delete(synchronize_session=False)
+# --- кэш результатов разбора на локальном диске ---
+# Ключ: (sha256 файла, год, месяц, версия парсера) → JSON со строками парсера.
+# Повторная загрузка того же файла (после ошибки или dry-run) сразу идёт в запись.
+# Версию парсера поднимать при любом изменении его вывода — старые записи просто перестанут совпадать.
+PARSER_VERSIONS = {'pdf': 1, 'xlsx': 1, 'text': 1}
+PARSE_CACHE_DIR    = os.getenv('PARSE_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'schedule-parse-cache')
+PARSE_CACHE_MAX_MB = int(os.getenv('PARSE_CACHE_MAX_MB', '64'))   # 0 — кэш выключен
 
-    # пользователи
-    users_by_key = {_norm(u.full_name): u for u in User.query.all()}
 
-    imported = 0
-    created_users = []
+def _parse_cache_path(kind, data, year, month):
+    raw = data.encode('utf-8') if isinstance(data, str) else data
+    sha = hashlib.sha256(raw).hexdigest()
+    return os.path.join(PARSE_CACHE_DIR, f"{kind}-v{PARSER_VERSIONS[kind]}-{year}-{month:02d}-{sha}.json")
 
-    for r in rows:
-        name = r['name']
-        key  = _norm(name)
-        user = users_by_key.get(key)
-        if not user:
-            user = User(full_name=name, role='user')
-            db.session.add(user); db.session.flush()
-            users_by_key[key] = user
-            created_users.append(user.full_name)
-
-        d = _date(year, month, r['day']).isoformat()
-        shift_code = r['code']  # '1','2','1/B','2/B', ...
-        # часы можешь ставить по умолчанию 9.5, если нужно:
-        hours = None
-
-        db.session.add(Shift(
-            user_id=user.id,
-            shift_date=d,
-            shift_code=shift_code,
-            hours=hours
-        ))
-        imported += 1
 
+def _parse_cache_evict():
+    # LRU по mtime (при попадании файл «трогаем»), пока каталог не влезет в лимит
+    try:
+        entries = []
+        for e in os.scandir(PARSE_CACHE_DIR):
+            if e.name.endswith('.json'):
+                st = e.stat()
+                entries.append((st.st_mtime, st.st_size, e.path))
+    except OSError:
+        return
+    total = sum(size for _, size, _ in entries)
+    limit = PARSE_CACHE_MAX_MB * 1024 * 1024
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass   # параллельно удалил другой воркер
+        total -= size
+
+
+def _parse_cached(kind, data, year, month, **kw):
+    """
+    IMPORT_PARSERS[kind] с дисковым кэшем; ошибки разбора не кэшируются.
+    При попадании колбэк progress (если передан) получает сразу «разобрано всё».
+    """
+    parse = IMPORT_PARSERS[kind][0]
+    if PARSE_CACHE_MAX_MB <= 0:
+        return parse(data, year, month, **kw)
+    path = _parse_cache_path(kind, data, year, month)
+    try:
+        with open(path, encoding='utf-8') as fh:
+            rows = json.load(fh)
+        os.utime(path)
+        if kw.get('progress'):
+            kw['progress'](1, 1)
+        return rows
+    except (OSError, ValueError):
+        pass
+    rows = parse(data, year, month, **kw)
+    try:
+        os.makedirs(PARSE_CACHE_DIR, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as fh:
+            json.dump(rows, fh, ensure_ascii=False)
+        os.replace(tmp, path)   # атомарно: другой воркер не увидит половину файла
+        _parse_cache_evict()
+    except OSError as e:
+        app.logger.warning(f"parse cache write skipped: {e}")
+    return rows
+
+
+def _job_update(job_id, **values):
+    # короткая отдельная транзакция: статус виден другим воркерам сразу
+    db.session.execute(update(ImportJob).where(ImportJob.id == job_id).values(**values))
     db.session.commit()
-    return jsonify({'imported': imported, 'created_users': created_users})
+
+
+def _run_import_job(job_id, kind, data, year, month, mode, dry_run):
+    with app.app_context():
+        parse_err = IMPORT_PARSERS[kind][1]
+        _job_update(job_id, status='running', progress=5)
+        try:
+            kw = {}
+            if kind == 'pdf':
+                kw['progress'] = lambda done, total: _job_update(job_id, progress=5 + 60 * done // max(total, 1))
+            rows = _parse_cached(kind, data, year, month, **kw)
+        except Exception as e:
+            db.session.rollback()
+            _job_update(job_id, status='error', error=f'{parse_err}: {e}', finished_at=datetime.now(timezone.utc))
+            return
+        _job_update(job_id, progress=70)
+        try:
+            if dry_run:
+                result = _import_preview(rows, year, month, mode)
+            else:
+                imported, created_users, diff = _import_month(rows, year, month, mode)
+                result = _import_result(imported, created_users, mode, diff)
+        except Exception as e:
+            db.session.rollback()
+            app.logger.exception("import job %s failed", job_id)
+            _job_update(job_id, status='error', error=f'Błąd zapisu do bazy: {e}', finished_at=datetime.now(timezone.utc))
+            return
+        _job_update(job_id, status='done', progress=100, result=result, finished_at=datetime.now(timezone.utc))
+
+
+def _submit_import_job(kind, data, year, month, mode):
+    me = current_user()
+    job = ImportJob(kind=kind, status='queued', progress=0, year=year, month=month,
+                    mode=mode, dry_run=_import_flag('dry_run'), created_by=me.id if me else None)
+    db.session.add(job)
+    db.session.commit()
+    _import_pool.submit(_run_import_job, job.id, kind, data, year, month, mode, job.dry_run)
+    return jsonify({'job_id': job.id, 'status': job.status,
+                    'status_url': f'/api/import-jobs/{job.id}'}), 202
+
+
+def _job_dict(job):
+    d = job.to_dict()
+    ts = job.updated_at
+    if ts is not None and ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)   # SQLite отдаёт naive UTC
+    if job.status in ('queued', 'running') and ts and datetime.now(timezone.utc) - ts > IMPORT_JOB_STALE:
+        d['status'] = 'error'
+        d['error'] = 'Zadanie przerwane (restart serwera?). Wyślij plik ponownie.'
+    return d
+
+
+@app.get('/api/import-jobs/<int:job_id>')
+@jwt_required()
+def import_job_status(job_id):
+    if not _perm('admin'):
+        return jsonify({'error': 'Brak uprawnień'}), 403
+    job = db.session.get(ImportJob, job_id)
+    if not job:
+        return jsonify({'error': 'Nie znaleziono zadania.'}), 404
+    return jsonify(_job_dict(job))
+
+
+@app.get('/api/import-jobs')
+@jwt_required()
+def import_jobs_list():
+    """Последние задачи (для админки после перезагрузки страницы)."""
+    if not _perm('admin'):
+        return jsonify({'error': 'Brak uprawnień'}), 403
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    jobs = ImportJob.query.order_by(ImportJob.id.desc()).limit(limit).all()
+    return jsonify([_job_dict(j) for j in jobs])
 
 
 
@@ -2989,6 +4579,9 @@ def control_deleted_details(event_id):
 
 class CoordShiftReport(db.Model):
     __tablename__ = 'coord_shift_reports'
+    __table_args__ = (
+        db.Index('ix_coord_reports_lounge_type_date', 'lounge', 'shift_type', 'shift_date'),
+    )
     id           = db.Column(db.Integer, primary_key=True)
     lounge       = db.Column(db.String(16), nullable=False)  # 'mazurek' | 'polonez'
     shift_type   = db.Column(db.String(16), nullable=False)  # 'morning' | 'evening'
@@ -3016,8 +4609,7 @@ class CoordShiftReport(db.Model):
 @app.get('/coord-panel')
 @jwt_required()
 def coord_panel_page():
-    role = (get_jwt().get('role') or '').lower()
-    if role != 'coordinator':
+    if not _perm('coordinator'):
         return redirect('/dashboard', 302)
     return render_template('coord-panel.html')
 
@@ -3025,8 +4617,7 @@ def coord_panel_page():
 @app.get('/api/coord-panel/report')
 @jwt_required()
 def api_coord_panel_get():
-    role = (get_jwt().get('role') or '').lower()
-    if role != 'coordinator':
+    if not _perm('coordinator'):
         return jsonify({'error': 'Forbidden'}), 403
 
     lounge = request.args.get('lounge')
@@ -3050,12 +4641,11 @@ def api_coord_panel_get():
 @app.post('/api/coord-panel/report')
 @jwt_required()
 def api_coord_panel_save():
-    role = (get_jwt().get('role') or '').lower()
-    if role != 'coordinator':
+    if not _perm('coordinator'):
         return jsonify({'error': 'Forbidden'}), 403
 
     uid = int(get_jwt()['sub'])
-    user = User.query.get(uid)
+    user = current_user()
     data = request.get_json(force=True)
 
     lounge = data['lounge']
@@ -3091,6 +4681,136 @@ def api_coord_panel_save():
 
 
 
+# ---------------------------------
+# Live updates (опрос /api/events)
+# ---------------------------------
+# Долгие SSE-потоки на gthread-воркерах держали по потоку на клиента; вместо них —
+# короткий опрос с курсором: запрос дешёвый, ни потоков, ни токена в URL.
+# Доставка с задержкой до LIVE_POLL_SECONDS — осознанно; push (SSE/WebSocket на отдельном
+# async-воркере) сюда не входит.
+LIVE_POLL_SECONDS = int(os.getenv('LIVE_POLL_SECONDS', '15'))
+LIVE_EVENTS_LIMIT = 200
+STREAM_EVENTS_TTL = timedelta(hours=24)
+
+def _emit(kind: str, payload: dict, users=(), managers: bool = False, everyone: bool = False):
+    """
+    Кладёт событие в stream_events в ТЕКУЩУЮ транзакцию — уйдёт подписчикам только после commit.
+    users — id получателей; managers — ещё и всем менеджерам; everyone — всем залогиненным.
+    Сама вставка — в before_commit (_stream_events_flush), под своим замком.
+    """
+    audience = None
+    if not everyone:
+        parts = [str(int(u)) for u in users if u]
+        if managers:
+            parts.append('managers')
+        audience = ',' + ','.join(parts) + ','
+    db.session.info.setdefault('stream_events', []).append(
+        {'kind': kind, 'audience': audience, 'payload': payload})
+
+
+@event.listens_for(db.session, 'before_commit')
+def _stream_events_flush(session):
+    """
+    id событий, как и seq журнала, должны становиться видны в порядке commit — поэтому
+    вставка под xact-lock. Замок свой (заявки/рынок/заметки не ждут импорт месяца) и берётся
+    последним, после flush со сменами: порядок «журнал → события» везде один, без взаимных
+    блокировок, и держится он только на время commit.
+    """
+    rows = session.info.pop('stream_events', None)
+    if not rows:
+        return
+    session.flush()
+    _journal_lock(session, STREAM_EVENTS_LOCK_KEY)
+    session.execute(StreamEvent.__table__.insert(), rows)
+
+@event.listens_for(db.session, 'after_rollback')
+def _stream_events_forget(session):
+    session.info.pop('stream_events', None)
+
+
+def _emit_proposal(p):
+    # очередь на утверждение видят менеджеры: туда попадают 'accepted', уходят 'approved'/'rejected'
+    _emit('proposal', {'id': p.id, 'status': p.status},
+          users=(p.requester_id, p.target_user_id),
+          managers=p.status in ('accepted', 'approved', 'rejected'))
+
+
+def _emit_market(o, public: bool = False):
+    # public — оффер появился в списке «open» или ушёл из него: это видят все
+    _emit('market', {'id': o.id, 'status': o.status},
+          users=(o.owner_id, o.candidate_id), everyone=public)
+
+
+_stream_prune_at = 0.0
+
+def _prune_stream_events():
+    # старые события чистим не чаще раза в час на воркер
+    global _stream_prune_at
+    if time.monotonic() < _stream_prune_at:
+        return
+    _stream_prune_at = time.monotonic() + 3600
+    cutoff = datetime.now(timezone.utc) - STREAM_EVENTS_TTL
+    db.session.execute(delete(StreamEvent).where(StreamEvent.created_at < cutoff))
+    db.session.commit()
+
+
+def _cursor_arg(name):
+    raw = (request.args.get(name) or '').strip()
+    if not raw:
+        return None
+    v = int(raw)
+    if v < 0:
+        raise ValueError(name)
+    return v
+
+
+@app.get('/api/events')
+@jwt_required()
+def live_events():
+    """
+    События после курсора ?event=<id>&seq=<seq> — только видимые пользователю:
+      {"event": N, "seq": M, "poll": сек, "events": [{"kind": "shifts"|"proposal"|"market"|"note", "data": {...}}]}
+    Без курсора — только текущие event/seq (точка отсчёта). Ответ отдаёт следующий курсор;
+    "more": true — упёрлись в LIVE_EVENTS_LIMIT, можно спросить ещё раз сразу.
+    """
+    try:
+        after_event, after_seq = _cursor_arg('event'), _cursor_arg('seq')
+    except ValueError:
+        return jsonify({'error': 'Zły kursor.'}), 400
+
+    _prune_stream_events()
+    head_event = db.session.query(func.max(StreamEvent.id)).scalar() or 0
+    head_seq = db.session.query(func.max(ShiftChange.seq)).scalar() or 0
+    out = {'event': head_event, 'seq': head_seq, 'poll': LIVE_POLL_SECONDS, 'events': [], 'more': False}
+    if after_event is None or after_seq is None:
+        return jsonify(out)
+
+    # события заявок/рынка/заметок: аудитория фильтруется в SQL
+    uid = int(get_jwt()['sub'])
+    who = [StreamEvent.audience.is_(None), StreamEvent.audience.like(f'%,{uid},%')]
+    if _perm('manager'):
+        who.append(StreamEvent.audience.like('%,managers,%'))
+    rows = (StreamEvent.query
+            .filter(StreamEvent.id > after_event, StreamEvent.id <= head_event, or_(*who))
+            .order_by(StreamEvent.id.asc())
+            .limit(LIVE_EVENTS_LIMIT + 1)
+            .all())
+    if len(rows) > LIVE_EVENTS_LIMIT:
+        rows = rows[:LIVE_EVENTS_LIMIT]
+        out['event'], out['more'] = rows[-1].id, True
+    out['events'] = [{'kind': ev.kind, 'data': ev.payload or {}} for ev in rows]
+
+    # смены: одно событие с затронутыми месяцами, данные клиент тянет дельтой /api/shifts/changes
+    if after_seq < head_seq:
+        days = (db.session.query(ShiftChange.shift_date)
+                .filter(ShiftChange.seq > after_seq, ShiftChange.seq <= head_seq)
+                .distinct()
+                .all())
+        months = sorted({d.strftime('%Y-%m') for (d,) in days})
+        out['events'].append({'kind': 'shifts', 'data': {'seq': head_seq, 'months': months}})
+    return jsonify(out)
+
+
 @app.route('/favicon.ico')
 def favicon():
     # Возвращаем 204 No Content, чтобы браузер отстал
@@ -3143,6 +4863,341 @@ def control_page():
 
 
 
+# ---------------------------------
+# Миграции схемы (schema_version)
+# ---------------------------------
+# Запуск: `flask --app server migrate` (Render: перед gunicorn в startCommand).
+# Воркеры при старте только сверяют MAX(version) — без create_all и сканов shifts.
+# Новая правка схемы = новый шаг в конце MIGRATIONS, уже выполненные шаги не менять.
+# Шаг получает соединение миграции и описывает свои таблицы сам (снимок на момент шага):
+# модели дальше меняются, а свежая база должна проходить те же шаги, что и старая.
+from sqlalchemy import (MetaData, Table, Column, Integer, String, Text, Boolean, Date,
+                        DateTime, Numeric, JSON, ForeignKey, UniqueConstraint)
+
+
+class SchemaVersion(db.Model):
+    __tablename__ = 'schema_version'
+    version    = db.Column(db.Integer, primary_key=True)
+    name       = db.Column(db.String(100), nullable=False)
+    applied_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
+
+
+class AppSetting(db.Model):
+    """Служебные значения между деплоями (например, хэш списков координаторов)."""
+    __tablename__ = 'app_settings'
+    key   = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.String(255), nullable=True)
+
+
+def _exec(conn, sql, ok_msg):
+    # мягкий шаг: ошибка логируется и не валит миграцию (как старый init-блок)
+    try:
+        with conn.begin_nested():
+            conn.execute(sqltext(sql))
+        app.logger.info(ok_msg)
+    except Exception as e:
+        app.logger.warning(f"skip: {e}")
+
+
+def _add_column(conn, table, column, ddl):
+    cols = {c['name'] for c in db.inspect(conn).get_columns(table)}
+    if column not in cols:
+        conn.execute(sqltext(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+        app.logger.info(f"{table}.{column} added")
+
+
+def _create_index(conn, name, table, columns, unique=False):
+    # IF NOT EXISTS есть и в SQLite, и в Postgres
+    _exec(conn, f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table} ({columns})",
+          f"{name} ensured")
+
+
+def _create_tables(conn, meta, *names):
+    # ссылки FK (users, shifts) в снимке — заглушки: создаём только перечисленные таблицы
+    meta.create_all(bind=conn, tables=[meta.tables[n] for n in names], checkfirst=True)
+
+
+def _m001_baseline(conn):
+    """Схема на момент перехода на миграции + то, что раньше делалось при каждом импорте модуля."""
+    meta = MetaData()
+    Table('users', meta,
+          Column('id', Integer, primary_key=True),
+          Column('email', String(255), unique=True, nullable=True),
+          Column('password_hash', String(255), nullable=True),
+          Column('full_name', String(255), unique=True, nullable=False),
+          Column('role', String(50), nullable=False),
+          Column('order_index', Integer, nullable=True),
+          Column('is_coordinator', Boolean, nullable=False),
+          Column('is_zmiwaka', Boolean, nullable=False),
+          Column('hourly_rate_pln', Numeric(10, 2), nullable=True),
+          Column('tax_percent', Numeric(5, 2), nullable=True),
+          Column('reset_token', String(128), nullable=True),
+          Column('reset_expires', DateTime, nullable=True))
+    Table('shifts', meta,
+          Column('id', Integer, primary_key=True),
+          Column('user_id', Integer, ForeignKey('users.id'), nullable=False),
+          Column('shift_date', Date, nullable=False),
+          Column('shift_code', String(50), nullable=False),
+          Column('hours', Integer, nullable=True),
+          Column('worked_hours', Numeric(5, 2), nullable=True),
+          Column('work_note', Text, nullable=True),
+          Column('lounge', String(16)),
+          Column('coord_lounge', String(16)),
+          UniqueConstraint('user_id', 'shift_date', name='uq_shifts_user_date'))
+    Table('shift_changes', meta,
+          Column('seq', Integer, primary_key=True),
+          Column('op', String(8), nullable=False),
+          Column('shift_id', Integer, nullable=False),
+          Column('shift_date', Date, nullable=False),
+          Column('changed_at', DateTime(timezone=True), server_default=func.now()))
+    Table('stream_events', meta,
+          Column('id', Integer, primary_key=True),
+          Column('kind', String(16), nullable=False),
+          Column('audience', String(255), nullable=True),
+          Column('payload', JSON, nullable=True),
+          Column('created_at', DateTime(timezone=True), server_default=func.now()))
+    Table('control_events', meta,
+          Column('id', Integer, primary_key=True),
+          Column('kind', String(20), nullable=False),
+          Column('user_id', Integer, ForeignKey('users.id'), nullable=False),
+          Column('event_date', Date, nullable=False),
+          Column('reason', Text, nullable=True),
+          Column('hours', Numeric(5, 2), nullable=True),
+          Column('time_from', String(5), nullable=True),
+          Column('time_to', String(5), nullable=True),
+          Column('created_by_id', Integer, ForeignKey('users.id'), nullable=False),
+          Column('created_at', DateTime(timezone=True), server_default=func.now()))
+    Table('swap_proposals', meta,
+          Column('id', Integer, primary_key=True),
+          Column('requester_id', Integer, ForeignKey('users.id'), nullable=False),
+          Column('target_user_id', Integer, ForeignKey('users.id'), nullable=False),
+          Column('my_date', Date, nullable=False),
+          Column('their_date', Date, nullable=False),
+          Column('status', String(20), nullable=False),
+          Column('created_at', DateTime(timezone=True), server_default=func.now()))
+    Table('market_offers', meta,
+          Column('id', Integer, primary_key=True),
+          Column('shift_id', Integer, ForeignKey('shifts.id'), nullable=False, unique=True),
+          Column('owner_id', Integer, ForeignKey('users.id'), nullable=False),
+          Column('candidate_id', Integer, ForeignKey('users.id'), nullable=True),
+          Column('status', String(20), nullable=False),
+          Column('created_at', DateTime(timezone=True), server_default=func.now()))
+    Table('day_notes', meta,
+          Column('id', Integer, primary_key=True),
+          Column('note_date', Date, nullable=False, index=True),
+          Column('text', Text, nullable=False),
+          Column('author_id', Integer, ForeignKey('users.id'), nullable=False),
+          Column('created_at', DateTime(timezone=True), server_default=func.now()))
+    Table('coord_shift_reports', meta,
+          Column('id', Integer, primary_key=True),
+          Column('lounge', String(16), nullable=False),
+          Column('shift_type', String(16), nullable=False),
+          Column('shift_date', Date, nullable=False),
+          Column('coord_name', String, nullable=False),
+          Column('times', JSON),
+          Column('bars', JSON),
+          Column('notes', JSON),
+          Column('created_at', DateTime(timezone=True), server_default=func.now()))
+    meta.create_all(bind=conn, checkfirst=True)
+
+    # старые базы (до появления этих колонок)
+    _add_column(conn, 'users', 'hourly_rate_pln', 'NUMERIC')
+    _add_column(conn, 'users', 'tax_percent', 'NUMERIC DEFAULT 0')
+    _add_column(conn, 'users', 'order_index', 'INTEGER')
+    _add_column(conn, 'users', 'is_coordinator', 'BOOLEAN DEFAULT FALSE NOT NULL')
+    _add_column(conn, 'users', 'is_zmiwaka', 'BOOLEAN DEFAULT FALSE NOT NULL')
+    _add_column(conn, 'shifts', 'coord_lounge', 'VARCHAR(16)')
+    _add_column(conn, 'shifts', 'lounge', 'VARCHAR(16)')
+
+    # allow null email/password in Postgres
+    if conn.dialect.name == 'postgresql':
+        cols = {c['name']: c for c in db.inspect(conn).get_columns('users')}
+        for col in ('email', 'password_hash'):
+            ci = cols.get(col)
+            if ci is not None and not ci.get('nullable', True):
+                _exec(conn, f"ALTER TABLE users ALTER COLUMN {col} DROP NOT NULL", f"users.{col} set NULLABLE")
+
+    # dedupe shifts per (user_id, date) — перед уникальным индексом; остаётся строка с большим id
+    _exec(conn, """
+        DELETE FROM shifts WHERE EXISTS (
+            SELECT 1 FROM shifts k
+            WHERE k.user_id = shifts.user_id AND k.shift_date = shifts.shift_date AND k.id > shifts.id)
+    """, "shifts deduped")
+    _create_index(conn, 'uq_shifts_user_date', 'shifts', 'user_id, shift_date', unique=True)
+
+
+def _m002_user_name_key(conn):
+    _add_column(conn, 'users', 'name_key', 'VARCHAR(255)')
+    _add_column(conn, 'users', 'coord_resolved', 'BOOLEAN')
+    _add_column(conn, 'users', 'zmiwaka_resolved', 'BOOLEAN')
+    _create_index(conn, 'ix_users_name_key', 'users', 'name_key')
+    _backfill_user_flags(conn)
+
+
+def _m003_user_token_version(conn):
+    _add_column(conn, 'users', 'token_version', 'INTEGER DEFAULT 0 NOT NULL')
+
+
+def _m004_user_month_stats(conn):
+    meta = MetaData()
+    Table('user_month_stats', meta,
+          Column('user_id', Integer, primary_key=True),
+          Column('year', Integer, primary_key=True),
+          Column('month', Integer, primary_key=True),
+          Column('shift_count', Integer, nullable=False),
+          Column('scheduled_hours', Numeric(7, 2), nullable=False),
+          Column('worked_hours', Numeric(7, 2), nullable=False),
+          Column('hours', Numeric(7, 2), nullable=False),
+          Column('logged_count', Integer, nullable=False),
+          Column('updated_at', DateTime(timezone=True), server_default=func.now()))
+    _create_tables(conn, meta, 'user_month_stats')
+    _backfill_month_stats(conn)
+
+
+def _m005_staffing_norms(conn):
+    meta = MetaData()
+    Table('staffing_norms', meta,
+          Column('id', Integer, primary_key=True),
+          Column('weekday', Integer, nullable=True),
+          Column('lounge', String(16), nullable=True),
+          Column('slot', String(8), nullable=False),
+          Column('norm', Integer, nullable=False))
+    _create_tables(conn, meta, 'staffing_norms')
+
+
+def _m006_hot_indexes(conn):
+    _create_index(conn, 'ix_shifts_shift_date', 'shifts', 'shift_date')
+    _create_index(conn, 'ix_control_events_event_date', 'control_events', 'event_date')
+    _create_index(conn, 'ix_swap_target_status', 'swap_proposals', 'target_user_id, status')
+    _create_index(conn, 'ix_swap_requester_status', 'swap_proposals', 'requester_id, status')
+    _create_index(conn, 'ix_swap_status', 'swap_proposals', 'status')
+    _create_index(conn, 'ix_market_status_owner', 'market_offers', 'status, owner_id')
+    _create_index(conn, 'ix_coord_reports_lounge_type_date', 'coord_shift_reports', 'lounge, shift_type, shift_date')
+
+
+def _m007_import_jobs(conn):
+    meta = MetaData()
+    Table('users', meta, Column('id', Integer, primary_key=True))
+    Table('import_jobs', meta,
+          Column('id', Integer, primary_key=True),
+          Column('kind', String(8), nullable=False),
+          Column('status', String(12), nullable=False),
+          Column('progress', Integer, nullable=False),
+          Column('year', Integer, nullable=False),
+          Column('month', Integer, nullable=False),
+          Column('mode', String(8), nullable=False),
+          Column('dry_run', Boolean, nullable=False),
+          Column('created_by', Integer, ForeignKey('users.id'), nullable=True),
+          Column('result', JSON, nullable=True),
+          Column('error', Text, nullable=True),
+          Column('created_at', DateTime(timezone=True), server_default=func.now()),
+          Column('updated_at', DateTime(timezone=True), server_default=func.now()),
+          Column('finished_at', DateTime(timezone=True), nullable=True))
+    _create_tables(conn, meta, 'import_jobs')
+
+
+def _m008_shift_changes_date_index(conn):
+    _create_index(conn, 'ix_shift_changes_date_seq', 'shift_changes', 'shift_date, seq')
+
+
+def _m009_app_settings(conn):
+    meta = MetaData()
+    Table('app_settings', meta,
+          Column('key', String(64), primary_key=True),
+          Column('value', String(255), nullable=True))
+    _create_tables(conn, meta, 'app_settings')
+
+
+def _m010_users_rev(conn):
+    # счётчик, который растит _bump_users_rev; строка нужна заранее — там только UPDATE
+    if conn.execute(sqltext("SELECT 1 FROM app_settings WHERE key = 'users_rev'")).first() is None:
+        conn.execute(sqltext("INSERT INTO app_settings (key, value) VALUES ('users_rev', '0')"))
+
+
+MIGRATIONS = [
+    (1, 'baseline', _m001_baseline),
+    (2, 'users.name_key + resolved flags', _m002_user_name_key),
+    (3, 'users.token_version', _m003_user_token_version),
+    (4, 'user_month_stats', _m004_user_month_stats),
+    (5, 'staffing_norms', _m005_staffing_norms),
+    (6, 'hot query indexes', _m006_hot_indexes),
+    (7, 'import_jobs', _m007_import_jobs),
+    (8, 'shift_changes date index', _m008_shift_changes_date_index),
+    (9, 'app_settings', _m009_app_settings),
+    (10, 'app_settings.users_rev', _m010_users_rev),
+]
+MIGRATION_LOCK_KEY = 0x67726166  # pg_advisory_lock: одна миграция на всю БД
+
+
+def schema_version(conn=None) -> int:
+    if conn is None:
+        with db.engine.connect() as conn:
+            return schema_version(conn)
+    if not db.inspect(conn).has_table('schema_version'):
+        return 0
+    return int(conn.execute(sqltext("SELECT MAX(version) FROM schema_version")).scalar() or 0)
+
+
+def migrate() -> list:
+    """
+    Применить недостающие шаги по порядку. Возвращает имена применённых.
+    Замок, шаги и запись версии идут через одно соединение (db.session не участвует):
+    хватает пула на одно соединение, а шаг и его номер коммитятся вместе.
+    """
+    is_pg = db.engine.url.get_backend_name().startswith('postgresql')
+    applied = []
+    with db.engine.connect() as conn:
+        if is_pg:
+            # второй процесс ждёт здесь, потом видит уже поднятую версию
+            conn.execute(sqltext("SELECT pg_advisory_lock(:k)"), {'k': MIGRATION_LOCK_KEY})
+            conn.commit()
+        try:
+            SchemaVersion.__table__.create(bind=conn, checkfirst=True)
+            conn.commit()
+            current = schema_version(conn)
+            for version, name, step in MIGRATIONS:
+                if version <= current:
+                    continue
+                app.logger.info(f"migration {version}: {name}")
+                step(conn)
+                conn.execute(SchemaVersion.__table__.insert(), {'version': version, 'name': name})
+                conn.commit()
+                applied.append(name)
+            # списки координаторов/змываков живут в коде — сверяем их после каждого деплоя
+            _sync_user_flags(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            if is_pg:
+                conn.execute(sqltext("SELECT pg_advisory_unlock(:k)"), {'k': MIGRATION_LOCK_KEY})
+                conn.commit()
+    return applied
+
+
+@app.cli.command('migrate')
+def migrate_command():
+    """flask --app server migrate"""
+    with app.app_context():
+        applied = migrate()
+        print(f"schema_version = {schema_version()}"
+              + (f" (applied: {', '.join(applied)})" if applied else " (up to date)"))
+
+
+# Схему меняет только `flask migrate` (или `python server.py`) — один процесс.
+# AUTO_MIGRATE=1 — миграция при импорте; на Postgres её прикрывает advisory lock,
+# на SQLite замка нет, поэтому только для одного процесса (flask run, без gunicorn).
+# Процессы пула PDF (_parse_schedule_pdf_advanced) тоже импортируют server — им база не нужна.
+AUTO_MIGRATE = os.getenv('AUTO_MIGRATE', '0') == '1'
+if multiprocessing.parent_process() is None:
+    with app.app_context():
+        if AUTO_MIGRATE:
+            migrate()
+        elif schema_version() < MIGRATIONS[-1][0]:
+            app.logger.warning("schema_version behind: run `flask --app server migrate`")
+
+
 @app.errorhandler(Exception)
 def catch_all(e):
     app.logger.exception("Unhandled")
@@ -3152,8 +5207,7 @@ def catch_all(e):
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5000))
     with app.app_context():
-        ensure_coord_lounge_column()
-        ensure_lounge_column()   # ← ВАЖНО
+        migrate()
     app.run(host='0.0.0.0', port=port, debug=True, use_reloader=False)
 
 
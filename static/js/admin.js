@@ -72,11 +72,44 @@
     window.location.href = '/';
   });
 
+  // ===== Итог импорта (replace / merge) =====
+  function importSummary(data){
+    const d = data.diff;
+    if (data.dry_run){
+      // ?dry_run=1 — ничего не записано, только прогноз
+      let s = `Podgląd: wierszy ${data.imported}; dodano ${d.added}, zmieniono ${d.changed}, usunięto ${d.removed}, bez zmian ${d.unchanged}`;
+      if (data.new_users?.length) s += `; nowi: ${data.new_users.join(', ')}`;
+      const typos = (data.unmatched || []).filter(u => u.similar.length);
+      if (typos.length) s += `; podobne: ` + typos.map(u => `${u.name} → ${u.similar.join('/')}`).join(', ');
+      if (data.lost && (data.lost.offers || data.lost.worked))
+        s += `; przepadnie ofert: ${data.lost.offers}, wpisów godzin: ${data.lost.worked}`;
+      return s;
+    }
+    let s = `Zaimportowano: ${data.imported}`;
+    if (Array.isArray(data.created_users)) s += `, nowych użytkowników: ${data.created_users.length}`;
+    if (d) s += ` (dodano ${d.added}, zmieniono ${d.changed}, usunięto ${d.removed}, bez zmian ${d.unchanged})`;
+    return s;
+  }
+
+  // ===== Фоновый импорт: опрос /api/import-jobs/<id> =====
+  async function waitImportJob(id, msg){
+    for (;;){
+      await new Promise(r => setTimeout(r, 1000));
+      const res = await fetch(`/api/import-jobs/${id}`, { headers: { 'Authorization': 'Bearer ' + token } });
+      const job = await res.json().catch(()=> ({}));
+      if (!res.ok) throw job;
+      if (job.status === 'done') return job.result;
+      if (job.status === 'error') throw { error: job.error };
+      msg.textContent = `Przetwarzanie… ${job.progress || 0}%`;
+    }
+  }
+
   // ===== XLSX upload =====
   const uploadForm = document.getElementById('upload-form');
   uploadForm?.addEventListener('submit', async (e)=>{
     e.preventDefault();
-    const btn = uploadForm.querySelector('button[type="submit"]');
+    const btn = e.submitter || uploadForm.querySelector('button[type="submit"]');
+    const preview = !!btn?.dataset.preview;
     const msg = document.getElementById('upload-msg');
 
     const month = Number(document.getElementById('month-select')?.value || 0);
@@ -94,17 +127,18 @@
       fd.append('month', String(month));
       fd.append('year',  String(year));
 
-      const res = await fetch('/api/upload-xlsx', {  // <-- ЭТОТ ЭНДПОИНТ на бэке
+      // async=1: сервер отвечает 202 + job_id, дальше опрашиваем статус
+      const res = await fetch('/api/upload-xlsx?async=1' + (preview ? '&dry_run=1' : ''), {  // <-- ЭТОТ ЭНДПОИНТ на бэке
         method: 'POST',
         headers: { 'Authorization': 'Bearer ' + token },
         body: fd
       });
 
-      const data = await res.json().catch(()=> ({}));
+      let data = await res.json().catch(()=> ({}));
       if (!res.ok) throw data;
+      if (res.status === 202) data = await waitImportJob(data.job_id, msg);
 
-      msg.textContent = `Zaimportowano: ${data.imported}` +
-        (Array.isArray(data.created_users) ? `, nowych użytkowników: ${data.created_users.length}` : '');
+      msg.textContent = importSummary(data);
 
     }catch(err){
       msg.textContent = err?.error || err?.message || 'Błąd importu XLSX';
@@ -117,10 +151,12 @@
   const pasteForm = document.getElementById('paste-form');
   pasteForm?.addEventListener('submit', async (e)=>{
     e.preventDefault();
-    const btn = pasteForm.querySelector('button[type="submit"]');
+    const btn = e.submitter || pasteForm.querySelector('button[type="submit"]');
+    const preview = !!btn?.dataset.preview;
     const msg = document.getElementById('paste-msg');
 
     const text  = (pasteForm.text?.value || '').trim();
+    const mode  = pasteForm.mode?.checked ? 'merge' : 'replace';
     const month = Number(document.getElementById('month-select-text')?.value || 0);
     const year  = Number(document.getElementById('year-select-text')?.value  || 0);
 
@@ -136,10 +172,9 @@
       if (typeof window.api === 'function'){
         const data = await window.api('/api/upload-text', {
           method: 'POST',
-          body: JSON.stringify({ text, month, year })
+          body: JSON.stringify({ text, month, year, mode, dry_run: preview ? 1 : 0 })
         });
-        msg.textContent = `Zaimportowano: ${data.imported}` +
-          (Array.isArray(data.created_users) ? `, nowych użytkowników: ${data.created_users.length}` : '');
+        msg.textContent = importSummary(data);
       } else {
         const res = await fetch('/api/upload-text', {
           method: 'POST',
@@ -147,13 +182,12 @@
             'Content-Type':'application/json',
             'Authorization':'Bearer ' + token
           },
-          body: JSON.stringify({ text, month, year })
+          body: JSON.stringify({ text, month, year, mode, dry_run: preview ? 1 : 0 })
         });
         const data = await res.json().catch(()=> ({}));
         if (!res.ok) throw data;
 
-        msg.textContent = `Zaimportowano: ${data.imported}` +
-          (Array.isArray(data.created_users) ? `, nowych użytkowników: ${data.created_users.length}` : '');
+        msg.textContent = importSummary(data);
       }
     }catch(err){
       msg.textContent = err?.error || err?.message || 'Błąd importu tekstu';
@@ -87,9 +87,39 @@ async function api(path, opts = {}) {
   window.clearToken = clearToken;
   window.currentClaims = currentClaims;
 
-  // keep-alive
+  // live-обновления: опрос /api/events с курсором вместо ручных обновлений; события → window 'grafik:<kind>'
+  (function liveEvents(){
+    let cursor = null, timer = null, every = 15000;
+    function stop(){ clearTimeout(timer); timer = null; window.liveStreamOpen = false; }
+    function later(ms){ clearTimeout(timer); timer = setTimeout(poll, ms); }
+    async function poll(){
+      timer = null;
+      if (!getToken() || document.visibilityState !== 'visible') return stop();
+      try {
+        const q = cursor ? `?event=${cursor.event}&seq=${cursor.seq}` : '';
+        const r = await api('/api/events' + q, { method:'GET' });
+        (r.events || []).forEach(ev =>
+          window.dispatchEvent(new CustomEvent('grafik:' + ev.kind, { detail: ev.data || {} })));
+        cursor = { event: r.event, seq: r.seq };
+        if (r.poll) every = r.poll * 1000;
+        window.liveStreamOpen = true;
+        later(r.more ? 0 : every);
+      } catch(_){
+        window.liveStreamOpen = false;
+        later(every * 2);
+      }
+    }
+    // скрытая вкладка не опрашивает сервер; вернулась — сразу догоняет с того же курсора
+    document.addEventListener('visibilitychange', () => {
+      if (document.visibilityState === 'visible') later(0); else stop();
+    });
+    window.addEventListener('pagehide', stop);
+    if (document.visibilityState === 'visible') later(0);
+  })();
+
+  // keep-alive (пока идёт live-опрос — не нужен)
   (function keepAlive(){
-    const ping = () => fetch('/api/health', { cache:'no-store' }).catch(()=>{});
+    const ping = () => window.liveStreamOpen ? null : fetch('/api/health', { cache:'no-store' }).catch(()=>{});
     let timer = null;
     function start(){
       clearInterval(timer);
@@ -415,8 +445,22 @@ async function api(path, opts = {}) {
     ALL_SHIFTS = data || [];
     return data;
   }
+  // дни грузим пачкой на всю неделю (/api/days) и держим в памяти — соседние дни без запросов
+  const DAY_CACHE = new Map();
+  window.addEventListener('grafik:shifts', () => DAY_CACHE.clear());
+  // заметки лежат в том же кэше дня — выкидываем только затронутый день
+  window.addEventListener('grafik:note', (ev) => {
+    if (ev.detail?.date) DAY_CACHE.delete(ev.detail.date); else DAY_CACHE.clear();
+  });
   async function fetchDayShifts(isoDate){
-    return await api('/api/day-shifts?date=' + encodeURIComponent(isoDate), { method:'GET' });
+    if (!DAY_CACHE.has(isoDate)){
+      const d = new Date(isoDate + 'T12:00:00');
+      const from = new Date(d); from.setDate(d.getDate() - ((d.getDay() + 6) % 7));
+      const to = new Date(from); to.setDate(from.getDate() + 6);
+      const days = await api(`/api/days?from=${isoLocal(from)}&to=${isoLocal(to)}`, { method:'GET' });
+      Object.entries(days || {}).forEach(([iso, day]) => DAY_CACHE.set(iso, day));
+    }
+    return DAY_CACHE.get(isoDate) || { morning:[], evening:[] };
   }
 
   function groupShiftsByDate(shifts){
@@ -467,7 +511,8 @@ async function api(path, opts = {}) {
         cell.appendChild(list);
 
         cell.addEventListener('click', async () => {
-          const all = await fetchDayShifts(iso);
+          let all;
+          try { all = await fetchDayShifts(iso); } catch(err){ alert(err.message || 'Błąd'); return; }
           openDayModal(iso, all);
         });
       } else {
@@ -527,10 +572,10 @@ async function api(path, opts = {}) {
     return col;
   }
 
-  async function openDayModal(isoDate){
-    let data;
+  async function openDayModal(isoDate, preloaded){
+    let data = preloaded;
     try{
-      data = await api('/api/day-shifts?date=' + encodeURIComponent(isoDate));
+      if (!data) data = await fetchDayShifts(isoDate);
     }catch(err){ alert(err.message || 'Błąd'); return; }
 
     const d = new Date(isoDate + 'T12:00:00');
@@ -851,7 +896,7 @@ window.isoToUTCDate = isoToUTCDate;
 window.isBeforeTomorrowWarsaw = isBeforeTomorrowWarsaw;
 
 (function startKeepAlive(){
-  const ping = () => fetch('/api/health', { cache: 'no-store' }).catch(()=>{});
+  const ping = () => window.liveStreamOpen ? null : fetch('/api/health', { cache: 'no-store' }).catch(()=>{});
   ping();
   setInterval(ping, 240000);
   document.addEventListener('visibilitychange', () => {
@@ -428,19 +428,84 @@
   
   // ========= Bulk загрузка/рендер месяца =========
   function monthKey(d){ return d.getFullYear() + '-' + String(d.getMonth()+1).padStart(2,'0'); }
+  // компактный формат /api/month-shifts?format=compact → обычная структура {iso:{morning:[],evening:[]}}
+  function expandCompactMonth(c){
+    const U = c.users || {}, codes = c.codes || [], lounges = c.lounges || [];
+    const out = {};
+    Object.entries(c.days || {}).forEach(([iso, slots]) => {
+      const day = out[iso] = { morning:[], evening:[] };
+      Object.entries(slots).forEach(([slot, col]) => {
+        day[slot] = (col.i || []).map((id, j) => {
+          const u = col.u[j], code = codes[col.c[j]] ?? '';
+          const coord = lounges[col.k[j]] ?? null;
+          return {
+            id, user_id: U.id[u], full_name: U.full_name[u], order_index: U.order_index[u],
+            is_zmiwaka: !!U.is_zmiwaka[u], shift_code: code, hours: col.h ? col.h[j] : null,
+            lounge: lounges[col.l[j]] ?? null, coord_lounge: coord,
+            is_coordinator: !!coord, is_bar_today: String(code).toUpperCase().includes('B'),
+          };
+        });
+      });
+    });
+    return out;
+  }
+
+  // полный снимок месяца живёт не дольше этого, дальше — перезагрузка вместо дельты
+  const MONTH_SNAPSHOT_MAX_AGE = 10*60*1000;
+
+  async function loadMonthSnapshot(y, m){
+    // seq приходит вместе с месяцем: сервер читает его в той же транзакции, что и смены
+    const compact = await api(`/api/month-shifts?year=${y}&month=${m}&format=compact`, { method:'GET' });
+    return { ts: Date.now(), seq: compact.seq, data: expandCompactMonth(compact) };
+  }
+
+  // ========= Дельта-синхронизация (/api/shifts/changes) =========
+  const slotOf = code => String(code||'').trim().startsWith('2') ? 'evening' : 'morning';
+  function sortSlot(list){
+    list.sort((a, b) => (a.order_index ?? Infinity) - (b.order_index ?? Infinity)
+      || String(a.full_name||'').localeCompare(String(b.full_name||'')));
+  }
+  function applyChanges(monthData, ym, changes){
+    (changes||[]).forEach(ch => {
+      // смена могла уехать на другой день/месяц — убираем её по id отовсюду
+      Object.values(monthData).forEach(day => {
+        ['morning','evening'].forEach(k => { if (day[k]) day[k] = day[k].filter(p => p.id !== ch.id); });
+      });
+      if (!String(ch.date||'').startsWith(ym)) return;
+      if (ch.op === 'upsert' && ch.item){
+        const d = monthData[ch.date] || (monthData[ch.date] = { morning:[], evening:[] });
+        const slot = ch.slot || slotOf(ch.item.shift_code);
+        d[slot].push(ch.item);
+        sortSlot(d[slot]);
+      }
+    });
+  }
+
   async function fetchMonthBulk(d){
     const y = d.getFullYear(), m = d.getMonth()+1;
-    const key = 'monthCache:'+y+'-'+String(m).padStart(2,'0');
+    const ym = y+'-'+String(m).padStart(2,'0');
+    const key = 'monthCache:'+ym;
+    let entry = null;
     try{
       const cached = sessionStorage.getItem(key);
       if (cached){
-        const { ts, data } = JSON.parse(cached);
-        if (Date.now() - ts < 120*1000) return data;
+        const parsed = JSON.parse(cached);
+        if (parsed && parsed.seq != null && parsed.data
+            && Date.now() - (parsed.ts || 0) < MONTH_SNAPSHOT_MAX_AGE) entry = parsed;
       }
     }catch(_){}
-    const data = await api(`/api/month-shifts?year=${y}&month=${m}`, { method:'GET' });
-    try{ sessionStorage.setItem(key, JSON.stringify({ ts:Date.now(), data })); }catch(_){}
-    return data;
+    if (!entry) entry = await loadMonthSnapshot(y, m);
+    else {
+      // снимок из sessionStorage дотягиваем только изменениями
+      try{
+        const delta = await api('/api/shifts/changes?since='+encodeURIComponent(entry.seq), { method:'GET' });
+        if (delta.reset) entry = await loadMonthSnapshot(y, m);
+        else { applyChanges(entry.data, ym, delta.changes); entry.seq = delta.seq; }
+      }catch(_){ entry = await loadMonthSnapshot(y, m); }
+    }
+    // ts — время полного снимка, дельты его не продлевают
+    try{ sessionStorage.setItem(key, JSON.stringify({ ts:entry.ts, seq:entry.seq, data:entry.data })); }catch(_){}
+    return entry.data;
   }
 
   function updatePastBtn() {
@@ -499,6 +564,18 @@
     requestAnimationFrame(step);
   }
 
+  // live: смены месяца изменились → дельта и перерисовка уже показанных дней (без сброса прокрутки)
+  async function refreshShownDays(){
+    const monthData = await fetchMonthBulk(baseMonth);
+    $$('[data-day-row]', daysRoot).forEach(row => {
+      const iso = row.dataset.dayRow;
+      row.replaceWith(dayRow(iso, monthData[iso] || { morning:[], evening:[] }, iso === isoLocal(TODAY)));
+    });
+  }
+  window.addEventListener('grafik:shifts', (ev) => {
+    if ((ev.detail?.months || []).includes(monthKey(baseMonth))) refreshShownDays().catch(()=>{});
+  });
+
   // ---------- controls ----------
   $('#prev-month')?.addEventListener('click', () => { baseMonth = new Date(baseMonth.getFullYear(), baseMonth.getMonth() - 1, 1); renderMonthLadder(); });
   $('#next-month')?.addEventListener('click', () => { baseMonth = new Date(baseMonth.getFullYear(), baseMonth.getMonth() + 1, 1); renderMonthLadder(); });
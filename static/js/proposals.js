@@ -7,7 +7,7 @@
   var tabBtns = Array.prototype.slice.call(document.querySelectorAll('button[data-tab]'));
   var mgrTab  = document.querySelector('#mgr-tab');
 
-  var data   = { incoming: [], outgoing: [], for_approval: [] };
+  var data   = { incoming: [], outgoing: [], for_approval: [], next: {} };
   var active = 'incoming';
   var redirected = false;
 
@@ -95,12 +95,15 @@
 
   // ----- init
   load().catch(function(e){ if(!redirected) alert((e && e.message) || 'Błąd pobierania propozycji'); });
+  // live: новая/изменённая заявка → перечитываем список
+  window.addEventListener('grafik:proposal', function(){ load().catch(function(){}); });
 
   function load(){
-    return apiCall('/api/proposals').then(function(json){
+    return apiCall('/api/proposals?limit=50').then(function(json){
       data.incoming     = json.incoming     || [];
       data.outgoing     = json.outgoing     || [];
       data.for_approval = json.for_approval || json.to_approve || [];
+      data.next         = json.next || {};
       if (mgrTab) mgrTab.hidden = !data.for_approval.length;
       var def = tabBtns.find(function(b){ return b.dataset.tab === 'incoming'; });
       if (def) def.classList.add('active');
@@ -121,6 +124,24 @@
       return;
     }
     items.forEach(function(sp){ listEl.appendChild(row(sp)); });
+
+    // следующая страница (keyset: cursor = id последней строки)
+    var box = active === 'manager' ? 'for_approval' : active;
+    var cursor = data.next[box];
+    if (cursor){
+      var more = document.createElement('button');
+      more.className = 'btn-secondary';
+      more.textContent = 'Pokaż więcej';
+      more.addEventListener('click', function(){
+        more.disabled = true;
+        apiCall('/api/proposals?box=' + box + '&cursor=' + encodeURIComponent(cursor)).then(function(json){
+          data[box] = data[box].concat(json[box] || []);
+          data.next[box] = (json.next || {})[box] || null;
+          render();
+        }).catch(function(e){ more.disabled = false; alert((e && e.message) || 'Błąd pobierania propozycji'); });
+      });
+      listEl.appendChild(more);
+    }
   }
 
   // ===== parsing helpers
@@ -267,7 +267,9 @@
   // ---------- загрузка ----------
   async function loadToday(){
     try{
-      const day = await api('/api/day-shifts?date='+iso);
+      // смены и заметки дня — одним запросом
+      const days = await api('/api/days?from='+iso+'&to='+iso);
+      const day = days[iso] || {};
       dayCache = { morning: day.morning||[], evening: day.evening||[] };
 
       let my=null, group=null;
@@ -285,8 +287,7 @@
       // сначала работа
       renderWork(group || 'morning');
       // потом заметки
-      const notes = await api('/api/day-notes?date='+iso);
-      renderNotes(notes);
+      renderNotes(day.notes || []);
 
     }catch(e){
       if (els.shiftBox) els.shiftBox.textContent = e.message || 'Błąd';
@@ -328,6 +329,9 @@
 
   $('#note-add')?.addEventListener('click', addNote);
   $('#btn-refresh')?.addEventListener('click', loadToday);
+  // live: заметки и смены этого дня
+  window.addEventListener('grafik:note', (ev) => { if (ev.detail?.date === iso) loadNotesOnly(); });
+  window.addEventListener('grafik:shifts', (ev) => { if ((ev.detail?.months || []).includes(iso.slice(0, 7))) loadToday(); });
 
   loadToday();
 })();
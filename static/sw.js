@@ -1,4 +1,4 @@
-// v1 — shell + runtime cache
+// v2 — shell + runtime cache (API: ревалидация по ETag)
 const CORE = [
   '/', '/dashboard',
   '/static/css/style.css',
@@ -11,7 +11,7 @@ self.addEventListener('install', e=>{
 self.addEventListener('activate', e=>{
   e.waitUntil(
     caches.keys().then(keys=>Promise.all(
-      keys.filter(k=>!['core-v1','rt-v1'].includes(k)).map(k=>caches.delete(k))
+      keys.filter(k=>!['core-v1','rt-v2'].includes(k)).map(k=>caches.delete(k))
     ))
   );
   self.clients.claim();
@@ -23,13 +23,22 @@ self.addEventListener('fetch', e=>{
   // runtime cache для статики и GET API
   if (request.method==='GET' && (url.pathname.startsWith('/static/') || url.pathname.startsWith('/api/'))){
     e.respondWith(
-      caches.open('rt-v1').then(async cache=>{
+      caches.open('rt-v2').then(async cache=>{
+        const cached = await cache.match(request);
+        // есть ETag в кэше — спрашиваем сервер условно, на 304 отдаём кэш
+        let req = request;
+        const etag = cached && cached.headers.get('ETag');
+        if (etag){
+          const headers = new Headers(request.headers);
+          headers.set('If-None-Match', etag);
+          req = new Request(request, { headers });
+        }
         try{
-          const net = await fetch(request);
+          const net = await fetch(req);
+          if (net.status === 304 && cached) return cached;
           if (net.ok) cache.put(request, net.clone());
           return net;
         }catch{
-          const cached = await cache.match(request);
           return cached || new Response(JSON.stringify({offline:true}), {status:503, headers:{'content-type':'application/json'}});
         }
       })
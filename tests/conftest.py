@@ -0,0 +1,53 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# база — временный SQLite, задаётся до импорта server (он читает DATABASE_URL при импорте)
+_DB_DIR = tempfile.mkdtemp(prefix='grafik-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_DB_DIR, 'test.db')
+os.environ['ADMIN_EMAILS'] = 'admin@example.com'
+os.environ['JWT_SECRET_KEY'] = 'tests-only-secret-key-0123456789abcdef'
+os.environ['PARSE_CACHE_MAX_MB'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server  # noqa: E402
+
+with server.app.app_context():
+    server.migrate()
+
+KEEP_TABLES = {'schema_version', 'app_settings'}
+
+
+@pytest.fixture
+def app():
+    yield server.app
+    # после теста — пустые таблицы и холодные кэши процесса
+    with server.app.app_context():
+        server.db.session.remove()
+        for table in reversed(server.db.metadata.sorted_tables):
+            if table.name not in KEEP_TABLES:
+                server.db.session.execute(table.delete())
+        server.db.session.commit()
+    server.month_cache._items.clear()
+    server.token_versions._data.clear()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def register(client):
+    """register(email, name) → access_token; admin@example.com получает роль admin."""
+    def _register(email, full_name):
+        r = client.post('/api/register', json={'email': email, 'password': 'secret1', 'full_name': full_name})
+        assert r.status_code == 200, r.get_json()
+        return r.get_json()['access_token']
+    return _register
+
+
+def auth(token):
+    return {'Authorization': 'Bearer ' + token}
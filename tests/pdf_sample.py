@@ -0,0 +1,76 @@
+"""
+Синтетический PDF-график для тестов парсера: страницы × строки × дни,
+цифры чёрные/синие (зал), у части ячеек — голубая/жёлтая заливка (координатор),
+плюс мелкий «шум» внизу страницы. Без внешних зависимостей: PDF собирается вручную.
+"""
+import random
+
+W, H = 842, 1200
+X0, CW, RH = 150, 20, 18
+TEXT_COLORS = {'0 0 0': 'polonez', '0.1 0.2 0.9': 'mazurek'}
+FILL_COLORS = {'0.3 0.6 1': 'mazurek', '1 0.95 0.2': 'polonez'}
+CODES = ('1', '2', '1/B', '2/B', '', '')
+
+
+def make_pdf(pages=2, rows=12, days=30, seed=3, noise=300):
+    """
+    Возвращает (pdf_bytes, expected), expected — {(name, day): (code, lounge, coord_lounge)}:
+    то, что _parse_schedule_pdf_advanced должен прочитать из файла.
+    """
+    rnd = random.Random(seed)
+    expected, contents = {}, []
+    for p in range(pages):
+        top = H - 60
+        ops = ['0 0 0 rg BT /F1 9 Tf']
+        ops += [f'1 0 0 1 {X0 + (d - 1) * CW + 5} {top} Tm ({d}) Tj' for d in range(1, days + 1)]
+        ops.append('ET')
+        for r in range(rows):
+            y = top - (r + 1) * RH
+            name = f'Pracownik{p:02d}{r:02d} Nazwisko{r:02d}'
+            ops.append(f'0 0 0 rg {X0 - 140} {y - 4} {days * CW + 140} 0.5 re f')
+            fills = {}
+            for d in range(days):
+                if rnd.random() < 0.15:
+                    fills[d] = rnd.choice(list(FILL_COLORS))
+                    ops.append(f'{fills[d]} rg {X0 + d * CW + 1} {y - 3} {CW - 2} {RH - 2} re f')
+            ops.append(f'0 0 0 rg BT /F1 9 Tf 1 0 0 1 {X0 - 140} {y} Tm ({name}) Tj ET')
+            for d in range(days):
+                code = rnd.choice(CODES)
+                if not code:
+                    continue
+                color = rnd.choice(list(TEXT_COLORS))
+                ops.append(f'{color} rg BT /F1 9 Tf 1 0 0 1 {X0 + d * CW + 3} {y} Tm ({code}) Tj ET')
+                expected[(name, d + 1)] = (code, TEXT_COLORS[color], FILL_COLORS.get(fills.get(d)))
+        for _ in range(noise):
+            ops.append(f'0.5 0.5 0.5 rg BT /F1 4 Tf 1 0 0 1 {rnd.uniform(10, W - 10):.1f} '
+                       f'{rnd.uniform(10, 40):.1f} Tm (.) Tj ET')
+        contents.append('\n'.join(ops).encode())
+    return _assemble(contents), expected
+
+
+def _assemble(contents):
+    objs = []
+
+    def add(body):
+        objs.append(body)
+        return len(objs)
+
+    font = add(b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>')
+    content_ids = [add(b'<< /Length %d >>\nstream\n' % len(c) + c + b'\nendstream') for c in contents]
+    pages_id = len(objs) + 1 + len(contents)
+    page_ids = [add(f'<< /Type /Page /Parent {pages_id} 0 R /MediaBox [0 0 {W} {H}] '
+                    f'/Resources << /Font << /F1 {font} 0 R >> >> /Contents {cid} 0 R >>'.encode())
+                for cid in content_ids]
+    kids = ' '.join(f'{i} 0 R' for i in page_ids)
+    add(f'<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>'.encode())
+    root = add(f'<< /Type /Catalog /Pages {pages_id} 0 R >>'.encode())
+
+    out, offsets = bytearray(b'%PDF-1.4\n'), []
+    for i, body in enumerate(objs, 1):
+        offsets.append(len(out))
+        out += f'{i} 0 obj\n'.encode() + body + b'\nendobj\n'
+    xref = len(out)
+    out += f'xref\n0 {len(objs) + 1}\n0000000000 65535 f \n'.encode()
+    out += b''.join(f'{o:010d} 00000 n \n'.encode() for o in offsets)
+    out += f'trailer\n<< /Size {len(objs) + 1} /Root {root} 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode()
+    return bytes(out)
@@ -0,0 +1,108 @@
+from flask_jwt_extended import decode_token
+from werkzeug.security import generate_password_hash
+
+from conftest import auth
+from server import db, token_versions, User
+
+ADMIN_ONLY = '/api/upload-text'
+
+
+def _login(client, email):
+    r = client.post('/api/login', json={'email': email, 'password': 'secret1'})
+    assert r.status_code == 200, r.get_json()
+    return r.get_json()['access_token']
+
+
+def _update_user(app, email, **values):
+    with app.app_context():
+        u = User.query.filter_by(email=email).one()
+        for k, v in values.items():
+            setattr(u, k, v)
+        db.session.commit()
+
+
+def _admin_call(client, tok):
+    # пустой текст: у админа 400, у остальных 403 — до парсинга
+    return client.post(ADMIN_ONLY, json={'text': '', 'year': 2026, 'month': 11}, headers=auth(tok)).status_code
+
+
+def test_claims_carry_permissions(app, register):
+    admin = register('admin@example.com', 'Admin A')
+    user = register('b@example.com', 'Bob B')
+    with app.app_context():
+        a, u = decode_token(admin), decode_token(user)
+    assert (a['admin'], a['role'], a['tv']) == (True, 'admin', 0)
+    assert (u['admin'], u['manager'], u['role']) == (False, False, 'user')
+
+
+def test_permissions_checked_from_claims(client, register):
+    admin = register('admin@example.com', 'Admin A')
+    user = register('b@example.com', 'Bob B')
+    assert _admin_call(client, admin) == 400
+    assert _admin_call(client, user) == 403
+
+
+def test_role_change_revokes_old_token(app, client, register):
+    register('admin@example.com', 'Admin A')
+    old = register('b@example.com', 'Bob B')
+    assert client.get('/api/me/settings', headers=auth(old)).status_code == 200
+
+    _update_user(app, 'b@example.com', role='admin')
+
+    assert client.get('/api/me/settings', headers=auth(old)).status_code == 401
+    new = _login(client, 'b@example.com')
+    assert _admin_call(client, new) == 400
+
+
+def test_password_change_revokes_old_token(app, client, register):
+    old = register('admin@example.com', 'Admin A')
+    _update_user(app, 'admin@example.com', password_hash=generate_password_hash('secret1'))
+    assert client.get('/api/me/settings', headers=auth(old)).status_code == 401
+    assert client.get('/api/me/settings', headers=auth(_login(client, 'admin@example.com'))).status_code == 200
+
+
+def test_unrelated_edit_keeps_token(app, client, register):
+    tok = register('admin@example.com', 'Admin A')
+    assert client.post('/api/me/settings', json={'hourly_rate_pln': 30}, headers=auth(tok)).status_code == 200
+    assert client.get('/api/me/settings', headers=auth(tok)).status_code == 200
+
+
+def test_version_cache_dropped_only_after_commit(app, client, register):
+    register('admin@example.com', 'Admin A')
+    old = register('b@example.com', 'Bob B')
+    assert client.get('/api/me/settings', headers=auth(old)).status_code == 200   # версия в кэше
+    with app.app_context():
+        u = User.query.filter_by(email='b@example.com').one()
+        u.role = 'manager'
+        db.session.flush()
+        # соседний запрос до commit ещё видит старую версию и кладёт её в кэш
+        token_versions._data[u.id] = (0, float('inf'))
+        db.session.commit()
+    assert client.get('/api/me/settings', headers=auth(old)).status_code == 401
+
+
+def test_rolled_back_change_keeps_cache(app, client, register):
+    register('admin@example.com', 'Admin A')
+    tok = register('b@example.com', 'Bob B')
+    with app.app_context():
+        u = User.query.filter_by(email='b@example.com').one()
+        uid = u.id
+        u.role = 'manager'
+        db.session.flush()
+        db.session.rollback()
+    assert client.get('/api/me/settings', headers=auth(tok)).status_code == 200
+    assert uid in token_versions._data
+
+
+def test_coordinator_permissions_from_claims(app, client, register):
+    register('admin@example.com', 'Admin A')
+    user = register('b@example.com', 'Bob B')
+    _update_user(app, 'b@example.com', role='coordinator')
+    coord = _login(client, 'b@example.com')
+    url = '/api/coord-panel/report?lounge=mazurek&shift_type=morning&date=2026-03-02'
+    assert client.get(url, headers=auth(coord)).status_code == 200
+    assert client.get('/api/admin/control?month=2026-03', headers=auth(coord)).status_code == 200
+    other = register('c@example.com', 'Cezary C')
+    assert client.get(url, headers=auth(other)).status_code == 403
+    assert client.get('/api/admin/control?month=2026-03', headers=auth(other)).status_code == 403
+    assert client.get(url, headers=auth(user)).status_code == 401   # токен до смены роли
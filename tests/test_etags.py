@@ -0,0 +1,100 @@
+from contextlib import contextmanager
+from datetime import date
+
+from sqlalchemy import event
+
+from conftest import auth
+from server import db, DayNote, Shift, User
+
+
+def _user_id(app, email):
+    with app.app_context():
+        return User.query.filter_by(email=email).one().id
+
+
+def _add_shift(app, uid, d, code='1'):
+    with app.app_context():
+        sh = Shift(user_id=uid, shift_date=d, shift_code=code)
+        db.session.add(sh)
+        db.session.commit()
+        return sh.id
+
+
+@contextmanager
+def _shift_selects(app):
+    with app.app_context():
+        engine = db.engine
+    seen = []
+
+    def grab(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and 'FROM shifts' in statement:
+            seen.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', grab)
+    try:
+        yield seen
+    finally:
+        event.remove(engine, 'before_cursor_execute', grab)
+
+
+def _get(client, tok, url, etag=None):
+    headers = auth(tok)
+    if etag:
+        headers['If-None-Match'] = etag
+    return client.get(url, headers=headers)
+
+
+URLS = ['/api/day-shifts?date=2026-03-02', '/api/my-shifts', '/api/my-shifts-brief?month=2026-03',
+        '/api/days?from=2026-03-01&to=2026-03-07']
+
+
+def test_not_modified_skips_shift_queries(app, client, register):
+    tok = register('admin@example.com', 'Admin A')
+    _add_shift(app, _user_id(app, 'admin@example.com'), date(2026, 3, 2))
+    for url in URLS:
+        etag = _get(client, tok, url).headers['ETag']
+        with _shift_selects(app) as seen:
+            r = _get(client, tok, url, etag)
+        assert r.status_code == 304 and r.data == b'', url
+        assert seen == [], url
+
+
+def test_shift_edit_changes_etag(app, client, register):
+    tok = register('admin@example.com', 'Admin A')
+    sid = _add_shift(app, _user_id(app, 'admin@example.com'), date(2026, 3, 2))
+    etags = {url: _get(client, tok, url).headers['ETag'] for url in URLS}
+    with app.app_context():
+        db.session.get(Shift, sid).shift_code = '2'
+        db.session.commit()
+    for url, etag in etags.items():
+        r = _get(client, tok, url, etag)
+        assert r.status_code == 200 and r.headers['ETag'] != etag, url
+
+
+def test_rename_and_notes_change_etag(app, client, register):
+    tok = register('admin@example.com', 'Admin A')
+    uid = _user_id(app, 'admin@example.com')
+    _add_shift(app, uid, date(2026, 3, 2))
+    day = '/api/day-shifts?date=2026-03-02'
+    days = '/api/days?from=2026-03-01&to=2026-03-07'
+    etag = _get(client, tok, day).headers['ETag']
+    with app.app_context():
+        db.session.get(User, uid).full_name = 'Admin Nowy'
+        db.session.commit()
+    r = _get(client, tok, day, etag)
+    assert r.status_code == 200 and r.get_json()['morning'][0]['full_name'] == 'Admin Nowy'
+
+    etag = _get(client, tok, days).headers['ETag']
+    with app.app_context():
+        db.session.add(DayNote(note_date=date(2026, 3, 3), text='hej', author_id=uid))
+        db.session.commit()
+    r = _get(client, tok, days, etag)
+    assert r.status_code == 200 and r.get_json()['2026-03-03']['notes'][0]['text'] == 'hej'
+
+
+def test_per_user_etags_differ(app, client, register):
+    a = register('admin@example.com', 'Admin A')
+    b = register('b@example.com', 'Bob B')
+    url = '/api/my-shifts-brief?month=2026-03'
+    etag = _get(client, a, url).headers['ETag']
+    assert _get(client, b, url, etag).status_code == 200
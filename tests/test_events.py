@@ -0,0 +1,45 @@
+from datetime import date
+
+import server
+from conftest import auth
+from server import db, Shift, StreamEvent, User
+
+
+def _head(client, tok):
+    j = client.get('/api/events', headers=auth(tok)).get_json()
+    return j['event'], j['seq']
+
+
+def _events(client, tok, cursor):
+    return client.get('/api/events?event=%d&seq=%d' % cursor, headers=auth(tok)).get_json()
+
+
+def test_market_event_reaches_cursor(app, client, register):
+    tok = register('admin@example.com', 'Admin A')
+    other = register('b@example.com', 'Bob B')
+    with app.app_context():
+        sh = Shift(user_id=User.query.filter_by(email='admin@example.com').one().id,
+                   shift_date=date(2026, 3, 5), shift_code='1')
+        db.session.add(sh)
+        db.session.commit()
+        sid = sh.id
+    cursor = _head(client, other)
+    r = client.post(f'/api/market/offers/{sid}', headers=auth(tok))
+    assert r.status_code == 200, r.get_json()
+    j = _events(client, other, cursor)
+    assert [e for e in j['events'] if e['kind'] == 'market'] == \
+           [{'kind': 'market', 'data': {'id': r.get_json()['offer_id'], 'status': 'open'}}]
+    assert j['event'] > cursor[0]
+    assert _events(client, tok, (j['event'], j['seq']))['events'] == []
+
+
+def test_events_written_only_on_commit(app):
+    with app.app_context():
+        server._emit('note', {'date': '2026-03-05'}, everyone=True)
+        assert StreamEvent.query.count() == 0    # до commit в таблице ничего нет
+        db.session.rollback()
+        db.session.commit()
+        assert StreamEvent.query.count() == 0    # откаченное событие не всплывает позже
+        server._emit('note', {'date': '2026-03-06'}, everyone=True)
+        db.session.commit()
+        assert [e.payload for e in StreamEvent.query] == [{'date': '2026-03-06'}]
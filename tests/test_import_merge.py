@@ -0,0 +1,79 @@
+from conftest import auth
+from server import db, Shift, User
+
+CODES = (['1', '2', '-'] * 11)[:30]
+
+
+def _text(codes):
+    return 'Kowalski Jan ' + ' '.join(codes)
+
+
+def _upload(client, tok, codes, mode, **extra):
+    r = client.post('/api/upload-text', headers=auth(tok),
+                    json=dict(extra, text=_text(codes), year=2026, month=11, mode=mode))
+    assert r.status_code == 200, r.get_json()
+    return r.get_json()
+
+
+def _shifts(app):
+    with app.app_context():
+        return {s.shift_date.day: (s.shift_code, s.lounge, s.coord_lounge)
+                for s in Shift.query.join(User).filter(User.full_name == 'Kowalski Jan')}
+
+
+def _set_lounges(app, day, lounge, coord_lounge):
+    # как после /api/admin/lounge-from-xlsx или ручной правки
+    with app.app_context():
+        s = Shift.query.filter(db.func.extract('day', Shift.shift_date) == day).one()
+        s.lounge, s.coord_lounge = lounge, coord_lounge
+        db.session.commit()
+
+
+def test_text_merge_keeps_lounges_from_other_source(app, client, register):
+    tok = register('admin@example.com', 'Admin A')
+    _upload(client, tok, CODES, 'replace')
+    _set_lounges(app, 1, 'polonez', 'mazurek')
+    _set_lounges(app, 2, None, 'krakowiak')
+
+    changed = list(CODES)
+    changed[1] = '1'
+    _upload(client, tok, changed, 'merge')
+
+    shifts = _shifts(app)
+    assert shifts[1] == ('1', 'polonez', 'mazurek')
+    assert shifts[2] == ('1', None, 'krakowiak')
+
+
+def test_merge_without_changes_touches_nothing(app, client, register):
+    tok = register('admin@example.com', 'Admin A')
+    _upload(client, tok, CODES, 'replace')
+    _set_lounges(app, 1, 'polonez', 'mazurek')
+    before = _shifts(app)
+    _upload(client, tok, CODES, 'merge')
+    assert _shifts(app) == before
+
+
+def test_replace_takes_source_as_is(app, client, register):
+    tok = register('admin@example.com', 'Admin A')
+    _upload(client, tok, CODES, 'replace')
+    _set_lounges(app, 1, 'polonez', 'mazurek')
+    _upload(client, tok, CODES, 'replace')
+    assert _shifts(app)[1] == ('1', None, None)
+
+
+def test_replace_dry_run_matches_real_replace(app, client, register):
+    tok = register('admin@example.com', 'Admin A')
+    _upload(client, tok, CODES, 'replace')
+    _set_lounges(app, 1, 'polonez', 'mazurek')
+    _set_lounges(app, 2, None, 'krakowiak')
+    changed = list(CODES)
+    changed[3] = '2'
+
+    preview = _upload(client, tok, changed, 'replace', dry_run=1)
+    before = _shifts(app)
+    _upload(client, tok, changed, 'replace')
+    after = _shifts(app)
+
+    assert preview['diff'] == {'added': 0, 'removed': 0, 'unchanged': len(before) - 3,
+                               'changed': sum(before[d] != after[d] for d in before)}
+    assert preview['diff']['changed'] == 3
@@ -0,0 +1,85 @@
+"""
+Планы запросов, которые реально выполняют горячие эндпоинты: SQL перехватывается
+на движке во время запроса и прогоняется через EXPLAIN QUERY PLAN (SQLite).
+"""
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from conftest import auth
+from server import db, User
+
+ENDPOINT_INDEXES = [
+    ('/api/month-shifts?year=2026&month=3', 'shifts', ('ix_shifts_shift_date',)),
+    ('/api/month-shifts?year=2026&month=3', 'shift_changes', ('ix_shift_changes_date_seq',)),
+    ('/api/day-shifts?date=2026-03-02', 'shifts', ('ix_shifts_shift_date',)),
+    ('/api/my-shifts', 'shifts', ('uq_shifts_user_date', 'sqlite_autoindex_shifts')),
+    ('/api/proposals', 'swap_proposals', ('ix_swap_target_status',)),
+    ('/api/proposals', 'swap_proposals', ('ix_swap_requester_status',)),
+    ('/api/proposals', 'swap_proposals', ('ix_swap_status',)),
+    ('/api/proposals?box=outgoing&limit=5&cursor=10', 'swap_proposals', ('ix_swap_requester_status',)),
+    ('/api/market/offers', 'market_offers', ('ix_market_status_owner',)),
+    ('/api/admin/control?month=2026-03', 'control_events', ('ix_control_events_event_date',)),
+    ('/api/admin/control?month=2026-03', 'swap_proposals', ('ix_swap_status',)),
+    ('/api/admin/control?month=2026-03', 'shifts', ('ix_shifts_shift_date',)),
+]
+
+
+@contextmanager
+def _captured_selects(app):
+    with app.app_context():
+        engine = db.engine
+    statements = []
+
+    def grab(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', grab)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', grab)
+
+
+def _endpoint_plans(app, client, token, url):
+    """[строки плана] для каждого SELECT, выполненного эндпоинтом."""
+    with _captured_selects(app) as statements:
+        r = client.get(url, headers=auth(token))
+    assert r.status_code == 200, r.get_json()
+    with app.app_context():
+        raw = db.engine.raw_connection()
+        try:
+            cur = raw.cursor()
+            plans = []
+            for sql, params in statements:
+                cur.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                plans.append([row[-1] for row in cur.fetchall()])
+            return plans
+        finally:
+            raw.close()
+
+
+def _assert_uses(plans, table, indexes):
+    lines = [line for plan in plans for line in plan]
+    assert any(ix in line for line in lines for ix in indexes), lines
+    assert f'SCAN {table}' not in lines, lines   # полный проход таблицы (без индекса)
+
+
+@pytest.mark.parametrize('url,table,indexes', ENDPOINT_INDEXES)
+def test_endpoint_queries_use_indexes(app, client, register, url, table, indexes):
+    tok = register('admin@example.com', 'Admin A')
+    _assert_uses(_endpoint_plans(app, client, tok, url), table, indexes)
+
+
+def test_coord_report_uses_lounge_type_date_index(app, client, register):
+    register('admin@example.com', 'Admin A')
+    register('c@example.com', 'Coord C')
+    with app.app_context():
+        User.query.filter_by(email='c@example.com').one().role = 'coordinator'
+        db.session.commit()
+    tok = client.post('/api/login', json={'email': 'c@example.com', 'password': 'secret1'}).get_json()['access_token']
+    plans = _endpoint_plans(app, client, tok,
+                            '/api/coord-panel/report?lounge=mazurek&shift_type=morning&date=2026-03-02')
+    _assert_uses(plans, 'coord_shift_reports', ('ix_coord_reports_lounge_type_date',))
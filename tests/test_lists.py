@@ -0,0 +1,48 @@
+from datetime import date
+
+from conftest import auth
+from server import db, SwapProposal
+
+
+def _seed(app, n):
+    with app.app_context():
+        for i in range(n):
+            db.session.add(SwapProposal(requester_id=1, target_user_id=2, my_date=date(2026, 3, 1),
+                                        their_date=date(2026, 3, 2), status='pending'))
+        db.session.commit()
+        # строки из старой базы без created_at
+        db.session.execute(db.text("UPDATE swap_proposals SET created_at = NULL WHERE id % 4 = 0"))
+        db.session.commit()
+
+
+def test_without_limit_or_cursor_returns_everything(app, client, register):
+    tok = register('admin@example.com', 'Admin A')
+    register('b@example.com', 'Bob B')
+    _seed(app, 60)
+    j = client.get('/api/proposals', headers=auth(tok)).get_json()
+    assert len(j['outgoing']) == 60
+    assert j['next']['outgoing'] is None
+
+
+def test_cursor_walks_all_rows_including_null_created_at(app, client, register):
+    tok = register('admin@example.com', 'Admin A')
+    register('b@example.com', 'Bob B')
+    _seed(app, 23)
+    seen, cursor = [], None
+    url = '/api/proposals?box=outgoing&limit=5'
+    while True:
+        j = client.get(url + (f'&cursor={cursor}' if cursor else ''), headers=auth(tok)).get_json()
+        seen += [p['id'] for p in j['outgoing']]
+        cursor = j['next']['outgoing']
+        if not cursor:
+            break
+    assert seen == sorted(seen, reverse=True)
+    assert len(seen) == len(set(seen)) == 23
+
+
+def test_cursor_without_limit_uses_default_page(app, client, register):
+    tok = register('admin@example.com', 'Admin A')
+    register('b@example.com', 'Bob B')
+    _seed(app, 60)
+    j = client.get('/api/proposals?box=outgoing&cursor=999', headers=auth(tok)).get_json()
+    assert len(j['outgoing']) == 50
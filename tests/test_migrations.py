@@ -0,0 +1,56 @@
+import os
+import tempfile
+
+from sqlalchemy import create_engine, event, inspect
+
+import server
+from server import db
+
+
+def _fresh_engine():
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    os.remove(path)
+    return create_engine('sqlite:///' + path)
+
+
+def test_steps_run_on_the_migration_connection_only(app):
+    engine = _fresh_engine()
+    with app.app_context():
+        checkouts = []
+        listener = lambda *a: checkouts.append(1)
+        event.listen(db.engine, 'checkout', listener)
+        try:
+            with engine.connect() as conn:
+                for _, _, step in server.MIGRATIONS:
+                    step(conn)
+                    conn.commit()
+        finally:
+            event.remove(db.engine, 'checkout', listener)
+    # ни одного соединения из пула приложения: шагам хватает одного соединения
+    assert checkouts == []
+
+
+def test_fresh_database_matches_models(app):
+    engine = _fresh_engine()
+    with app.app_context(), engine.connect() as conn:
+        for _, _, step in server.MIGRATIONS:
+            step(conn)
+            conn.commit()
+    insp = inspect(engine)
+    migrated = {t for t in insp.get_table_names()}
+    expected = {t.name for t in db.metadata.sorted_tables} - {'schema_version'}
+    assert migrated == expected
+    for table in db.metadata.sorted_tables:
+        if table.name == 'schema_version':
+            continue
+        cols = {c['name'] for c in insp.get_columns(table.name)}
+        assert cols == set(table.columns.keys()), table.name
+        indexes = {i['name'] for i in insp.get_indexes(table.name)}
+        assert {i.name for i in table.indexes} <= indexes, table.name
+
+
+def test_migrate_is_idempotent(app):
+    with app.app_context():
+        assert server.migrate() == []
+        assert server.schema_version() == server.MIGRATIONS[-1][0]
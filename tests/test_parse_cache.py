@@ -0,0 +1,47 @@
+import pytest
+
+import server
+from pdf_sample import make_pdf
+from server import db, ImportJob
+
+
+@pytest.fixture
+def parse_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, 'PARSE_CACHE_MAX_MB', 64)
+    monkeypatch.setattr(server, 'PARSE_CACHE_DIR', str(tmp_path))
+    return tmp_path
+
+
+def test_cache_hit_returns_same_rows_and_full_progress(parse_cache):
+    data, _ = make_pdf(pages=2, rows=4)
+    first, second = [], []
+    rows = server._parse_cached('pdf', data, 2026, 11, progress=lambda d, t: first.append((d, t)))
+    assert first[-1] == (2, 2)
+    assert server._parse_cached('pdf', data, 2026, 11, progress=lambda d, t: second.append((d, t))) == rows
+    assert second == [(1, 1)]
+    assert len(list(parse_cache.iterdir())) == 1
+
+
+def test_job_progress_on_cache_hit(app, parse_cache, monkeypatch):
+    data, _ = make_pdf(pages=2, rows=4)
+    seen = []
+    job_update = server._job_update
+
+    def spy(job_id, **values):
+        if 'progress' in values:
+            seen.append(values['progress'])
+        job_update(job_id, **values)
+
+    monkeypatch.setattr(server, '_job_update', spy)
+    for _ in range(2):
+        seen.clear()
+        with app.app_context():
+            job = ImportJob(kind='pdf', status='queued', progress=0, year=2026, month=11,
+                            mode='replace', dry_run=True)
+            db.session.add(job)
+            db.session.commit()
+            job_id = job.id
+        server._run_import_job(job_id, 'pdf', data, 2026, 11, 'replace', True)
+        assert 65 in seen and seen[-1] == 100   # разбор отмечен целиком и при попадании в кэш
+        with app.app_context():
+            assert db.session.get(ImportJob, job_id).status == 'done'
@@ -0,0 +1,118 @@
+import io
+import os
+import random
+import time
+
+import pdfplumber
+import pytest
+
+import server
+from pdf_sample import make_pdf
+
+
+def _parsed(rows):
+    return {(r['name'], int(r['date'][-2:])): (r['shift'], r['lounge'], r['coord_lounge']) for r in rows}
+
+
+def test_sample_pdf_parsed_exactly():
+    data, expected = make_pdf()
+    assert _parsed(server._parse_schedule_pdf_advanced(data, 2026, 11)) == expected
+
+
+def test_page_pool_gives_same_rows_in_page_order():
+    data, _ = make_pdf(pages=3, rows=6)
+    pages = []
+    rows = server._parse_schedule_pdf_advanced(data, 2026, 11, workers=2,
+                                               progress=lambda done, total: pages.append(done))
+    assert rows == server._parse_schedule_pdf_advanced(data, 2026, 11, workers=1)
+    assert pages == [0, 1, 2, 3]
+
+
+def test_char_index_matches_linear_scan_on_pdf_pages():
+    data, _ = make_pdf(pages=1, rows=20)
+    with pdfplumber.open(io.BytesIO(data)) as pdf:
+        page = pdf.pages[0]
+        chars = page.chars
+        index = server._CharIndex(chars)
+        rnd = random.Random(1)
+        for _ in range(2000):
+            x, y = rnd.uniform(0, page.width), rnd.uniform(0, page.height)
+            bbox = (x, y, x + rnd.uniform(1, 40), y + rnd.uniform(1, 30))
+            assert [id(c) for c in server._cell_chars(index, bbox)] == \
+                   [id(c) for c in server._cell_chars(chars, bbox)]
+
+
+def test_fill_index_skips_grid_borders_and_white_background():
+    rnd = random.Random(2)
+    rows, days, cw, rh, x0, y0 = 30, 31, 20.0, 14.0, 130.0, 60.0
+    rects, truth = [], {}
+
+    def rect(ax, ay, bx, by, color, fill=True):
+        rects.append({'x0': ax, 'top': ay, 'x1': bx, 'bottom': by, 'non_stroking_color': color, 'fill': fill})
+
+    for r in range(rows):
+        for d in range(days):
+            rect(x0 + d * cw, y0 + r * rh, x0 + (d + 1) * cw, y0 + (r + 1) * rh, (1, 1, 1))
+    for r in range(rows + 1):
+        rect(0, y0 + r * rh - 0.25, x0 + days * cw, y0 + r * rh + 0.25, 0)
+    for r in range(rows):
+        for d in range(days):
+            if rnd.random() < 0.1:
+                color = rnd.choice([(0.3, 0.6, 1.0), (1.0, 0.95, 0.2)])
+                rect(x0 + d * cw + 0.5, y0 + r * rh + 0.5, x0 + (d + 1) * cw - 0.5, y0 + (r + 1) * rh - 0.5, color)
+                truth[(r, d)] = server._norm_rgb(color)
+    for _ in range(300):
+        x, y = rnd.uniform(0, 700), rnd.uniform(0, 500)
+        rect(x, y, x + 30, y + 20, (0.2, 0.2, 0.2), fill=False)
+
+    index = server._FillIndex(rects)
+    for r in range(rows):
+        for d in range(days):
+            # ячейка парсера чуть выше строки (±1pt) — задевает заливки соседей
+            bbox = (x0 + d * cw, y0 + r * rh - 1, x0 + (d + 1) * cw, y0 + (r + 1) * rh + 1)
+            assert server._cell_fill_color(index, bbox) == truth.get((r, d))
+            if r == 0:   # сырые rects — тот же результат (индекс строится на каждый вызов)
+                assert server._cell_fill_color(rects, bbox) == truth.get((r, d))
+
+
+@pytest.mark.skipif(os.getenv('PDF_BENCH') != '1', reason='бенчмарк: PDF_BENCH=1 pytest -s -k benchmark')
+def test_char_index_benchmark_full_month_page():
+    """
+    Страница полного месяца: 100 строк × 31 день = 3100 ячеек, ~10k символов
+    (имена, 1–3 символа в ячейке, шум). Индекс обязан отдать те же символы, что и линейный проход.
+    """
+    rnd = random.Random(1)
+    rows, days, cw, rh, x0, y0 = 100, 31, 20.0, 14.0, 130.0, 60.0
+    chars = []
+
+    def ch(x, y, text='1', w=5.0, h=9.0):
+        chars.append({'x0': x, 'x1': x + w, 'top': y, 'bottom': y + h, 'text': text,
+                      'non_stroking_color': (0, 0, 1)})
+
+    for r in range(rows):
+        y = y0 + r * rh + 2
+        for k in range(20):
+            ch(10 + k * 5.5, y, 'a')
+        for d in range(days):
+            for k in range(rnd.choice((1, 1, 3))):
+                ch(x0 + d * cw + 4 + k * 5, y)
+    while len(chars) < 10000:
+        ch(rnd.uniform(0, 800), rnd.uniform(0, 1600), '.', w=2, h=2)
+    cells = [(x0 + d * cw, y0 + r * rh - 1, x0 + (d + 1) * cw, y0 + (r + 1) * rh + 1)
+             for r in range(rows) for d in range(days)]
+
+    t = time.perf_counter()
+    linear = [server._cell_chars(chars, bbox) for bbox in cells]
+    t_linear = time.perf_counter() - t
+    t = time.perf_counter()
+    index = server._CharIndex(chars)
+    t_build = time.perf_counter() - t
+    indexed = [server._cell_chars(index, bbox) for bbox in cells]
+    t_index = time.perf_counter() - t
+
+    assert [[id(c) for c in a] for a in indexed] == [[id(c) for c in b] for b in linear]
+    print(f'\n{len(cells)} cells, {len(chars)} chars/page\n'
+          f'linear scan: {t_linear * 1000:8.1f} ms/page\n'
+          f'grid index : {t_index * 1000:8.1f} ms/page (build {t_build * 1000:.1f})\n'
+          f'speedup    : {t_linear / t_index:.0f}x')
+    assert t_index < t_linear
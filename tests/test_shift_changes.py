@@ -0,0 +1,91 @@
+from datetime import date
+
+from conftest import auth
+from server import db, Shift
+
+
+def _seed(client, tok):
+    codes = ' '.join((['1', '2', '-'] * 11)[:30])
+    r = client.post('/api/upload-text', headers=auth(tok),
+                    json={'text': 'Kowalski Jan ' + codes, 'year': 2026, 'month': 11})
+    assert r.status_code == 200, r.get_json()
+
+
+def _month(client, tok, month, fmt='full'):
+    r = client.get(f'/api/month-shifts?year=2026&month={month}&format={fmt}', headers=auth(tok))
+    assert r.status_code == 200
+    return r
+
+
+def _ids(doc):
+    return {it['id'] for slots in doc.values() for items in slots.values() for it in items}
+
+
+def _changes(client, tok, since):
+    return client.get(f'/api/shifts/changes?since={since}', headers=auth(tok)).get_json()
+
+
+def _shift_on(app, day):
+    with app.app_context():
+        return Shift.query.filter_by(shift_date=day).one().id
+
+
+def _edit(app, sid, **values):
+    with app.app_context():
+        s = db.session.get(Shift, sid)
+        for k, v in values.items():
+            setattr(s, k, v)
+        db.session.commit()
+
+
+def test_month_seq_matches_header_and_journal_head(client, register):
+    tok = register('admin@example.com', 'Admin A')
+    _seed(client, tok)
+    r = _month(client, tok, 11, 'compact')
+    head = _changes(client, tok, '')['seq']
+    assert r.get_json()['seq'] == int(r.headers['X-Shift-Seq']) == head > 0
+    assert int(_month(client, tok, 11).headers['X-Shift-Seq']) == head
+
+
+def test_delta_from_month_seq_carries_edit(app, client, register):
+    tok = register('admin@example.com', 'Admin A')
+    _seed(client, tok)
+    seq = int(_month(client, tok, 11).headers['X-Shift-Seq'])
+    sid = _shift_on(app, date(2026, 11, 1))
+    _edit(app, sid, shift_code='2')
+
+    j = _changes(client, tok, seq)
+    assert not j['reset'] and j['seq'] > seq
+    [ch] = j['changes']
+    assert (ch['op'], ch['id'], ch['slot'], ch['item']['shift_code']) == ('upsert', sid, 'evening', '2')
+    assert _changes(client, tok, j['seq'])['changes'] == []
+
+
+def test_move_to_other_month_drops_shift_from_cached_month(app, client, register):
+    tok = register('admin@example.com', 'Admin A')
+    _seed(client, tok)
+    sid = _shift_on(app, date(2026, 11, 1))
+    r = _month(client, tok, 11)
+    assert sid in _ids(r.get_json())
+    seq = int(r.headers['X-Shift-Seq'])
+
+    _edit(app, sid, shift_date=date(2026, 12, 5))
+
+    assert sid not in _ids(_month(client, tok, 11).get_json())
+    assert sid in _ids(_month(client, tok, 12).get_json())
+    [ch] = _changes(client, tok, seq)['changes']
+    assert (ch['op'], ch['id'], ch['date']) == ('upsert', sid, '2026-12-05')
+
+
+def test_delete_reaches_delta(app, client, register):
+    tok = register('admin@example.com', 'Admin A')
+    _seed(client, tok)
+    seq = int(_month(client, tok, 11).headers['X-Shift-Seq'])
+    sid = _shift_on(app, date(2026, 11, 2))
+    with app.app_context():
+        db.session.delete(db.session.get(Shift, sid))
+        db.session.commit()
+
+    [ch] = _changes(client, tok, seq)['changes']
+    assert (ch['op'], ch['id'], ch['date']) == ('delete', sid, '2026-11-02')
+    assert sid not in _ids(_month(client, tok, 11).get_json())
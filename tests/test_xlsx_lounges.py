@@ -0,0 +1,42 @@
+import io
+from datetime import date
+
+import pytest
+
+import server
+
+openpyxl = pytest.importorskip('openpyxl')
+BLUE = openpyxl.styles.PatternFill('solid', fgColor='FF3366FF')
+YELLOW = openpyxl.styles.PatternFill('solid', fgColor='FFFFEE33')
+
+
+def _xlsx(rows, start_row=1):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    for i, row in enumerate(rows):
+        for j, (value, fill) in enumerate(row, 1):
+            cell = ws.cell(row=start_row + i, column=j, value=value)
+            if fill:
+                cell.fill = fill
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+
+SHEET = [
+    [('Imię', None)] + [(d, None) for d in range(1, 31)],
+    [('Kowalski Jan', None), ('1', BLUE), (2, YELLOW), (None, BLUE), ('X', YELLOW)],
+    [('Nowak Anna', None), ('2', None), ('1', BLUE)],
+]
+
+
+def test_header_on_first_row():
+    got = list(server._xlsx_iter_colored_office_cells(_xlsx(SHEET), 2026, 11))
+    assert got == [('Kowalski Jan', date(2026, 11, 1), 'mazurek'),
+                   ('Kowalski Jan', date(2026, 11, 2), 'polonez'),
+                   ('Nowak Anna', date(2026, 11, 2), 'mazurek')]
+
+
+def test_empty_first_row_means_no_header():
+    # строки 1 в XML нет вовсе: строка 2 с днями — не шапка
+    assert list(server._xlsx_iter_colored_office_cells(_xlsx(SHEET, start_row=2), 2026, 11)) == []